@@ -0,0 +1 @@
+from .bench import SCENARIOS, compare, run_scenario  # noqa: F401
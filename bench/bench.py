@@ -0,0 +1,441 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import pathlib
+import platform
+import resource
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+from consumer import init_app
+from consumer.backends import EventFilter, backend_key
+from propagator import EventPropagator
+
+logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+# Distinct events written to the events file of a run.
+EVENT_COUNT = 1000
+# Number of event types the events are spread over.
+EVENT_TYPES = 8
+# Target rate of a propagator with no ``rate`` set, high enough to only be
+# limited by ``max_in_flight``.
+UNTHROTTLED = 1e9
+# Seconds to wait for the consumer process to start or report back.
+STARTUP_TIMEOUT = 30.0
+SHUTDOWN_TIMEOUT = 60.0
+# Relative change of a metric reported as a regression.
+DEFAULT_TOLERANCE = 0.2
+
+DEFAULT_BASELINE = pathlib.Path(__file__).with_name("baseline.json")
+
+# Parameters of a scenario, overridden per scenario.
+DEFAULTS = {
+    "batch_size": 100,
+    "batch_latency_ms": 5,
+    "concurrency": 4,
+    "propagators": 1,
+    "payload_size": 64,
+    "rate": None,
+    "propagator": {},
+    "consumer": {},
+}
+
+SCENARIOS = {
+    "default": {},
+    "batch-1": {"batch_size": 1},
+    "batch-1000": {"batch_size": 1000},
+    "concurrency-1": {"concurrency": 1},
+    "concurrency-16": {"concurrency": 16},
+    "propagators-4": {"propagators": 4},
+    "payload-4k": {"payload_size": 4096},
+    "fire-and-forget": {"consumer": {"ack_mode": "fire_and_forget"}},
+    "no-group-commit": {"consumer": {"commit_interval_ms": 0}},
+    "shards-4": {"consumer": {"shards": 4}},
+}
+
+HIGHER_IS_BETTER = 1
+LOWER_IS_BETTER = -1
+# Result fields compared against the baseline.
+CHECKS = {
+    "events_per_sec": HIGHER_IS_BETTER,
+    "latency_p99_ms": LOWER_IS_BETTER,
+    "consumer_cpu_us_per_event": LOWER_IS_BETTER,
+    "consumer_max_rss_bytes": LOWER_IS_BETTER,
+}
+
+
+def free_port():
+    """
+    Find a free TCP port on the benchmark host.
+
+    :return: The port number.
+    """
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def max_rss_bytes(usage):
+    """
+    Peak resident set size of a process.
+
+    :param usage: A ``resource.getrusage`` result.
+    :return: The peak RSS in bytes.
+    """
+    # Linux reports kilobytes, macOS bytes.
+    if sys.platform == "darwin":
+        return usage.ru_maxrss
+    return usage.ru_maxrss * 1024
+
+
+def cpu_seconds(before, after):
+    """
+    CPU time used between two ``resource.getrusage`` results.
+
+    :param before: The earlier usage.
+    :param after: The later usage.
+    :return: User and system time in seconds.
+    """
+    return (after.ru_utime - before.ru_utime) + (
+        after.ru_stime - before.ru_stime
+    )
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of values.
+
+    :param values: The values, in any order.
+    :param fraction: The percentile as a fraction, e.g. ``0.99``.
+    :return: The percentile, or ``None`` for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def write_events_file(path, payload_size):
+    """
+    Write the events file replayed by the propagators.
+
+    :param path: Path of the file.
+    :param payload_size: Size of every event payload in characters.
+    """
+    events = [
+        {
+            "event_type": f"type{i % EVENT_TYPES}",
+            "event_payload": f"{i:08d}".ljust(payload_size, "x"),
+        }
+        for i in range(EVENT_COUNT)
+    ]
+    path.write_text(json.dumps(events))
+
+
+def run_consumer(options, port, ready, results):
+    """
+    Serve the consumer in a benchmark process until SIGTERM.
+
+    Reports the number of stored events and the CPU and memory used while
+    serving through ``results``.
+
+    :param options: Options passed to ``consumer.init_app``.
+    :param port: Port to listen on.
+    :param ready: Event set once the consumer accepts connections.
+    :param results: Queue receiving the report.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def serve():
+        app = await init_app(**options)
+        runner = web.AppRunner(app, auto_decompress=False, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, HOST, port).start()
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        ready.set()
+        await stop.wait()
+        backend = app[backend_key]
+        await backend.stop()
+        counts = await backend.count_events(EventFilter())
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        await runner.cleanup()
+        results.put(
+            {
+                "stored": sum(counts.values()),
+                "cpu_seconds": cpu_seconds(before, after),
+                "max_rss_bytes": max_rss_bytes(after),
+            }
+        )
+
+    asyncio.run(serve())
+
+
+class TimedPropagator(EventPropagator):
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the TimedPropagator.
+
+        An EventPropagator that records the latency of every request.
+        """
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    async def send_batch(self, events, attempt=0):
+        started = time.perf_counter()
+        await super().send_batch(events, attempt)
+        self.latencies.append(time.perf_counter() - started)
+
+
+async def run_scenario(name, overrides, duration, workdir):
+    """
+    Run one benchmark scenario.
+
+    The consumer runs in its own process so its CPU and memory use are
+    measured apart from the propagators, which run in this process.
+
+    :param name: Name of the scenario.
+    :param overrides: Parameters that differ from ``DEFAULTS``.
+    :param duration: Seconds the propagators send events.
+    :param workdir: Directory for the events file and the database.
+    :return: A dictionary of the results.
+    :raises RuntimeError: If the consumer process fails.
+    """
+    params = {**DEFAULTS, **overrides}
+    events_file = workdir / f"{name}.json"
+    write_events_file(events_file, params["payload_size"])
+    port = free_port()
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    results = context.Queue()
+    process = context.Process(
+        target=run_consumer,
+        args=(
+            {"db_path": str(workdir / f"{name}.db"), **params["consumer"]},
+            port,
+            ready,
+            results,
+        ),
+        name=f"bench-consumer-{name}",
+        daemon=True,
+    )
+    process.start()
+    try:
+        if not await asyncio.to_thread(ready.wait, STARTUP_TIMEOUT):
+            raise RuntimeError(f"Consumer for {name} did not start")
+
+        concurrency = params["concurrency"]
+        propagators = [
+            TimedPropagator(
+                events_file=str(events_file),
+                endpoint=f"http://{HOST}:{port}/event",
+                period=1,
+                rate=params["rate"] or UNTHROTTLED,
+                workers=concurrency,
+                max_in_flight=concurrency * params["batch_size"],
+                max_connections=max(10, concurrency),
+                max_keepalive_connections=max(10, concurrency),
+                max_batch_size=params["batch_size"],
+                max_batch_latency_ms=params["batch_latency_ms"],
+                **params["propagator"],
+            )
+            for _ in range(params["propagators"])
+        ]
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(p.run()) for p in propagators]
+        await asyncio.sleep(duration)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        after = resource.getrusage(resource.RUSAGE_SELF)
+
+        process.terminate()
+        consumer = await asyncio.to_thread(results.get, True, SHUTDOWN_TIMEOUT)
+        await asyncio.to_thread(process.join, SHUTDOWN_TIMEOUT)
+    finally:
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    sent = sum(p.stats.sent_events for p in propagators)
+    latencies = [latency for p in propagators for latency in p.latencies]
+    propagator_cpu = cpu_seconds(before, after)
+    return {
+        "params": params,
+        "elapsed_seconds": round(elapsed, 3),
+        "events_sent": sent,
+        "events_stored": consumer["stored"],
+        "events_per_sec": round(sent / elapsed, 1),
+        "requests": len(latencies),
+        "latency_p50_ms": millis(percentile(latencies, 0.5)),
+        "latency_p99_ms": millis(percentile(latencies, 0.99)),
+        "consumer_cpu_seconds": round(consumer["cpu_seconds"], 3),
+        "consumer_cpu_percent": round(
+            100 * consumer["cpu_seconds"] / elapsed, 1
+        ),
+        "consumer_cpu_us_per_event": (
+            round(1e6 * consumer["cpu_seconds"] / sent, 2) if sent else None
+        ),
+        "consumer_max_rss_bytes": consumer["max_rss_bytes"],
+        "propagator_cpu_seconds": round(propagator_cpu, 3),
+        "propagator_cpu_percent": round(100 * propagator_cpu / elapsed, 1),
+        "propagator_max_rss_bytes": max_rss_bytes(after),
+    }
+
+
+def millis(seconds):
+    """
+    Convert a latency to milliseconds.
+
+    :param seconds: The latency in seconds, or ``None``.
+    :return: The latency in milliseconds, or ``None``.
+    """
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Find the results that regressed against a baseline.
+
+    Only scenarios present in both runs are compared.
+
+    :param results: Scenario names mapped to their results.
+    :param baseline: Scenario names mapped to their baseline results.
+    :param tolerance: Relative change tolerated before a metric is flagged.
+    :return: A list of regression descriptions.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for field, direction in CHECKS.items():
+            value, expected = result.get(field), reference.get(field)
+            if not value or not expected:
+                continue
+            change = (value - expected) / expected
+            if change * direction < -tolerance:
+                regressions.append(
+                    f"{name}: {field} {expected} -> {value} ({change:+.0%})"
+                )
+    return regressions
+
+
+async def run_benchmarks(scenarios, duration):
+    """
+    Run scenarios one after the other.
+
+    :param scenarios: Scenario names mapped to their parameter overrides.
+    :param duration: Seconds each scenario sends events.
+    :return: Scenario names mapped to their results.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, overrides in scenarios.items():
+            logger.warning(f"Running scenario {name}")
+            results[name] = await run_scenario(
+                name, overrides, duration, pathlib.Path(directory)
+            )
+            logger.warning(
+                f"{name}: {results[name]['events_per_sec']} events/s, "
+                f"p99 {results[name]['latency_p99_ms']} ms"
+            )
+    return results
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+
+    :param argv: Command line arguments, defaulting to ``sys.argv``.
+    :return: The exit status, 1 if a regression was found.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the propagator and consumer end to end."
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="Seconds each scenario sends events.",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="Scenario to run; may be repeated. Defaults to all.",
+    )
+    parser.add_argument(
+        "--scenarios-file",
+        help="JSON object of extra scenarios, mapping names to parameters.",
+    )
+    parser.add_argument(
+        "--output", help="Write the results to this file as well."
+    )
+    parser.add_argument(
+        "--baseline",
+        default=str(DEFAULT_BASELINE),
+        help="Baseline results to compare against.",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Relative change flagged as a regression.",
+    )
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    scenarios = dict(SCENARIOS)
+    if args.scenarios_file:
+        scenarios.update(
+            json.loads(pathlib.Path(args.scenarios_file).read_text())
+        )
+    if args.scenario:
+        unknown = set(args.scenario) - set(scenarios)
+        if unknown:
+            parser.error(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+        scenarios = {name: scenarios[name] for name in args.scenario}
+
+    results = asyncio.run(run_benchmarks(scenarios, args.duration))
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "duration": args.duration,
+        "scenarios": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        pathlib.Path(args.output).write_text(text + "\n")
+
+    baseline_path = pathlib.Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(text + "\n")
+        logger.warning(f"Saved baseline to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        logger.warning(f"No baseline at {baseline_path}, nothing compared")
+        return 0
+    baseline = json.loads(baseline_path.read_text())["scenarios"]
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        logger.error(f"Regression: {regression}")
+    return 1 if regressions else 0
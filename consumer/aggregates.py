@@ -0,0 +1,502 @@
+import array
+import asyncio
+import collections
+import contextlib
+import hashlib
+import logging
+import math
+import time
+
+import aiosqlite
+from aiohttp import web
+
+from runtime import codec
+
+logger = logging.getLogger(__name__)
+
+# Name, slot length in seconds and slots per window. Each ring holds two
+# windows, so the last complete tumbling window is kept next to the
+# sliding one.
+WINDOWS = (("1s", 0.1, 10), ("1m", 1.0, 60), ("1h", 60.0, 60))
+HLL_PRECISION = 12
+CHECKPOINT_TABLE = "event_aggregates"
+MAX_TRACKED_TYPES = 1000
+
+
+class WindowCounter:
+    def __init__(self, resolution, slots):
+        """
+        Initialize the WindowCounter.
+
+        A ring buffer of per-slot counts, each stamped with the absolute
+        slot number it counts, so stale slots are skipped without a sweep.
+
+        :param resolution: Length of a slot in seconds.
+        :param slots: Number of slots in a window.
+        """
+        self.resolution = resolution
+        self.slots = slots
+        self.counts = array.array("Q", bytes(16 * slots))
+        self.stamps = array.array("q", [-1]) * (2 * slots)
+
+    def add(self, timestamp, count=1):
+        """
+        Count events at a time.
+
+        :param timestamp: Unix time of the events.
+        :param count: Number of events.
+        """
+        slot = int(timestamp // self.resolution)
+        i = slot % len(self.stamps)
+        if self.stamps[i] != slot:
+            self.stamps[i] = slot
+            self.counts[i] = 0
+        self.counts[i] += count
+
+    def total(self, first, last):
+        """
+        Sum of the slots in a range.
+
+        :param first: First absolute slot number.
+        :param last: Last absolute slot number, inclusive.
+        :return: The number of events.
+        """
+        return sum(
+            count
+            for count, stamp in zip(self.counts, self.stamps)
+            if first <= stamp <= last
+        )
+
+    def sliding(self, now):
+        """
+        Events in the window ending now.
+
+        :param now: The current Unix time.
+        :return: The number of events.
+        """
+        current = int(now // self.resolution)
+        return self.total(current - self.slots + 1, current)
+
+    def previous(self, now):
+        """
+        Events in the last complete window aligned to the epoch.
+
+        :param now: The current Unix time.
+        :return: The number of events.
+        """
+        start = (int(now // self.resolution) // self.slots - 1) * self.slots
+        return self.total(start, start + self.slots - 1)
+
+    def merge(self, other):
+        """
+        Add the counts of another counter with the same layout.
+
+        :param other: The WindowCounter to add.
+        """
+        for i, stamp in enumerate(other.stamps):
+            if stamp > self.stamps[i]:
+                self.stamps[i] = stamp
+                self.counts[i] = other.counts[i]
+            elif stamp == self.stamps[i] and stamp >= 0:
+                self.counts[i] += other.counts[i]
+
+    def to_bytes(self):
+        """
+        Serialize the counts and their stamps.
+
+        :return: The bytes.
+        """
+        return self.counts.tobytes() + self.stamps.tobytes()
+
+    def load(self, data):
+        """
+        Restore the counts saved by ``to_bytes``.
+
+        :param data: The saved bytes.
+        """
+        size = len(self.counts.tobytes())
+        self.counts = array.array("Q", data[:size])
+        self.stamps = array.array("q", data[size:])
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        """
+        Initialize the HyperLogLog.
+
+        Estimates the number of distinct strings added in ``2**precision``
+        bytes, with a standard error of about ``1.04 / sqrt(2**precision)``.
+
+        :param precision: Number of hash bits selecting a register.
+        """
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """
+        Add a string.
+
+        :param value: The string.
+        """
+        digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        """
+        Estimate the number of distinct strings added.
+
+        :return: The estimate.
+        """
+        m = len(self.registers)
+        estimate = (
+            0.7213
+            / (1 + 1.079 / m)
+            * m
+            * m
+            / sum(2.0**-rank for rank in self.registers)
+        )
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def merge(self, other):
+        """
+        Add the strings of another HyperLogLog with the same precision.
+
+        :param other: The HyperLogLog to add.
+        """
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class TypeAggregate:
+    def __init__(self):
+        """
+        Initialize the TypeAggregate.
+
+        Running total, window counters and distinct payload estimate of one
+        event type.
+        """
+        self.total = 0
+        self.windows = [
+            WindowCounter(resolution, slots) for _, resolution, slots in WINDOWS
+        ]
+        self.payloads = HyperLogLog()
+
+    def add(self, timestamp, count, payloads):
+        """
+        Count events of this type.
+
+        :param timestamp: Unix time of the events.
+        :param count: Number of events.
+        :param payloads: Distinct payloads of the events.
+        """
+        self.total += count
+        for window in self.windows:
+            window.add(timestamp, count)
+        for payload in payloads:
+            self.payloads.add(payload)
+
+    def merge(self, other):
+        """
+        Add another aggregate of the same type.
+
+        :param other: The TypeAggregate to add.
+        """
+        self.total += other.total
+        for window, other_window in zip(self.windows, other.windows):
+            window.merge(other_window)
+        self.payloads.merge(other.payloads)
+
+    def summary(self, now):
+        """
+        Current values of the aggregate.
+
+        :param now: The current Unix time.
+        :return: A dictionary of the total, the distinct payload estimate
+            and the count, rate and previous tumbling count of each window.
+        """
+        windows = {}
+        for (name, resolution, slots), window in zip(WINDOWS, self.windows):
+            count = window.sliding(now)
+            windows[name] = {
+                "count": count,
+                "rate": count / (resolution * slots),
+                "previous": window.previous(now),
+            }
+        return {
+            "total": self.total,
+            "distinct_payloads": self.payloads.count(),
+            "windows": windows,
+        }
+
+    def to_row(self, event_type, now):
+        """
+        Serialize the aggregate for a checkpoint.
+
+        :param event_type: The event type.
+        :param now: The current Unix time.
+        :return: A checkpoint table row.
+        """
+        windows = b"".join(window.to_bytes() for window in self.windows)
+        return (
+            event_type,
+            self.total,
+            bytes(self.payloads.registers),
+            windows,
+            now,
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Restore an aggregate from a checkpoint row.
+
+        :param row: A ``(total, payloads, windows)`` row.
+        :return: The TypeAggregate, or ``None`` if the row was saved with
+            other windows or another precision.
+        """
+        aggregate = cls()
+        total, registers, windows = row
+        sizes = [len(window.to_bytes()) for window in aggregate.windows]
+        if len(windows) != sum(sizes) or len(registers) != len(
+            aggregate.payloads.registers
+        ):
+            return None
+        aggregate.total = total
+        aggregate.payloads.registers = bytearray(registers)
+        offset = 0
+        for window, size in zip(aggregate.windows, sizes):
+            window.load(windows[offset : offset + size])
+            offset += size
+        return aggregate
+
+
+class Aggregator:
+    def __init__(self, backend, max_types=MAX_TRACKED_TYPES, clock=None):
+        """
+        Initialize the Aggregator.
+
+        Keeps per event type counters of the events committed by this
+        process, fed by the writers' commit listeners, so dashboards read a
+        few ring buffers instead of scanning ``received_events``. The
+        counters are checkpointed to the first shard this process writes;
+        shards written by other worker processes contribute their latest
+        checkpoint to queries.
+
+        :param backend: The StorageBackend to aggregate.
+        :param max_types: Maximum number of event types tracked. Events of
+            further types are only counted as untracked.
+        :param clock: Wall clock function, for testing.
+        """
+        self.backend = backend
+        self.max_types = max_types
+        self.clock = clock or time.time
+        self.types = {}
+        self.untracked_events = 0
+        shards = backend.shard_backends()
+        self.writable = [shard for shard in shards if not shard.read_only]
+        self.read_only = [shard for shard in shards if shard.read_only]
+
+    def start(self):
+        """
+        Start counting the commits of this process.
+        """
+        for shard in self.writable:
+            shard.add_commit_listener(self.record)
+
+    def record(self, rows):
+        """
+        Count committed events.
+
+        :param rows: ``(id, event_type, event_payload, received_at)`` rows
+            of one commit, which share their ``received_at`` time.
+        """
+        if not rows:
+            return
+        timestamp = rows[0][3]
+        payloads = collections.defaultdict(set)
+        for row in rows:
+            payloads[row[1]].add(row[2])
+        counts = collections.Counter(row[1] for row in rows)
+        for event_type, count in counts.items():
+            aggregate = self.types.get(event_type)
+            if aggregate is None:
+                if len(self.types) >= self.max_types:
+                    self.untracked_events += count
+                    continue
+                aggregate = self.types[event_type] = TypeAggregate()
+            aggregate.add(timestamp, count, payloads[event_type])
+
+    async def load(self):
+        """
+        Create the checkpoint table and restore the last checkpoint.
+        """
+        if not self.writable:
+            return
+        db = self.writable[0].db
+        await db.execute(
+            f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} ("
+            "event_type TEXT PRIMARY KEY, total INTEGER NOT NULL, "
+            "payloads BLOB NOT NULL, windows BLOB NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        await db.commit()
+        self.types = await read_checkpoint(db)
+        if self.types:
+            logger.info(f"Restored aggregates of {len(self.types)} type(s)")
+
+    async def checkpoint(self):
+        """
+        Save the counters to the first shard this process writes.
+        """
+        if not self.writable or not self.types:
+            return
+        shard = self.writable[0]
+        now = self.clock()
+        rows = [
+            aggregate.to_row(event_type, now)
+            for event_type, aggregate in self.types.items()
+        ]
+        # The checkpoint shares the writer connection.
+        async with shard.writer.lock:
+            await shard.db.executemany(
+                f"INSERT OR REPLACE INTO {CHECKPOINT_TABLE} "
+                "(event_type, total, payloads, windows, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            await shard.db.commit()
+
+    async def summary(self, event_type=None):
+        """
+        Current aggregates, merged with the checkpoints of other workers.
+
+        :param event_type: Only report this event type.
+        :return: A dictionary of aggregate summaries by event type.
+        """
+        merged = {}
+        parts = [self.types]
+        for shard in self.read_only:
+            async with shard.read_pool.acquire() as db:
+                parts.append(await read_checkpoint(db))
+        for part in parts:
+            for name, aggregate in part.items():
+                if event_type is not None and name != event_type:
+                    continue
+                if name not in merged:
+                    merged[name] = TypeAggregate()
+                merged[name].merge(aggregate)
+        now = self.clock()
+        return {
+            name: aggregate.summary(now)
+            for name, aggregate in sorted(merged.items())
+        }
+
+
+async def read_checkpoint(db):
+    """
+    Read the aggregates saved in a database.
+
+    :param db: A connection to the database.
+    :return: A dictionary of TypeAggregate objects by event type.
+    """
+    try:
+        rows = await db.execute_fetchall(
+            "SELECT event_type, total, payloads, windows "
+            f"FROM {CHECKPOINT_TABLE}"
+        )
+    except aiosqlite.OperationalError:
+        # No checkpoint was written to this database yet.
+        return {}
+    aggregates = {}
+    for row in rows:
+        aggregate = TypeAggregate.from_row(row[1:])
+        if aggregate is not None:
+            aggregates[row[0]] = aggregate
+    return aggregates
+
+
+aggregator_key = web.AppKey("aggregator", Aggregator)
+
+
+async def handle_aggregates(request):
+    """
+    Return the windowed counts of each event type.
+
+    :param request: The incoming request object.
+    :return: A JSON response with the aggregates by event type and the
+        number of events of untracked types.
+    """
+    aggregator = request.app[aggregator_key]
+    try:
+        summary = await aggregator.summary(request.query.get("event_type"))
+    except aiosqlite.DatabaseError as db_err:
+        logger.error(f"Database error: {db_err}")
+        return web.json_response(
+            {"error": "Database operation failed"},
+            status=500,
+            dumps=codec.dumps,
+        )
+    return web.json_response(
+        {
+            "event_types": summary,
+            "untracked_events": aggregator.untracked_events,
+        },
+        dumps=codec.dumps,
+    )
+
+
+async def run_checkpoints(aggregator, interval):
+    """
+    Periodically checkpoint the aggregates.
+
+    :param aggregator: The Aggregator to save.
+    :param interval: Seconds between checkpoints.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await aggregator.checkpoint()
+        except aiosqlite.Error as e:
+            logger.error(f"Aggregate checkpoint failed: {e}")
+
+
+def aggregates_context(interval):
+    """
+    Build a cleanup context restoring the aggregates and checkpointing them
+    in the background.
+
+    :param interval: Seconds between checkpoints.
+    :return: The cleanup context for ``app.cleanup_ctx``.
+    """
+
+    async def context(app):
+        aggregator = app[aggregator_key]
+        await aggregator.load()
+        aggregator.start()
+        task = asyncio.create_task(run_checkpoints(aggregator, interval))
+        yield
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    return context
+
+
+def setup_aggregates(app, aggregator, checkpoint_interval):
+    """
+    Register the aggregation stage and its endpoint on the application.
+
+    :param app: The web application.
+    :param aggregator: The Aggregator of the application.
+    :param checkpoint_interval: Seconds between checkpoints.
+    """
+    app[aggregator_key] = aggregator
+    app.cleanup_ctx.append(aggregates_context(checkpoint_interval))
+    app.router.add_get("/events/aggregates", handle_aggregates)
@@ -0,0 +1,777 @@
+import abc
+import asyncio
+import bisect
+import collections
+import contextlib
+import heapq
+import itertools
+import logging
+import operator
+import os
+import pathlib
+import re
+import zlib
+
+import aiosqlite
+from aiohttp import web
+
+from .storage import (
+    ENCODING_NONE,
+    SEQUENCE_TABLE,
+    WINDOW_DAY,
+    PartitionedStorage,
+)
+from .writer import EventWriter
+
+logger = logging.getLogger(__name__)
+
+SHARD_BY_EVENT_TYPE = "event_type"
+SHARD_BY_ROUND_ROBIN = "round_robin"
+SHARD_BY_MODES = (SHARD_BY_EVENT_TYPE, SHARD_BY_ROUND_ROBIN)
+
+EVENT_COLUMNS = "id, event_type, event_payload, received_at"
+row_id = operator.itemgetter(0)
+
+
+async def open_db(db_path):
+    """
+    Open the long-lived writer connection tuned for ingest.
+
+    :param db_path: Path to the SQLite database file.
+    :return: The open database connection.
+    """
+    db = await aiosqlite.connect(db_path)
+    # Only takes effect on a new database, before any table exists.
+    await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class ReadPool:
+    def __init__(self, db_path, size=4):
+        """
+        Initialize the ReadPool.
+
+        A fixed set of read-only connections, separate from the writer
+        connection, so queries never wait for or block ingest.
+
+        :param db_path: Path to the SQLite database file.
+        :param size: Number of connections in the pool.
+        """
+        self.db_path = db_path
+        self.size = size
+        self.connections = []
+        self.idle = asyncio.Queue()
+
+    async def open(self):
+        """
+        Open the read-only connections.
+        """
+        uri = f"{pathlib.Path(self.db_path).resolve().as_uri()}?mode=ro"
+        for _ in range(self.size):
+            db = await aiosqlite.connect(uri, uri=True)
+            await db.execute("PRAGMA query_only=1")
+            self.connections.append(db)
+            self.idle.put_nowait(db)
+
+    async def close(self):
+        """
+        Close all connections.
+        """
+        for db in self.connections:
+            await db.close()
+        self.connections = []
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """
+        Borrow a connection for the duration of a ``with`` block.
+        """
+        db = await self.idle.get()
+        try:
+            yield db
+        finally:
+            self.idle.put_nowait(db)
+
+
+class EventFilter:
+    def __init__(self, event_type=None, after_id=None, before_id=None):
+        """
+        Initialize the EventFilter.
+
+        :param event_type: Only match events of this type.
+        :param after_id: Only match events with a larger id.
+        :param before_id: Only match events with a smaller id.
+        """
+        self.event_type = event_type
+        self.after_id = after_id
+        self.before_id = before_id
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface between the HTTP handlers and the event storage.
+
+    Rows are ``(event_type, event_payload, event_id)`` tuples on the way in,
+    where the event id may be ``None``, and
+    ``(id, event_type, event_payload, received_at)`` tuples on the way out,
+    ordered by id.
+    """
+
+    @abc.abstractmethod
+    async def open(self):
+        """
+        Open the storage and create its schema.
+        """
+
+    @abc.abstractmethod
+    def start(self):
+        """
+        Start the background writer tasks.
+        """
+
+    @abc.abstractmethod
+    async def stop(self):
+        """
+        Commit everything already queued and stop the writer tasks.
+        """
+
+    @abc.abstractmethod
+    async def close(self):
+        """
+        Close all connections.
+        """
+
+    @abc.abstractmethod
+    def submit(self, rows, wait=True):
+        """
+        Queue rows for storage without waiting for room.
+
+        :param rows: Rows to store.
+        :param wait: Whether the caller wants to be told when the rows are
+            durable.
+        :return: An awaitable resolved with the number of rows stored once
+            they are committed, or ``None`` when ``wait`` is false. Rows
+            whose event id is already stored are not counted.
+        :raises asyncio.QueueFull: If the rows cannot be queued now.
+        """
+
+    @abc.abstractmethod
+    async def put(self, rows, wait=True):
+        """
+        Queue rows for storage, waiting for room.
+
+        :param rows: Rows to store.
+        :param wait: Whether the caller wants to be told when the rows are
+            durable.
+        :return: An awaitable resolved with the number of rows stored once
+            they are committed, or ``None`` when ``wait`` is false.
+        """
+
+    @abc.abstractmethod
+    def configure_writers(self, **options):
+        """
+        Change the queue bound and commit group limits of the running
+        writers.
+
+        :param options: ``max_queue_size``, ``max_group_events`` and
+            ``commit_interval_ms``; missing ones keep their value.
+        """
+
+    @abc.abstractmethod
+    def shard_backends(self):
+        """
+        The single-file backends the events are stored in.
+
+        :return: A list of SQLiteBackend objects, in shard order.
+        """
+
+    @abc.abstractmethod
+    def queue_depth(self):
+        """
+        Number of batches waiting for a commit.
+
+        :return: The number of queued batches.
+        """
+
+    @abc.abstractmethod
+    async def maintain(self, vacuum_pages):
+        """
+        Apply the retention policy and compact the storage.
+
+        :param vacuum_pages: Maximum number of pages released per database.
+        """
+
+    @abc.abstractmethod
+    async def fetch_events(self, filters, limit):
+        """
+        Return the first matching events.
+
+        :param filters: The EventFilter to apply.
+        :param limit: Maximum number of events to return.
+        :return: A list of rows.
+        """
+
+    @abc.abstractmethod
+    async def count_events(self, filters):
+        """
+        Count matching events per event type.
+
+        :param filters: The EventFilter to apply.
+        :return: A dictionary of event types to counts.
+        """
+
+    @abc.abstractmethod
+    def export_events(self, filters, chunk_size):
+        """
+        Yield all matching events in chunks.
+
+        Implementations are async generators.
+
+        :param filters: The EventFilter to apply.
+        :param chunk_size: Maximum number of rows per chunk.
+        :return: An async iterator of lists of rows.
+        """
+
+
+class SQLiteBackend(StorageBackend):
+    def __init__(
+        self,
+        db_path,
+        shard=0,
+        shard_count=1,
+        max_queue_size=1000,
+        max_group_events=5000,
+        commit_interval_ms=5,
+        read_pool_size=4,
+        partition_window=WINDOW_DAY,
+        retention_hours=None,
+        read_only=False,
+        metrics=None,
+        dictionary_encoding=ENCODING_NONE,
+        intern_cache_size=100_000,
+    ):
+        """
+        Initialize the SQLiteBackend.
+
+        One database file with its own writer connection, group-commit
+        writer and read-only connection pool. As one shard of ``shard_count``,
+        its row ids are exposed as ``local_id * shard_count + shard`` so ids
+        stay unique across shards. A read-only backend only opens the pool;
+        another process owns the writer.
+
+        :param db_path: Path to the SQLite database file.
+        :param shard: Number of this shard.
+        :param shard_count: Total number of shards.
+        :param max_queue_size: Maximum number of batches waiting for a commit.
+        :param max_group_events: Number of events that closes a commit group.
+        :param commit_interval_ms: Maximum time (in milliseconds) a commit
+            group stays open waiting for more batches.
+        :param read_pool_size: Number of read-only connections.
+        :param partition_window: Time window of a storage partition.
+        :param retention_hours: Hours after which a partition is dropped, or
+            ``None`` to keep events forever.
+        :param read_only: Whether this process only reads the database.
+        :param metrics: Optional ConsumerMetrics updated by the writer.
+        :param dictionary_encoding: ``"none"``, ``"types"`` or
+            ``"types_and_payloads"`` for new partitions.
+        :param intern_cache_size: Maximum number of lookup ids cached per
+            lookup table.
+        """
+        self.db_path = db_path
+        self.read_only = read_only
+        self.shard = shard
+        self.shard_count = shard_count
+        self.writer_options = {
+            "max_queue_size": max_queue_size,
+            "max_group_events": max_group_events,
+            "commit_interval_ms": commit_interval_ms,
+            "metrics": metrics,
+        }
+        self.storage_options = {
+            "window": partition_window,
+            "retention_hours": retention_hours,
+            "dictionary_encoding": dictionary_encoding,
+            "intern_cache_size": intern_cache_size,
+        }
+        self.read_pool = ReadPool(db_path, size=read_pool_size)
+        self.db = None
+        self.storage = None
+        self.writer = None
+        self.commit_listeners = {}
+
+    async def open(self):
+        """
+        Open the writer connection, create the schema and open the read pool.
+        """
+        if self.read_only:
+            await self.read_pool.open()
+            return
+        self.db = await open_db(self.db_path)
+        self.storage = PartitionedStorage(self.db, **self.storage_options)
+        await self.storage.init()
+        self.writer = EventWriter(self.storage, **self.writer_options)
+        await self.read_pool.open()
+
+    def start(self):
+        """
+        Start the writer task.
+        """
+        if not self.read_only:
+            self.writer.start()
+
+    async def stop(self):
+        """
+        Commit everything already queued and stop the writer task.
+        """
+        if not self.read_only:
+            await self.writer.stop()
+
+    async def close(self):
+        """
+        Close the read pool and the writer connection.
+        """
+        await self.read_pool.close()
+        if not self.read_only:
+            await self.db.close()
+
+    def full(self):
+        """
+        Check whether the writer queue is at capacity.
+
+        :return: True if a submit would raise ``asyncio.QueueFull``.
+        """
+        return self.writer.full()
+
+    def submit(self, rows, wait=True):
+        return self.writer.submit(rows, wait)
+
+    async def put(self, rows, wait=True):
+        return await self.writer.put(rows, wait)
+
+    def configure_writers(self, **options):
+        if self.read_only:
+            return
+        writer = self.writer
+        writer.configure(
+            options.get("max_queue_size", writer.max_queue_size),
+            options.get("max_group_events", writer.max_group_events),
+            options.get("commit_interval_ms", writer.commit_interval_ms),
+        )
+
+    def shard_backends(self):
+        return [self]
+
+    def queue_depth(self):
+        if self.read_only:
+            return 0
+        return self.writer.queue.qsize()
+
+    def add_commit_listener(self, callback):
+        """
+        Call a function with the rows of every commit of this process.
+
+        :param callback: Called with ``(id, event_type, event_payload,
+            received_at)`` rows, with ids across shards.
+        """
+
+        def listener(rows):
+            callback([self.global_row(row) for row in rows])
+
+        self.commit_listeners[callback] = listener
+        self.writer.listeners.append(listener)
+
+    def remove_commit_listener(self, callback):
+        """
+        Stop calling a function added with ``add_commit_listener``.
+
+        :param callback: The function to remove.
+        """
+        self.writer.listeners.remove(self.commit_listeners.pop(callback))
+
+    async def last_id(self):
+        """
+        Highest id allocated so far, read from the sequence so it covers
+        commits of other processes.
+
+        :return: The id across shards, or ``None`` if nothing was stored.
+        """
+        async with self.read_pool.acquire() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT next_id - 1 FROM {SEQUENCE_TABLE}"
+            )
+        if not rows or rows[0][0] < 1:
+            return None
+        return self.global_row(rows[0])[0]
+
+    async def maintain(self, vacuum_pages):
+        if self.read_only:
+            return
+        # The maintenance pass shares the writer connection.
+        async with self.writer.lock:
+            await self.storage.maintain(vacuum_pages)
+
+    def where_clause(self, filters):
+        """
+        Build the WHERE clause of a filter, mapping id bounds to local ids.
+
+        :param filters: The EventFilter to apply.
+        :return: A tuple of the SQL condition and its parameters.
+        """
+        conditions = []
+        params = []
+        if filters.event_type is not None:
+            conditions.append("event_type = ?")
+            params.append(filters.event_type)
+        if filters.after_id is not None:
+            conditions.append("id > ?")
+            params.append((filters.after_id - self.shard) // self.shard_count)
+        if filters.before_id is not None:
+            conditions.append("id < ?")
+            params.append(
+                -((self.shard - filters.before_id) // self.shard_count)
+            )
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+
+    def global_row(self, row):
+        """
+        Replace the local id of a row by its id across shards.
+
+        :param row: A row read from this shard.
+        :return: The row with its global id.
+        """
+        return (row[0] * self.shard_count + self.shard, *row[1:])
+
+    async def fetch_events(self, filters, limit):
+        where, params = self.where_clause(filters)
+        query = (
+            f"SELECT {EVENT_COLUMNS} FROM received_events "
+            f"{where} ORDER BY id LIMIT ?"
+        )
+        async with self.read_pool.acquire() as db:
+            async with db.execute(query, (*params, limit)) as cursor:
+                rows = await cursor.fetchall()
+        return [self.global_row(row) for row in rows]
+
+    async def count_events(self, filters):
+        where, params = self.where_clause(filters)
+        query = (
+            "SELECT event_type, COUNT(*) FROM received_events "
+            f"{where} GROUP BY event_type"
+        )
+        async with self.read_pool.acquire() as db:
+            async with db.execute(query, params) as cursor:
+                return dict(await cursor.fetchall())
+
+    async def export_events(self, filters, chunk_size):
+        # Each chunk is a page read after the last id sent, so a slow client
+        # holds a read connection only while a page is fetched. Unlike one
+        # long query, later pages see events stored during the export.
+        filters = EventFilter(
+            filters.event_type, filters.after_id, filters.before_id
+        )
+        while True:
+            rows = await self.fetch_events(filters, chunk_size)
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            filters.after_id = rows[-1][0]
+
+
+async def total_stored(futures):
+    """
+    Wait for the parts of a batch spread over several shards.
+
+    :param futures: The futures returned by the shards.
+    :return: The total number of rows stored.
+    """
+    return sum(await asyncio.gather(*futures))
+
+
+class ShardedBackend(StorageBackend):
+    def __init__(self, shards, shard_by=SHARD_BY_EVENT_TYPE, owned_shard=None):
+        """
+        Initialize the ShardedBackend.
+
+        Spreads ingest over several SQLite backends, each with its own file
+        and writer task, and merges their results on reads.
+
+        :param shards: The SQLiteBackend of every shard, in shard order.
+        :param shard_by: ``"event_type"`` to keep each event type on one
+            shard, or ``"round_robin"`` to rotate chunks over all shards.
+        :param owned_shard: The only shard this process writes to, when
+            each shard is owned by a different process.
+        :raises ValueError: If ``shard_by`` is unknown.
+        """
+        if shard_by not in SHARD_BY_MODES:
+            raise ValueError(f"Unknown shard_by mode: {shard_by}")
+        self.shards = shards
+        self.shard_by = shard_by
+        self.owned_shard = owned_shard
+        self.next_shard = 0
+
+    async def open(self):
+        await asyncio.gather(*(shard.open() for shard in self.shards))
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+
+    async def stop(self):
+        await asyncio.gather(*(shard.stop() for shard in self.shards))
+
+    async def close(self):
+        for shard in self.shards:
+            await shard.close()
+
+    def shard_of(self, key):
+        """
+        Shard holding an event type when sharding by event type, or an event
+        id when rotating chunks.
+
+        A CRC rather than ``hash()`` keeps the mapping stable across runs.
+
+        :param key: The event type or event id.
+        :return: The shard number.
+        """
+        return zlib.crc32(key.encode()) % len(self.shards)
+
+    def route(self, rows):
+        """
+        Split rows by the shard that stores them.
+
+        Rows with an event id always reach the same shard, whose id table
+        catches a repeated id: when rotating chunks they are routed by a
+        hash of the id, and otherwise a repeated event has the same type.
+
+        :param rows: Rows to store.
+        :return: A dictionary of shard numbers to rows.
+        """
+        if self.owned_shard is not None:
+            return {self.owned_shard: rows}
+        if self.shard_by == SHARD_BY_ROUND_ROBIN:
+            shard = self.next_shard
+            self.next_shard = (shard + 1) % len(self.shards)
+            parts = {}
+            for row in rows:
+                target = shard if row[2] is None else self.shard_of(row[2])
+                parts.setdefault(target, []).append(row)
+            return parts
+        parts = {}
+        for row in rows:
+            parts.setdefault(self.shard_of(row[0]), []).append(row)
+        return parts
+
+    def shards_for(self, filters):
+        """
+        Shards that may hold events matching a filter.
+
+        :param filters: The EventFilter to apply.
+        :return: A list of SQLiteBackend objects.
+        """
+        if (
+            self.shard_by == SHARD_BY_EVENT_TYPE
+            and self.owned_shard is None
+            and filters.event_type is not None
+        ):
+            return [self.shards[self.shard_of(filters.event_type)]]
+        return self.shards
+
+    def submit(self, rows, wait=True):
+        parts = self.route(rows)
+        # Check every shard first so a request is never half queued.
+        if any(self.shards[shard].full() for shard in parts):
+            raise asyncio.QueueFull
+        futures = [
+            self.shards[shard].submit(part, wait)
+            for shard, part in parts.items()
+        ]
+        return asyncio.ensure_future(total_stored(futures)) if wait else None
+
+    async def put(self, rows, wait=True):
+        futures = [
+            await self.shards[shard].put(part, wait)
+            for shard, part in self.route(rows).items()
+        ]
+        return asyncio.ensure_future(total_stored(futures)) if wait else None
+
+    def configure_writers(self, **options):
+        for shard in self.shards:
+            shard.configure_writers(**options)
+
+    def shard_backends(self):
+        return self.shards
+
+    def queue_depth(self):
+        return sum(shard.queue_depth() for shard in self.shards)
+
+    async def maintain(self, vacuum_pages):
+        for shard in self.shards:
+            await shard.maintain(vacuum_pages)
+
+    async def fetch_events(self, filters, limit):
+        results = await asyncio.gather(
+            *(
+                shard.fetch_events(filters, limit)
+                for shard in self.shards_for(filters)
+            )
+        )
+        merged = heapq.merge(*results, key=row_id)
+        return list(itertools.islice(merged, limit))
+
+    async def count_events(self, filters):
+        counts = collections.Counter()
+        for result in await asyncio.gather(
+            *(shard.count_events(filters) for shard in self.shards_for(filters))
+        ):
+            counts.update(result)
+        return dict(counts)
+
+    async def export_events(self, filters, chunk_size):
+        # Each shard streams in id order; rows up to the smallest last id
+        # buffered from a live stream can be emitted in merged order.
+        streams = [
+            shard.export_events(filters, chunk_size)
+            for shard in self.shards_for(filters)
+        ]
+        buffers = [[] for _ in streams]
+        live = set(range(len(streams)))
+        try:
+            while live or any(buffers):
+                for i in list(live):
+                    if not buffers[i]:
+                        chunk = await anext(streams[i], None)
+                        if chunk is None:
+                            live.discard(i)
+                        else:
+                            buffers[i] = chunk
+                bound = min((buffers[i][-1][0] for i in live), default=None)
+                ready = []
+                for i, buffer in enumerate(buffers):
+                    cut = (
+                        len(buffer)
+                        if bound is None
+                        else bisect.bisect_right(buffer, bound, key=row_id)
+                    )
+                    ready.append(buffer[:cut])
+                    buffers[i] = buffer[cut:]
+                rows = list(heapq.merge(*ready, key=row_id))
+                if rows:
+                    yield rows
+        finally:
+            for stream in streams:
+                await stream.aclose()
+
+
+def shard_paths(db_path, shards, shard_dir=None):
+    """
+    Paths of the database files of a shard layout.
+
+    :param db_path: Path to the SQLite database file.
+    :param shards: Number of shards.
+    :param shard_dir: Directory of the shard files. Defaults to the
+        directory of ``db_path``.
+    :return: The path of every shard, in shard order.
+    """
+    if shards == 1:
+        return [db_path]
+    path = pathlib.Path(db_path)
+    directory = pathlib.Path(shard_dir) if shard_dir else path.parent
+    return [
+        str(directory / f"{path.stem}-{i}{path.suffix}") for i in range(shards)
+    ]
+
+
+def check_shard_layout(db_path, shards, shard_dir=None):
+    """
+    Check that the databases already on disk belong to a shard layout.
+
+    Ids are derived from the shard count, and events are looked up in the
+    files of the configured layout only, so the count cannot change on
+    existing data.
+
+    :param db_path: Path to the SQLite database file.
+    :param shards: Number of shards.
+    :param shard_dir: Directory of the shard files.
+    :raises ValueError: If a database of another layout exists.
+    """
+    path = pathlib.Path(db_path)
+    directory = pathlib.Path(shard_dir) if shard_dir else path.parent
+    name = re.compile(rf"{re.escape(path.stem)}-\d+{re.escape(path.suffix)}")
+    existing = [
+        str(file)
+        for file in directory.glob(f"{path.stem}-*{path.suffix}")
+        if name.fullmatch(file.name)
+    ]
+    if path.exists():
+        existing.append(db_path)
+    expected = set(shard_paths(db_path, shards, shard_dir))
+    unexpected = sorted(file for file in existing if file not in expected)
+    if unexpected:
+        raise ValueError(
+            f"{', '.join(unexpected)} hold events of another shard layout "
+            f"than shards={shards}; the shard count cannot change on "
+            "existing data, so keep the previous count or move these files "
+            "aside"
+        )
+
+
+async def open_backend(
+    db_path,
+    shards=1,
+    shard_dir=None,
+    shard_by=SHARD_BY_EVENT_TYPE,
+    owned_shard=None,
+    **options,
+):
+    """
+    Open the storage backend described by the consumer configuration.
+
+    With more than one shard, shard ``i`` is stored in ``<stem>-<i>.db``
+    inside ``shard_dir``, where ``<stem>`` is the name of ``db_path``
+    without its suffix. With ``owned_shard`` set, the other shards are
+    opened read-only; they must already have been created.
+
+    :param db_path: Path to the SQLite database file.
+    :param shards: Number of database files to spread ingest over.
+    :param shard_dir: Directory of the shard files. Defaults to the
+        directory of ``db_path``.
+    :param shard_by: ``"event_type"`` or ``"round_robin"``.
+    :param owned_shard: The only shard this process writes to.
+    :param options: Options passed to every SQLiteBackend.
+    :return: The open backend.
+    :raises ValueError: If the shard configuration is invalid or does not
+        match the databases on disk.
+    """
+    if shards < 1:
+        raise ValueError("shards must be at least 1")
+    check_shard_layout(db_path, shards, shard_dir)
+    if shards == 1:
+        backend = SQLiteBackend(db_path, **options)
+    else:
+        paths = shard_paths(db_path, shards, shard_dir)
+        directory = os.path.dirname(paths[0])
+        os.makedirs(directory or ".", exist_ok=True)
+        backend = ShardedBackend(
+            [
+                SQLiteBackend(
+                    shard_path,
+                    shard=i,
+                    shard_count=shards,
+                    read_only=owned_shard not in (None, i),
+                    **options,
+                )
+                for i, shard_path in enumerate(paths)
+            ],
+            shard_by=shard_by,
+            owned_shard=owned_shard,
+        )
+        logger.info(f"Storing events in {shards} shards under {directory}")
+    await backend.open()
+    return backend
+
+
+backend_key = web.AppKey("backend", StorageBackend)
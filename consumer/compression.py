@@ -0,0 +1,142 @@
+import zlib
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:  # pragma: no cover - depends on the Python version
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+from .parsing import READ_CHUNK_SIZE, MalformedBodyError
+
+IDENTITY = "identity"
+GZIP = "gzip"
+ZSTD = "zstd"
+
+DECOMPRESSION_ERRORS = (zlib.error, EOFError)
+if zstd is not None:
+    DECOMPRESSION_ERRORS += (zstd.ZstdError,)
+
+MAGIC_NUMBERS = {
+    GZIP: b"\x1f\x8b",
+    ZSTD: b"\x28\xb5\x2f\xfd",
+}
+
+
+def supported_encodings():
+    """
+    List the content encodings the consumer can decode.
+
+    :return: A tuple of encoding names.
+    """
+    if zstd is None:
+        return (IDENTITY, GZIP)
+    return (IDENTITY, GZIP, ZSTD)
+
+
+class GzipDecompressor:
+    def __init__(self):
+        """
+        Initialize the GzipDecompressor.
+
+        Adapts ``zlib.decompressobj`` to the ``decompress(data, max_length)``
+        interface of the zstd decompressor.
+        """
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.tail = b""
+
+    @property
+    def needs_input(self):
+        return not self.tail
+
+    @property
+    def eof(self):
+        return self.decompressor.eof
+
+    @property
+    def unused_data(self):
+        return self.decompressor.unused_data
+
+    def decompress(self, data, max_length):
+        """
+        Decompress at most ``max_length`` bytes, buffering leftover input.
+
+        :param data: Compressed input.
+        :param max_length: Maximum number of bytes to return.
+        :return: Decompressed bytes.
+        """
+        out = self.decompressor.decompress(self.tail + data, max_length)
+        self.tail = self.decompressor.unconsumed_tail
+        return out
+
+
+class DecompressingStream:
+    def __init__(self, content, encoding):
+        """
+        Initialize the DecompressingStream.
+
+        Wraps a request body stream and inflates it incrementally, never
+        producing more than the requested number of bytes per read, so the
+        size limits enforced by the parsers apply to the decompressed body.
+
+        The server must not decode bodies itself: a body that does not
+        start with the magic number of its declared encoding is rejected.
+
+        :param content: The request body stream.
+        :param encoding: The request content encoding.
+        """
+        self.content = content
+        self.encoding = encoding
+        self.decompressor = None
+        self.head = b""
+
+    async def start(self, n):
+        """
+        Read the start of the body and create the decompressor.
+
+        :param n: Number of bytes to read at a time.
+        :raises MalformedBodyError: If the body does not match its declared
+            encoding.
+        """
+        magic = MAGIC_NUMBERS[self.encoding]
+        while len(self.head) < len(magic):
+            chunk = await self.content.read(n)
+            if not chunk:
+                break
+            self.head += chunk
+        if not self.head.startswith(magic):
+            raise MalformedBodyError(f"Body is not {self.encoding}-compressed")
+        if self.encoding == GZIP:
+            self.decompressor = GzipDecompressor()
+        else:
+            self.decompressor = zstd.ZstdDecompressor()
+
+    async def read(self, n=READ_CHUNK_SIZE):
+        """
+        Read up to ``n`` decompressed bytes.
+
+        :param n: Maximum number of bytes to return.
+        :return: Decompressed bytes, or ``b""`` at the end of the body.
+        :raises MalformedBodyError: If the body is not validly compressed.
+        """
+        if self.decompressor is None:
+            await self.start(n)
+        data, self.head = self.head, b""
+        decompressor = self.decompressor
+        while True:
+            if decompressor.eof:
+                if decompressor.unused_data or await self.content.read(1):
+                    raise MalformedBodyError("Extra data after compressed body")
+                return b""
+            if not data and decompressor.needs_input:
+                data = await self.content.read(n)
+                if not data:
+                    raise MalformedBodyError("Truncated compressed body")
+            try:
+                out = decompressor.decompress(data, n)
+            except DECOMPRESSION_ERRORS as e:
+                raise MalformedBodyError(str(e))
+            data = b""
+            if out:
+                return out
@@ -1,9 +1,47 @@
-import json
+import asyncio
+import contextlib
+import inspect
 import logging
+import time
 
 import aiosqlite
 from aiohttp import web
 
+from metrics import Registry
+from runtime import codec
+
+from .aggregates import (
+    MAX_TRACKED_TYPES,
+    Aggregator,
+    aggregator_key,
+    setup_aggregates,
+)
+from .backends import SHARD_BY_EVENT_TYPE, backend_key, open_backend
+from .compression import IDENTITY, DecompressingStream, supported_encodings
+from .dedup import IDEMPOTENCY_KEY_HEADER, RecentIds, event_id, recent_ids_key
+from .monitoring import (
+    REJECTED_INVALID,
+    REJECTED_MALFORMED,
+    REJECTED_QUEUE_FULL,
+    REJECTED_STORAGE,
+    REJECTED_TOO_LARGE,
+    ConsumerMetrics,
+    metrics_key,
+    metrics_server_context,
+    setup_metrics,
+)
+from .parsing import (
+    InvalidEventDataError,
+    MalformedBodyError,
+    PayloadTooLargeError,
+    TooManyEventsError,
+    get_body_parser,
+    is_valid_event,
+)
+from .reads import setup_read_routes
+from .storage import ENCODING_NONE, WINDOW_DAY
+from .stream import SLOW_POLICY_DISCONNECT, StreamHub, setup_stream
+
 
 def setup_logging():
     """
@@ -18,79 +56,533 @@ setup_logging()
 logger = logging.getLogger(__name__)
 
 
-async def init_db():
+DB_PATH = "events.db"
+
+ACK_DURABLE = "durable"
+ACK_FIRE_AND_FORGET = "fire_and_forget"
+# Seconds a client is asked to wait when the ingest queue is full.
+RETRY_AFTER = 1
+# Options a running consumer accepts from a configuration reload.
+SETTINGS_OPTIONS = (
+    "ack_mode",
+    "max_body_size",
+    "max_events_per_request",
+    "ingest_chunk_events",
+)
+WRITER_OPTIONS = ("max_queue_size", "max_group_events", "commit_interval_ms")
+RELOADABLE_OPTIONS = (*SETTINGS_OPTIONS, *WRITER_OPTIONS, "dedup_cache_size")
+
+
+class IngestSettings:
+    def __init__(
+        self,
+        ack_mode=ACK_DURABLE,
+        max_body_size=64 * 1024 * 1024,
+        max_events_per_request=100_000,
+        ingest_chunk_events=1000,
+    ):
+        """
+        Initialize the IngestSettings.
+
+        :param ack_mode: ``"durable"`` to answer once events are committed,
+            or ``"fire_and_forget"`` to answer 202 as soon as they are queued.
+        :param max_body_size: Maximum request body size in bytes.
+        :param max_events_per_request: Maximum number of events per request.
+        :param ingest_chunk_events: Number of parsed events handed to the
+            writer at a time while a request body is streamed.
+        """
+        if ack_mode not in (ACK_DURABLE, ACK_FIRE_AND_FORGET):
+            raise ValueError(f"Unknown ack mode: {ack_mode}")
+        self.ack_mode = ack_mode
+        self.max_body_size = max_body_size
+        self.max_events_per_request = max_events_per_request
+        self.ingest_chunk_events = ingest_chunk_events
+
+
+settings_key = web.AppKey("settings", IngestSettings)
+
+
+async def start_backend(app):
     """
-    Initialize the database by creating the received_events table if it does
-    not exist.
+    Start the storage writers when the application starts.
+
+    :param app: The web application.
     """
-    async with aiosqlite.connect("events.db") as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS received_events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_type TEXT NOT NULL,
-                event_payload TEXT NOT NULL
-            )
-        """
+    app[backend_key].start()
+
+
+async def stop_backend(app):
+    """
+    Flush queued events, checkpoint the aggregates they were counted in and
+    close the storage when the application shuts down.
+
+    :param app: The web application.
+    """
+    await app[backend_key].stop()
+    try:
+        await app[aggregator_key].checkpoint()
+    except aiosqlite.Error as e:
+        logger.error(f"Aggregate checkpoint failed: {e}")
+    await app[backend_key].close()
+
+
+def error_response(message, status, accepted=0, headers=None):
+    """
+    Build a JSON error response.
+
+    :param message: The error message.
+    :param status: The HTTP status code.
+    :param accepted: Number of events of the request already queued before
+        the error, reported only when non-zero.
+    :param headers: Extra response headers.
+    :return: The JSON response.
+    """
+    body = {"error": message}
+    if accepted:
+        body["accepted"] = accepted
+    return web.json_response(
+        body, status=status, headers=headers, dumps=codec.dumps
+    )
+
+
+async def run_maintenance(backend, interval, vacuum_pages):
+    """
+    Periodically drop expired partitions and compact the database files.
+
+    :param backend: The storage backend to maintain.
+    :param interval: Seconds between maintenance passes.
+    :param vacuum_pages: Maximum number of pages released per pass.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await backend.maintain(vacuum_pages)
+        except aiosqlite.Error as e:
+            logger.error(f"Storage maintenance failed: {e}")
+
+
+def maintenance_context(interval, vacuum_pages):
+    """
+    Build a cleanup context running storage maintenance in the background.
+
+    :param interval: Seconds between maintenance passes.
+    :param vacuum_pages: Maximum number of pages released per pass.
+    :return: The cleanup context for ``app.cleanup_ctx``.
+    """
+
+    async def context(app):
+        task = asyncio.create_task(
+            run_maintenance(app[backend_key], interval, vacuum_pages)
         )
-        await db.commit()
+        yield
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    return context
 
 
 async def handle_events(request):
     """
     Handle incoming events by saving them to the database.
 
+    The body is decoded according to its content type (JSON array, NDJSON or
+    msgpack) after undoing any gzip or zstd content encoding, parsed
+    incrementally and handed to the writer in chunks of
+    ``ingest_chunk_events`` events, so memory stays bounded regardless of the
+    batch size. A request that fits in one chunk is stored all-or-nothing.
+    Each chunk is validated as a whole once parsed, so parse and validation
+    time are measured per chunk rather than per event.
+
+    Events may carry an ``event_id``; with an ``Idempotency-Key`` header,
+    events without one get ``<key>:<position in the body>``. Events whose id
+    is already stored are dropped, first against a cache of recent ids and
+    then against the stored ids of the shard, and the response reports how
+    many events were accepted and how many were deduplicated.
+
     :param request: The incoming request object.
     :return: A JSON response indicating success or failure.
     """
     if not request.can_read_body:
         return web.json_response(
-            {"error": "Request body is not readable"}, status=400
+            {"error": "Request body is not readable"},
+            status=400,
+            dumps=codec.dumps,
         )
-    try:
-        data = await request.json()
-    except json.JSONDecodeError:
-        return web.json_response({"error": "Invalid JSON format"}, status=400)
-    if not isinstance(data, list) or not all(
-        isinstance(item, dict)
-        and isinstance(item.get("event_type"), str)
-        and isinstance(item.get("event_payload"), str)
-        for item in data
+    settings = request.app[settings_key]
+    backend = request.app[backend_key]
+    metrics = request.app[metrics_key]
+    if request.content_length is not None:
+        metrics.request_bytes.observe(request.content_length)
+    if (
+        request.content_length is not None
+        and request.content_length > settings.max_body_size
     ):
+        return error_response("Request body too large", 413)
+    body_parser = get_body_parser(request.content_type)
+    if body_parser is None:
+        return error_response("Unsupported content type", 415)
+    parse_body, wire_format = body_parser
+    encoding = request.headers.get("Content-Encoding", IDENTITY).lower()
+    if encoding not in supported_encodings():
+        return error_response("Unsupported content encoding", 415)
+    content = request.content
+    if encoding != IDENTITY:
+        content = DecompressingStream(content, encoding)
+
+    durable = settings.ack_mode == ACK_DURABLE
+    recent = request.app[recent_ids_key]
+    key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    pending = []
+    accepted = 0
+    parsed = 0
+    duplicates = 0
+    stored_ids = []
+    items = []
+    parse_seconds = 0.0
+    validation_seconds = 0.0
+
+    async def flush():
+        nonlocal accepted, parsed, duplicates, items, validation_seconds
+        started = time.perf_counter()
+        valid = all(map(is_valid_event, items))
+        validation_seconds += time.perf_counter() - started
+        if not valid:
+            raise InvalidEventDataError("Invalid event")
+        if key is None:
+            rows = [
+                (
+                    item["event_type"],
+                    item["event_payload"],
+                    item.get("event_id"),
+                )
+                for item in items
+            ]
+        else:
+            rows = [
+                (
+                    item["event_type"],
+                    item["event_payload"],
+                    event_id(item, key, parsed + i),
+                )
+                for i, item in enumerate(items)
+            ]
+        ids = [row[2] for row in rows if row[2] is not None]
+        if ids and len(recent):
+            fresh = [
+                row for row in rows if row[2] is None or row[2] not in recent
+            ]
+            duplicates += len(rows) - len(fresh)
+            rows = fresh
+            ids = [row[2] for row in rows if row[2] is not None]
+        if rows:
+            if pending or accepted:
+                stored = await backend.put(rows, wait=durable)
+            else:
+                stored = backend.submit(rows, wait=durable)
+            if stored is not None:
+                pending.append(stored)
+        if durable:
+            stored_ids.extend(ids)
+        else:
+            recent.add_all(ids)
+        accepted += len(rows)
+        parsed += len(items)
+        items = []
+
+    def reject(reason):
+        metrics.events_rejected.labels(reason).inc(len(items))
+
+    try:
+        started = time.perf_counter()
+        async for item in parse_body(content, settings.max_body_size):
+            if parsed + len(items) >= settings.max_events_per_request:
+                raise TooManyEventsError("Too many events in request")
+            items.append(item)
+            if len(items) >= settings.ingest_chunk_events:
+                parse_seconds += time.perf_counter() - started
+                await flush()
+                started = time.perf_counter()
+        parse_seconds += time.perf_counter() - started
+        if items:
+            await flush()
+    except asyncio.QueueFull:
+        logger.warning("Ingest queue is full, rejecting request")
+        reject(REJECTED_QUEUE_FULL)
+        return error_response(
+            "Ingest queue is full",
+            503,
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
+    except (MalformedBodyError, InvalidEventDataError) as e:
+        await asyncio.gather(*pending, return_exceptions=True)
+        if isinstance(e, MalformedBodyError):
+            reject(REJECTED_MALFORMED)
+            message = f"Invalid {wire_format} format"
+        else:
+            reject(REJECTED_INVALID)
+            message = "Invalid event data format"
+        return error_response(message, 400, accepted)
+    except (PayloadTooLargeError, TooManyEventsError) as e:
+        await asyncio.gather(*pending, return_exceptions=True)
+        reject(REJECTED_TOO_LARGE)
+        return error_response(str(e), 413, accepted)
+    finally:
+        metrics.events_received.inc(parsed + len(items))
+
+    metrics.parse_seconds.observe(parse_seconds)
+    metrics.validation_seconds.observe(validation_seconds)
+    metrics.request_events.observe(accepted)
+
+    if not durable:
+        metrics.events_deduplicated.inc(duplicates)
+        status = 202 if accepted else 200
         return web.json_response(
-            {"error": "Invalid event data format"}, status=400
+            {
+                "status": "accepted" if accepted else "success",
+                "accepted": accepted,
+                "deduplicated": duplicates,
+            },
+            status=status,
+            dumps=codec.dumps,
         )
 
     try:
-        async with aiosqlite.connect("events.db") as db:
-            for event in data:
-                await db.execute(
-                    """
-                    INSERT INTO received_events (event_type, event_payload)
-                    VALUES (?, ?)
-                """,
-                    (event["event_type"], event["event_payload"]),
-                )
-            await db.commit()
+        stored = sum(await asyncio.gather(*pending))
     except aiosqlite.DatabaseError as db_err:
         logger.error(f"Database error: {db_err}")
+        metrics.events_rejected.labels(REJECTED_STORAGE).inc(accepted)
         return web.json_response(
-            {"error": "Database operation failed"}, status=500
+            {"error": "Database operation failed"},
+            status=500,
+            dumps=codec.dumps,
         )
     except Exception as e:
         logger.error(f"Error saving events to database: {e}")
-        return web.json_response({"error": "Internal server error"}, status=500)
+        metrics.events_rejected.labels(REJECTED_STORAGE).inc(accepted)
+        return web.json_response(
+            {"error": "Internal server error"}, status=500, dumps=codec.dumps
+        )
+
+    recent.add_all(stored_ids)
+    deduplicated = duplicates + accepted - stored
+    metrics.events_deduplicated.inc(deduplicated)
+    return web.json_response(
+        {"status": "success", "accepted": stored, "deduplicated": deduplicated},
+        status=200,
+        dumps=codec.dumps,
+    )
+
+
+def default_options():
+    """
+    Default values of the consumer options.
 
-    return web.json_response({"status": "success"}, status=200)
+    :return: A dictionary of ``init_app`` parameters to their defaults.
+    """
+    return {
+        name: parameter.default
+        for name, parameter in inspect.signature(init_app).parameters.items()
+    }
+
+
+def check_reload(changes):
+    """
+    Validate options changed by a configuration reload.
+
+    :param changes: Changed options mapped to their new values.
+    :raises ValueError: If an option cannot change while the consumer runs,
+        or has an invalid value.
+    """
+    fixed = sorted(set(changes) - set(RELOADABLE_OPTIONS))
+    if fixed:
+        raise ValueError(f"Changing {', '.join(fixed)} requires a restart")
+    for name, value in changes.items():
+        if name == "ack_mode":
+            continue
+        minimum = 0 if name in ("commit_interval_ms", "dedup_cache_size") else 1
+        if (
+            not isinstance(value, (int, float))
+            or isinstance(value, bool)
+            or value < minimum
+        ):
+            raise ValueError(f"Invalid value for {name}: {value!r}")
+    ack_mode = changes.get("ack_mode", ACK_DURABLE)
+    if ack_mode not in (ACK_DURABLE, ACK_FIRE_AND_FORGET):
+        raise ValueError(f"Unknown ack mode: {ack_mode}")
+
+
+def prepare_reconfigure(app, **changes):
+    """
+    Validate options changed by a configuration reload and prepare their
+    application to the running consumer.
+
+    Nothing changes until the returned function is called. It applies every
+    change without yielding to the event loop, so each request and commit
+    group sees either the old or the new options.
 
+    :param app: The consumer application.
+    :param changes: Changed options mapped to their new values.
+    :return: A function applying the changes.
+    :raises ValueError: If an option cannot change while the consumer runs,
+        or has an invalid value.
+    """
+    check_reload(changes)
+
+    def apply():
+        settings = app[settings_key]
+        for name in SETTINGS_OPTIONS:
+            if name in changes:
+                setattr(settings, name, changes[name])
+        writer_changes = {
+            name: changes[name] for name in WRITER_OPTIONS if name in changes
+        }
+        if writer_changes:
+            app[backend_key].configure_writers(**writer_changes)
+        if "dedup_cache_size" in changes:
+            app[recent_ids_key].resize(changes["dedup_cache_size"])
+        logger.info(f"Applied consumer options: {sorted(changes)}")
+
+    return apply
 
-async def init_app():
+
+async def init_app(
+    db_path=DB_PATH,
+    max_queue_size=1000,
+    max_group_events=5000,
+    commit_interval_ms=5,
+    ack_mode=ACK_DURABLE,
+    max_body_size=64 * 1024 * 1024,
+    max_events_per_request=100_000,
+    ingest_chunk_events=1000,
+    read_pool_size=4,
+    partition_window=WINDOW_DAY,
+    retention_hours=None,
+    maintenance_interval=60.0,
+    vacuum_pages=1000,
+    shards=1,
+    shard_dir=None,
+    shard_by=SHARD_BY_EVENT_TYPE,
+    worker_index=None,
+    dedup_cache_size=100_000,
+    stream_queue_size=1000,
+    stream_slow_policy=SLOW_POLICY_DISCONNECT,
+    stream_poll_interval=0.5,
+    dictionary_encoding=ENCODING_NONE,
+    intern_cache_size=100_000,
+    aggregate_checkpoint_interval=60.0,
+    aggregate_max_types=MAX_TRACKED_TYPES,
+    metrics_host="localhost",
+    metrics_port=None,
+):
     """
     Initialize the web application and set up routes.
 
+    :param db_path: Path to the SQLite database file.
+    :param max_queue_size: Maximum number of requests waiting to be
+        committed before the endpoint answers 503.
+    :param max_group_events: Number of events that closes a commit group.
+    :param commit_interval_ms: Maximum time (in milliseconds) a commit group
+        stays open waiting for more requests.
+    :param ack_mode: ``"durable"`` to answer once events are committed, or
+        ``"fire_and_forget"`` to answer 202 as soon as they are queued.
+    :param max_body_size: Maximum request body size in bytes.
+    :param max_events_per_request: Maximum number of events per request.
+    :param ingest_chunk_events: Number of parsed events handed to the writer
+        at a time while a request body is streamed.
+    :param read_pool_size: Number of read-only connections serving the read
+        endpoints.
+    :param partition_window: Time window of a storage partition, ``"day"``
+        or ``"hour"``.
+    :param retention_hours: Hours after which a partition is dropped, or
+        ``None`` to keep events forever.
+    :param maintenance_interval: Seconds between retention and vacuum passes.
+    :param vacuum_pages: Maximum number of free pages released per pass.
+    :param shards: Number of database files ingest is spread over, each
+        with its own writer.
+    :param shard_dir: Directory of the shard files. Defaults to the
+        directory of ``db_path``.
+    :param shard_by: ``"event_type"`` to keep each event type on one shard,
+        or ``"round_robin"`` to rotate request chunks over the shards.
+    :param worker_index: Shard written by this process when every consumer
+        worker process owns one shard.
+    :param dedup_cache_size: Number of recent event ids kept in memory to
+        drop duplicates before they reach SQLite. Zero disables the cache.
+    :param stream_queue_size: Maximum number of events waiting for one
+        event stream subscriber.
+    :param stream_slow_policy: ``"disconnect"`` to close the stream of a
+        subscriber that falls behind, or ``"drop"`` to skip events for it.
+    :param stream_poll_interval: Seconds between polls of the shards other
+        worker processes write, while anyone is subscribed.
+    :param dictionary_encoding: ``"types"`` or ``"types_and_payloads"`` to
+        store new partitions with event types, and optionally payloads, as
+        ids into lookup tables; ``"none"`` to store them as text.
+    :param intern_cache_size: Maximum number of lookup ids the writer keeps
+        in memory per lookup table.
+    :param aggregate_checkpoint_interval: Seconds between checkpoints of the
+        windowed aggregates.
+    :param aggregate_max_types: Maximum number of event types aggregated.
+    :param metrics_host: Host of the separate metrics listener.
+    :param metrics_port: Port to also serve ``/metrics`` on, or ``None``.
+        Consumer workers each serve their own metrics on this port offset by
+        their index.
     :return: The initialized web application.
     """
-    await init_db()
+    settings = IngestSettings(
+        ack_mode=ack_mode,
+        max_body_size=max_body_size,
+        max_events_per_request=max_events_per_request,
+        ingest_chunk_events=ingest_chunk_events,
+    )
+    # Workers label their samples, so scrapes reaching different workers
+    # through the shared port yield separate series.
+    labels = () if worker_index is None else (("worker", str(worker_index)),)
+    metrics = ConsumerMetrics(Registry(labels))
+    backend = await open_backend(
+        db_path,
+        shards=shards,
+        shard_dir=shard_dir,
+        shard_by=shard_by,
+        owned_shard=worker_index,
+        max_queue_size=max_queue_size,
+        max_group_events=max_group_events,
+        commit_interval_ms=commit_interval_ms,
+        read_pool_size=read_pool_size,
+        partition_window=partition_window,
+        retention_hours=retention_hours,
+        metrics=metrics,
+        dictionary_encoding=dictionary_encoding,
+        intern_cache_size=intern_cache_size,
+    )
+    metrics.track_backend(backend)
+    hub = StreamHub(
+        backend,
+        queue_size=stream_queue_size,
+        slow_policy=stream_slow_policy,
+        poll_interval=stream_poll_interval,
+        metrics=metrics,
+    )
+    metrics.track_stream(hub)
     app = web.Application()
+    app[backend_key] = backend
+    app[settings_key] = settings
+    app[recent_ids_key] = RecentIds(dedup_cache_size)
+    setup_metrics(app, metrics)
+    if metrics_port is not None:
+        app.cleanup_ctx.append(
+            metrics_server_context(metrics_host, metrics_port)
+        )
+    app.on_startup.append(start_backend)
+    app.cleanup_ctx.append(
+        maintenance_context(maintenance_interval, vacuum_pages)
+    )
+    app.on_cleanup.append(stop_backend)
     app.router.add_post("/event", handle_events)
+    setup_read_routes(app)
+    setup_stream(app, hub)
+    setup_aggregates(
+        app,
+        Aggregator(backend, max_types=aggregate_max_types),
+        aggregate_checkpoint_interval,
+    )
     return app
@@ -0,0 +1,78 @@
+import collections
+
+from aiohttp import web
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+
+
+class RecentIds:
+    def __init__(self, capacity=100_000):
+        """
+        Initialize the RecentIds cache.
+
+        Remembers the most recently stored event ids so repeated events are
+        dropped before they reach SQLite. The cache only short-circuits:
+        the event id table of each shard stays authoritative, so an id that
+        was evicted is still caught there. Each worker process keeps its own
+        cache.
+
+        :param capacity: Maximum number of ids kept. Zero disables the
+            cache.
+        """
+        self.capacity = capacity
+        self.ids = collections.OrderedDict()
+
+    def __contains__(self, event_id):
+        if event_id in self.ids:
+            self.ids.move_to_end(event_id)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def resize(self, capacity):
+        """
+        Change the capacity, evicting the least recently used ids if it
+        shrinks.
+
+        :param capacity: Maximum number of ids kept. Zero disables the
+            cache.
+        """
+        self.capacity = capacity
+        while len(self.ids) > capacity:
+            self.ids.popitem(last=False)
+
+    def add_all(self, event_ids):
+        """
+        Remember stored event ids, evicting the least recently used ones.
+
+        :param event_ids: The ids to remember.
+        """
+        if not self.capacity:
+            return
+        ids = self.ids
+        for event_id in event_ids:
+            ids[event_id] = None
+            ids.move_to_end(event_id)
+        while len(ids) > self.capacity:
+            ids.popitem(last=False)
+
+
+recent_ids_key = web.AppKey("recent_ids", RecentIds)
+
+
+def event_id(item, key, position):
+    """
+    Event id of a parsed event.
+
+    :param item: The parsed event.
+    :param key: The request's idempotency key, or ``None``.
+    :param position: Position of the event in the request body.
+    :return: The event's own ``event_id``, one derived from the idempotency
+        key, or ``None``.
+    """
+    own_id = item.get("event_id")
+    if own_id is not None or key is None:
+        return own_id
+    return f"{key}:{position}"
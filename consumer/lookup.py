@@ -0,0 +1,81 @@
+import collections
+
+# Values resolved per query, below SQLite's bound parameter limit.
+LOOKUP_CHUNK = 500
+
+
+class LookupTable:
+    def __init__(self, db, table, capacity=100_000):
+        """
+        Initialize the LookupTable.
+
+        Maps repeated strings to integer ids stored in a table of the
+        database, so partitions hold the id instead of the string. Ids of
+        recently used values are kept in a bounded cache, so inserting
+        events with known values needs no query. Only the writer connection
+        adds values, inside its transaction; the cache is cleared whenever
+        that transaction is rolled back.
+
+        :param db: The database connection owned by the writer.
+        :param table: Name of the table holding the values.
+        :param capacity: Maximum number of cached ids.
+        """
+        self.db = db
+        self.table = table
+        self.capacity = capacity
+        self.cache = collections.OrderedDict()
+
+    async def create(self):
+        """
+        Create the table if it does not exist.
+        """
+        await self.db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} "
+            "(id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)"
+        )
+
+    def clear(self):
+        """
+        Forget all cached ids.
+        """
+        self.cache.clear()
+
+    async def ids(self, values):
+        """
+        Ids of values, adding the values seen for the first time in the
+        order they appear.
+
+        :param values: The strings to resolve.
+        :return: The id of each value, in order.
+        """
+        cache = self.cache
+        distinct = dict.fromkeys(values)
+        missing = [value for value in distinct if value not in cache]
+        if missing:
+            await self.resolve(missing)
+        ids = [cache[value] for value in values]
+        for value in distinct:
+            cache.move_to_end(value)
+        while len(cache) > self.capacity:
+            cache.popitem(last=False)
+        return ids
+
+    async def resolve(self, values):
+        """
+        Insert values not stored yet and cache the ids of all of them.
+
+        :param values: Strings missing from the cache.
+        """
+        await self.db.executemany(
+            f"INSERT OR IGNORE INTO {self.table} (value) VALUES (?)",
+            [(value,) for value in values],
+        )
+        for start in range(0, len(values), LOOKUP_CHUNK):
+            chunk = values[start : start + LOOKUP_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = await self.db.execute_fetchall(
+                f"SELECT value, id FROM {self.table} "
+                f"WHERE value IN ({placeholders})",
+                chunk,
+            )
+            self.cache.update(rows)
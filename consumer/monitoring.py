@@ -0,0 +1,174 @@
+from aiohttp import web
+
+from metrics import (
+    BYTE_BUCKETS,
+    SIZE_BUCKETS,
+    Registry,
+    metrics_handler,
+    start_metrics_server,
+)
+
+# Rejection reasons of parsed events.
+REJECTED_INVALID = "invalid_event"
+REJECTED_MALFORMED = "malformed_body"
+REJECTED_TOO_LARGE = "too_large"
+REJECTED_QUEUE_FULL = "queue_full"
+REJECTED_STORAGE = "storage_error"
+
+
+class ConsumerMetrics:
+    def __init__(self, registry=None):
+        """
+        Initialize the ConsumerMetrics.
+
+        Groups the collectors of the consumer hot path. Latencies are
+        measured once per chunk or commit group rather than per event.
+
+        :param registry: The Registry to register the collectors in. A new
+            one is created by default.
+        """
+        self.registry = registry if registry is not None else Registry()
+        registry = self.registry
+        self.requests = registry.counter(
+            "consumer_requests_total",
+            "HTTP requests handled, by route and status.",
+            ("path", "status"),
+        )
+        self.events_received = registry.counter(
+            "consumer_events_received_total",
+            "Events parsed from ingest requests.",
+        )
+        self.events_rejected = registry.counter(
+            "consumer_events_rejected_total",
+            "Parsed events that were not stored, by reason.",
+            ("reason",),
+        )
+        self.events_deduplicated = registry.counter(
+            "consumer_events_deduplicated_total",
+            "Events dropped because their event id was already stored.",
+        )
+        self.events_stored = registry.counter(
+            "consumer_events_stored_total",
+            "Events committed to storage.",
+        )
+        self.commit_failures = registry.counter(
+            "consumer_commit_failures_total",
+            "Commit groups rolled back after a storage error.",
+        )
+        self.request_bytes = registry.histogram(
+            "consumer_request_bytes",
+            "Declared Content-Length of ingest requests.",
+            BYTE_BUCKETS,
+        )
+        self.request_events = registry.histogram(
+            "consumer_request_events",
+            "Events per accepted ingest request.",
+            SIZE_BUCKETS,
+        )
+        self.commit_group_events = registry.histogram(
+            "consumer_commit_group_events",
+            "Events per commit group.",
+            SIZE_BUCKETS,
+        )
+        self.parse_seconds = registry.histogram(
+            "consumer_parse_seconds",
+            "Time spent reading and parsing an ingest request body.",
+        )
+        self.validation_seconds = registry.histogram(
+            "consumer_validation_seconds",
+            "Time spent validating the events of an ingest request.",
+        )
+        self.commit_seconds = registry.histogram(
+            "consumer_commit_seconds",
+            "Time spent inserting and committing a commit group.",
+        )
+        self.queue_depth = registry.gauge(
+            "consumer_queue_depth",
+            "Batches waiting in the writer queues.",
+        )
+        self.stream_subscribers = registry.gauge(
+            "consumer_stream_subscribers",
+            "Clients connected to the event stream.",
+        )
+        self.stream_events_dropped = registry.counter(
+            "consumer_stream_events_dropped_total",
+            "Events skipped for stream subscribers that fell behind.",
+        )
+        self.stream_disconnects = registry.counter(
+            "consumer_stream_disconnects_total",
+            "Stream subscribers disconnected for falling behind.",
+        )
+
+    def track_backend(self, backend):
+        """
+        Report the queue depth of a storage backend.
+
+        The depth is read when the metrics are rendered, so the hot path
+        does not update it.
+
+        :param backend: The StorageBackend to watch.
+        """
+        self.queue_depth.function = backend.queue_depth
+
+    def track_stream(self, hub):
+        """
+        Report the number of stream subscribers.
+
+        :param hub: The StreamHub to watch.
+        """
+        self.stream_subscribers.function = hub.__len__
+
+
+metrics_key = web.AppKey("metrics", ConsumerMetrics)
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """
+    Count handled requests by route and status.
+
+    :param request: The incoming request object.
+    :param handler: The next handler.
+    :return: The response.
+    """
+    resource = request.match_info.route.resource
+    path = resource.canonical if resource is not None else "unmatched"
+    requests = request.app[metrics_key].requests
+    try:
+        response = await handler(request)
+    except web.HTTPException as e:
+        requests.labels(path, str(e.status)).inc()
+        raise
+    requests.labels(path, str(response.status)).inc()
+    return response
+
+
+def setup_metrics(app, metrics):
+    """
+    Expose the consumer metrics on ``/metrics``.
+
+    :param app: The web application.
+    :param metrics: The ConsumerMetrics of the application.
+    """
+    app[metrics_key] = metrics
+    app.middlewares.append(metrics_middleware)
+    app.router.add_get("/metrics", metrics_handler(metrics.registry))
+
+
+def metrics_server_context(host, port):
+    """
+    Build a cleanup context serving the consumer metrics on their own port.
+
+    :param host: Host to listen on.
+    :param port: Port to listen on.
+    :return: The cleanup context.
+    """
+
+    async def serve_metrics(app):
+        runner = await start_metrics_server(
+            app[metrics_key].registry, host, port
+        )
+        yield
+        await runner.cleanup()
+
+    return serve_metrics
@@ -0,0 +1,304 @@
+import codecs
+import json
+
+from runtime import codec
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+WHITESPACE = " \t\n\r"
+READ_CHUNK_SIZE = 64 * 1024
+DECODER = json.JSONDecoder()
+
+JSON_CONTENT_TYPE = "application/json"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class MalformedBodyError(ValueError):
+    """
+    Raised when the request body cannot be decoded in its wire format.
+    """
+
+
+class InvalidEventDataError(ValueError):
+    """
+    Raised when the request body decodes but is not a list of events.
+    """
+
+
+class PayloadTooLargeError(ValueError):
+    """
+    Raised when the request body exceeds the configured size limit.
+    """
+
+
+class TooManyEventsError(ValueError):
+    """
+    Raised when a request carries more events than the configured limit.
+    """
+
+
+def is_valid_event(item):
+    """
+    Check that an item is an event with string type and payload, and a
+    string ``event_id`` if it has one.
+
+    :param item: Decoded JSON value.
+    :return: True if the item is a valid event.
+    """
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get("event_type"), str)
+        and isinstance(item.get("event_payload"), str)
+        and isinstance(item.get("event_id", ""), str)
+    )
+
+
+class BodyReader:
+    def __init__(self, content, max_body_size, chunk_size=READ_CHUNK_SIZE):
+        """
+        Initialize the BodyReader.
+
+        Decodes a request body stream into text in bounded chunks, keeping
+        only the unconsumed part of the text in memory.
+
+        :param content: The request body stream.
+        :param max_body_size: Maximum number of body bytes to read.
+        :param chunk_size: Number of bytes to read at a time.
+        """
+        self.content = content
+        self.max_body_size = max_body_size
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.bytes_read = 0
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    async def fill(self, min_size=0):
+        """
+        Append the next chunks of the body to the buffer.
+
+        Reads at least one chunk, and keeps reading until more than
+        ``min_size`` characters were added or the body is exhausted. The
+        buffer is rebuilt once per call, so callers waiting for a large
+        value can grow it geometrically and keep the total work linear.
+
+        :param min_size: Number of characters to exceed before stopping.
+        :return: False if the body is exhausted.
+        """
+        if self.eof:
+            return False
+        texts = []
+        size = 0
+        while not self.eof and size <= min_size:
+            chunk = await self.content.read(self.chunk_size)
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self.max_body_size:
+                raise PayloadTooLargeError("Request body too large")
+            try:
+                text = self.decoder.decode(chunk, final=not chunk)
+            except UnicodeDecodeError as e:
+                raise MalformedBodyError(str(e))
+            texts.append(text)
+            size += len(text)
+            if not chunk:
+                self.eof = True
+        self.buffer = self.buffer[self.pos :] + "".join(texts)
+        self.pos = 0
+        return True
+
+    def unconsumed(self):
+        """
+        Number of buffered characters not consumed yet.
+        """
+        return len(self.buffer) - self.pos
+
+    async def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        :return: The next character, or an empty string at the end of the
+            body.
+        """
+        while True:
+            while self.pos < len(self.buffer):
+                if self.buffer[self.pos] not in WHITESPACE:
+                    return self.buffer[self.pos]
+                self.pos += 1
+            if not await self.fill():
+                return ""
+
+    async def read_rest(self):
+        """
+        Consume and return the remainder of the body.
+
+        :return: The unconsumed text.
+        """
+        while await self.fill(self.unconsumed()):
+            pass
+        rest, self.buffer, self.pos = self.buffer[self.pos :], "", 0
+        return rest
+
+
+async def iter_json_array(content, max_body_size, chunk_size=READ_CHUNK_SIZE):
+    """
+    Incrementally parse a top-level JSON array, yielding each element as soon
+    as it is complete.
+
+    :param content: The request body stream.
+    :param max_body_size: Maximum number of body bytes to read.
+    :param chunk_size: Number of bytes to read at a time.
+    :raises MalformedBodyError: If the body is not valid JSON.
+    :raises InvalidEventDataError: If the body is valid JSON but not a list.
+    :raises PayloadTooLargeError: If the body exceeds ``max_body_size``.
+    """
+    reader = BodyReader(content, max_body_size, chunk_size)
+    if await reader.peek() != "[":
+        try:
+            codec.loads(await reader.read_rest())
+        except ValueError as e:
+            raise MalformedBodyError(str(e))
+        raise InvalidEventDataError("Request body is not a list")
+    reader.pos += 1
+
+    first = True
+    while True:
+        char = await reader.peek()
+        if char == "]" and first:
+            reader.pos += 1
+            break
+        while True:
+            try:
+                item, end = DECODER.raw_decode(reader.buffer, reader.pos)
+            except json.JSONDecodeError as e:
+                # Doubling the text before retrying bounds the number of
+                # attempts at a large element by the log of its size.
+                if not await reader.fill(reader.unconsumed()):
+                    raise MalformedBodyError(str(e))
+                continue
+            # A number that ends exactly at the end of the buffer may be
+            # truncated, so it is only trusted once more text follows.
+            if (
+                end == len(reader.buffer)
+                and not isinstance(item, (dict, list, str))
+                and await reader.fill()
+            ):
+                continue
+            break
+        reader.pos = end
+        first = False
+        yield item
+
+        char = await reader.peek()
+        reader.pos += 1
+        if char == "]":
+            break
+        if char != ",":
+            raise MalformedBodyError("Expected ',' or ']' after array element")
+
+    if await reader.peek():
+        raise MalformedBodyError("Extra data after JSON array")
+
+
+async def iter_ndjson(content, max_body_size, chunk_size=READ_CHUNK_SIZE):
+    """
+    Incrementally parse newline-delimited JSON, yielding one value per
+    non-empty line.
+
+    :param content: The request body stream.
+    :param max_body_size: Maximum number of body bytes to read.
+    :param chunk_size: Number of bytes to read at a time.
+    :raises MalformedBodyError: If a line is not valid JSON.
+    :raises PayloadTooLargeError: If the body exceeds ``max_body_size``.
+    """
+    reader = BodyReader(content, max_body_size, chunk_size)
+    scan_from = 0
+    while True:
+        newline = reader.buffer.find("\n", reader.pos + scan_from)
+        if newline == -1:
+            scan_from = reader.unconsumed()
+            if await reader.fill(scan_from):
+                continue
+            newline = len(reader.buffer)
+        line = reader.buffer[reader.pos : newline]
+        reader.pos = newline + 1
+        scan_from = 0
+        if line.strip():
+            try:
+                yield codec.loads(line)
+            except ValueError as e:
+                raise MalformedBodyError(str(e))
+        if reader.eof and reader.pos >= len(reader.buffer):
+            return
+
+
+async def iter_msgpack(content, max_body_size, chunk_size=READ_CHUNK_SIZE):
+    """
+    Incrementally parse a msgpack array, yielding each element as soon as it
+    is complete.
+
+    :param content: The request body stream.
+    :param max_body_size: Maximum number of body bytes to read.
+    :param chunk_size: Number of bytes to read at a time.
+    :raises MalformedBodyError: If the body is not valid msgpack.
+    :raises InvalidEventDataError: If the body is valid msgpack but not a
+        list.
+    :raises PayloadTooLargeError: If the body exceeds ``max_body_size``.
+    """
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=max_body_size)
+    bytes_read = 0
+
+    async def feed():
+        nonlocal bytes_read
+        chunk = await content.read(chunk_size)
+        if not chunk:
+            return False
+        bytes_read += len(chunk)
+        if bytes_read > max_body_size:
+            raise PayloadTooLargeError("Request body too large")
+        unpacker.feed(chunk)
+        return True
+
+    async def next_value(read, header=False):
+        while True:
+            try:
+                return read()
+            except msgpack.OutOfData:
+                if not await feed():
+                    raise MalformedBodyError("Truncated msgpack body")
+            except msgpack.FormatError as e:
+                raise MalformedBodyError(str(e))
+            except ValueError as e:
+                if header:
+                    raise InvalidEventDataError(str(e))
+                raise MalformedBodyError(str(e))
+
+    length = await next_value(unpacker.read_array_header, header=True)
+    for _ in range(length):
+        yield await next_value(unpacker.unpack)
+
+    if await feed() or unpacker.tell() < bytes_read:
+        raise MalformedBodyError("Extra data after msgpack array")
+
+
+def get_body_parser(content_type):
+    """
+    Select the incremental parser for a request content type.
+
+    Unknown content types are parsed as JSON.
+
+    :param content_type: The request content type.
+    :return: A tuple of the parser and the wire format name, or ``None`` if
+        the content type is known but its decoder is not installed.
+    """
+    if content_type == NDJSON_CONTENT_TYPE:
+        return iter_ndjson, "NDJSON"
+    if content_type in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            return None
+        return iter_msgpack, "msgpack"
+    return iter_json_array, "JSON"
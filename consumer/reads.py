@@ -0,0 +1,170 @@
+import logging
+
+import aiosqlite
+from aiohttp import web
+
+from runtime import codec
+
+from .backends import EventFilter, backend_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_FETCH_SIZE = 1000
+
+
+def int_param(request, name, default=None, minimum=0, maximum=None):
+    """
+    Read an optional integer query parameter.
+
+    :param request: The incoming request object.
+    :param name: Name of the query parameter.
+    :param default: Value used when the parameter is missing.
+    :param minimum: Smallest accepted value.
+    :param maximum: Largest accepted value.
+    :return: The parameter value.
+    :raises web.HTTPBadRequest: If the value is not an accepted integer.
+    """
+    raw = request.query.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        value = None
+    if (
+        value is None
+        or value < minimum
+        or (maximum is not None and value > maximum)
+    ):
+        raise web.HTTPBadRequest(
+            text=codec.dumps({"error": f"Invalid query parameter: {name}"}),
+            content_type="application/json",
+        )
+    return value
+
+
+def build_filters(request):
+    """
+    Build the filter shared by the read endpoints.
+
+    Supported filters are ``event_type`` and the exclusive id bounds
+    ``after_id`` and ``before_id``.
+
+    :param request: The incoming request object.
+    :return: The EventFilter.
+    """
+    return EventFilter(
+        event_type=request.query.get("event_type"),
+        after_id=int_param(request, "after_id"),
+        before_id=int_param(request, "before_id"),
+    )
+
+
+def row_to_event(row):
+    """
+    Convert a result row into an event dictionary.
+
+    :param row: An ``(id, event_type, event_payload, received_at)`` row.
+    :return: The event dictionary.
+    """
+    return {
+        "id": row[0],
+        "event_type": row[1],
+        "event_payload": row[2],
+        "received_at": row[3],
+    }
+
+
+async def handle_list_events(request):
+    """
+    Return one page of stored events in id order.
+
+    Pages are keyset-paginated: pass the returned ``next_after_id`` as
+    ``after_id`` to fetch the next page.
+
+    :param request: The incoming request object.
+    :return: A JSON response with the events and the next page cursor.
+    """
+    filters = build_filters(request)
+    limit = int_param(
+        request, "limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE
+    )
+    try:
+        rows = await request.app[backend_key].fetch_events(filters, limit)
+    except aiosqlite.DatabaseError as db_err:
+        logger.error(f"Database error: {db_err}")
+        return web.json_response(
+            {"error": "Database operation failed"},
+            status=500,
+            dumps=codec.dumps,
+        )
+    next_after_id = rows[-1][0] if len(rows) == limit else None
+    return web.json_response(
+        {
+            "events": [row_to_event(row) for row in rows],
+            "next_after_id": next_after_id,
+        },
+        dumps=codec.dumps,
+    )
+
+
+async def handle_count_events(request):
+    """
+    Return the number of stored events per event type.
+
+    :param request: The incoming request object.
+    :return: A JSON response mapping event types to counts.
+    """
+    filters = build_filters(request)
+    try:
+        counts = await request.app[backend_key].count_events(filters)
+    except aiosqlite.DatabaseError as db_err:
+        logger.error(f"Database error: {db_err}")
+        return web.json_response(
+            {"error": "Database operation failed"},
+            status=500,
+            dumps=codec.dumps,
+        )
+    return web.json_response({"counts": counts}, dumps=codec.dumps)
+
+
+async def handle_export_events(request):
+    """
+    Stream all matching events as NDJSON.
+
+    Rows are fetched from server-side cursors in fixed-size chunks and
+    written as they arrive, so memory use does not depend on the result size.
+
+    :param request: The incoming request object.
+    :return: A streaming NDJSON response.
+    """
+    filters = build_filters(request)
+    response = web.StreamResponse(
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    await response.prepare(request)
+    chunks = request.app[backend_key].export_events(filters, EXPORT_FETCH_SIZE)
+    try:
+        async for rows in chunks:
+            await response.write(
+                "".join(
+                    codec.dumps(row_to_event(row)) + "\n" for row in rows
+                ).encode()
+            )
+    finally:
+        await chunks.aclose()
+    await response.write_eof()
+    return response
+
+
+def setup_read_routes(app):
+    """
+    Register the read endpoints on the application.
+
+    :param app: The web application.
+    """
+    app.router.add_get("/events", handle_list_events)
+    app.router.add_get("/events/counts", handle_count_events)
+    app.router.add_get("/events/export", handle_export_events)
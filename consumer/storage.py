@@ -0,0 +1,562 @@
+import datetime
+import logging
+import re
+import time
+
+from .lookup import LookupTable
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DAY = "day"
+WINDOW_HOUR = "hour"
+WINDOW_FORMATS = {WINDOW_DAY: "%Y%m%d", WINDOW_HOUR: "%Y%m%d%H"}
+WINDOW_SECONDS = {WINDOW_DAY: 24 * 3600, WINDOW_HOUR: 3600}
+
+VIEW_NAME = "received_events"
+PARTITION_PREFIX = "received_events_p"
+PARTITION_NAME = re.compile(r"received_events_p(\d{8}|\d{10})")
+SEQUENCE_TABLE = "received_events_sequence"
+TYPES_TABLE = "received_events_types"
+PAYLOADS_TABLE = "received_events_payloads"
+EVENT_IDS_TABLE = "received_events_ids"
+ENCODING_NONE = "none"
+ENCODING_TYPES = "types"
+ENCODING_TYPES_AND_PAYLOADS = "types_and_payloads"
+ENCODINGS = (ENCODING_NONE, ENCODING_TYPES, ENCODING_TYPES_AND_PAYLOADS)
+# Partition receiving the rows of a database created before partitioning.
+LEGACY_PARTITION = "19700101"
+# SQLite rejects compound SELECTs with more terms than this.
+MAX_COMPOUND_TERMS = 500
+# Stays below the smallest SQLITE_MAX_VARIABLE_NUMBER of supported builds.
+MAX_VARIABLES = 500
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def partition_start(key):
+    """
+    Compute the start of a partition's time window.
+
+    :param key: The partition key, ``YYYYMMDD`` or ``YYYYMMDDHH`` in UTC.
+    :return: The window start as a Unix timestamp.
+    """
+    window = WINDOW_DAY if len(key) == 8 else WINDOW_HOUR
+    start = datetime.datetime.strptime(key, WINDOW_FORMATS[window])
+    return start.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def partition_end(key):
+    """
+    Compute the end of a partition's time window.
+
+    :param key: The partition key.
+    :return: The window end as a Unix timestamp.
+    """
+    window = WINDOW_DAY if len(key) == 8 else WINDOW_HOUR
+    return partition_start(key) + WINDOW_SECONDS[window]
+
+
+def table_name(key):
+    """
+    Name of the table holding a partition.
+
+    :param key: The partition key.
+    :return: The table name.
+    """
+    return f"{PARTITION_PREFIX}{key}"
+
+
+class PartitionedStorage:
+    def __init__(
+        self,
+        db,
+        window=WINDOW_DAY,
+        retention_hours=None,
+        clock=None,
+        dictionary_encoding=ENCODING_NONE,
+        intern_cache_size=100_000,
+    ):
+        """
+        Initialize the PartitionedStorage.
+
+        Events are stored in one table per UTC day or hour, and the
+        ``received_events`` view unions all of them. Ids are allocated here
+        from a persistent sequence, so they stay unique and increasing across
+        partitions. Expired partitions are dropped as whole tables.
+
+        Stored event ids are kept in one table outside the partitions, so a
+        repeated id is rejected whichever partition holds the first event.
+        An id is forgotten when retention drops the partition of its event.
+
+        With dictionary encoding, new partitions store event types, and
+        optionally payloads, as ids into lookup tables, and the view joins
+        them back. Each partition keeps the layout it was created with, so
+        the setting may change on existing data.
+
+        :param db: The database connection owned by the writer.
+        :param window: Partition window, ``"day"`` or ``"hour"``.
+        :param retention_hours: Hours after which a partition is dropped, or
+            ``None`` to keep events forever.
+        :param clock: Wall clock function, for testing.
+        :param dictionary_encoding: ``"none"``, ``"types"`` or
+            ``"types_and_payloads"``.
+        :param intern_cache_size: Maximum number of lookup ids cached per
+            lookup table.
+        :raises ValueError: If the window or the encoding is unknown.
+        """
+        if window not in WINDOW_FORMATS:
+            raise ValueError(f"Unknown partition window: {window}")
+        if dictionary_encoding not in ENCODINGS:
+            raise ValueError(
+                f"Unknown dictionary encoding: {dictionary_encoding}"
+            )
+        self.db = db
+        self.window = window
+        self.retention_hours = retention_hours
+        self.clock = clock or time.time
+        self.dictionary_encoding = dictionary_encoding
+        self.types = LookupTable(db, TYPES_TABLE, intern_cache_size)
+        self.payloads = LookupTable(db, PAYLOADS_TABLE, intern_cache_size)
+        self.partitions = []
+        # Whether the type and the payload of each partition are encoded.
+        self.layouts = {}
+        self.next_id = 1
+        self.last_insert = None
+        self.incremental_vacuum = False
+
+    def partition_key(self, timestamp):
+        """
+        Key of the partition a timestamp falls into.
+
+        :param timestamp: A Unix timestamp.
+        :return: The partition key.
+        """
+        moment = datetime.datetime.fromtimestamp(
+            timestamp, datetime.timezone.utc
+        )
+        return moment.strftime(WINDOW_FORMATS[self.window])
+
+    async def begin(self):
+        """
+        Open a transaction if none is active, so schema changes commit
+        together with the rows that need them.
+        """
+        if not self.db.in_transaction:
+            await self.db.execute("BEGIN")
+
+    async def init(self):
+        """
+        Create the sequence, the current partition and the view, moving the
+        table of an unpartitioned database into a partition first.
+        """
+        await self.migrate_legacy_table()
+        await self.begin()
+        await self.db.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEQUENCE_TABLE} "
+            "(next_id INTEGER NOT NULL)"
+        )
+        if self.dictionary_encoding != ENCODING_NONE:
+            await self.types.create()
+            await self.payloads.create()
+        await self.load()
+        for key in self.partitions:
+            await self.add_event_id_column(key)
+        await self.create_event_ids_table()
+        rows = await self.db.execute_fetchall(
+            f"SELECT next_id FROM {SEQUENCE_TABLE}"
+        )
+        if not rows:
+            await self.db.execute(
+                f"INSERT INTO {SEQUENCE_TABLE} (next_id) VALUES (?)",
+                (self.next_id,),
+            )
+        await self.ensure_partition(self.partition_key(self.clock()))
+        await self.rebuild_view()
+        await self.db.commit()
+
+        ((mode,),) = await self.db.execute_fetchall("PRAGMA auto_vacuum")
+        self.incremental_vacuum = mode == AUTO_VACUUM_INCREMENTAL
+        if not self.incremental_vacuum:
+            logger.info(
+                "Incremental vacuum is off for this database; run "
+                "'PRAGMA auto_vacuum=INCREMENTAL; VACUUM;' once to enable it"
+            )
+
+    async def migrate_legacy_table(self):
+        """
+        Turn a ``received_events`` table from before partitioning into the
+        oldest partition.
+        """
+        rows = await self.db.execute_fetchall(
+            "SELECT type FROM sqlite_master WHERE name = ?", (VIEW_NAME,)
+        )
+        if not rows or rows[0][0] != "table":
+            return
+        columns = await self.db.execute_fetchall(
+            f"PRAGMA table_info({VIEW_NAME})"
+        )
+        await self.begin()
+        if "received_at" not in [column[1] for column in columns]:
+            await self.db.execute(
+                f"ALTER TABLE {VIEW_NAME} ADD COLUMN received_at REAL"
+            )
+        legacy_table = table_name(LEGACY_PARTITION)
+        await self.db.execute(
+            f"ALTER TABLE {VIEW_NAME} RENAME TO {legacy_table}"
+        )
+        await self.db.commit()
+        logger.info(f"Moved existing events into partition {legacy_table}")
+
+    async def load(self):
+        """
+        Read the existing partitions and the next id from the database.
+        """
+        rows = await self.db.execute_fetchall(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+        keys = []
+        for (name,) in rows:
+            match = PARTITION_NAME.fullmatch(name)
+            if match:
+                keys.append(match.group(1))
+        self.partitions = sorted(keys, key=partition_start)
+        self.layouts = {}
+        for key in self.partitions:
+            columns = await self.db.execute_fetchall(
+                f"PRAGMA table_info({table_name(key)})"
+            )
+            names = {column[1] for column in columns}
+            self.layouts[key] = ("type_id" in names, "payload_id" in names)
+        # Ids added by a rolled back transaction no longer exist.
+        self.types.clear()
+        self.payloads.clear()
+
+        rows = await self.db.execute_fetchall(
+            f"SELECT next_id FROM {SEQUENCE_TABLE}"
+        )
+        if rows:
+            self.next_id = rows[0][0]
+            return
+        max_id = 0
+        for key in self.partitions:
+            ((partition_max,),) = await self.db.execute_fetchall(
+                f"SELECT MAX(id) FROM {table_name(key)}"
+            )
+            max_id = max(max_id, partition_max or 0)
+        self.next_id = max_id + 1
+
+    async def add_event_id_column(self, key):
+        """
+        Add the ``event_id`` column to a partition created before event ids
+        existed.
+
+        :param key: The partition key.
+        """
+        table = table_name(key)
+        columns = await self.db.execute_fetchall(f"PRAGMA table_info({table})")
+        if "event_id" not in [column[1] for column in columns]:
+            await self.db.execute(
+                f"ALTER TABLE {table} ADD COLUMN event_id TEXT"
+            )
+
+    async def create_event_ids_table(self):
+        """
+        Create the table of stored event ids, filling it from the partitions
+        of a database whose ids were only indexed per partition.
+        """
+        rows = await self.db.execute_fetchall(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (EVENT_IDS_TABLE,)
+        )
+        if rows:
+            return
+        await self.db.execute(
+            f"""
+            CREATE TABLE {EVENT_IDS_TABLE} (
+                event_id TEXT PRIMARY KEY,
+                partition TEXT NOT NULL
+            ) WITHOUT ROWID
+        """
+        )
+        for key in self.partitions:
+            table = table_name(key)
+            await self.db.execute(
+                f"INSERT OR IGNORE INTO {EVENT_IDS_TABLE} "
+                f"SELECT event_id, ? FROM {table} WHERE event_id IS NOT NULL",
+                (key,),
+            )
+            await self.db.execute(f"DROP INDEX IF EXISTS {table}_event_id")
+
+    async def claim_event_ids(self, rows, key):
+        """
+        Record the event ids of rows about to be stored in a partition.
+
+        :param rows: ``(event_type, event_payload, event_id)`` tuples.
+        :param key: The partition key.
+        :return: The positions in ``rows`` whose id is already stored or
+            repeats an earlier row.
+        """
+        positions = {}
+        skipped = set()
+        for i, row in enumerate(rows):
+            if row[2] is None:
+                continue
+            if row[2] in positions:
+                skipped.add(i)
+            else:
+                positions[row[2]] = i
+        if not positions:
+            return skipped
+        ids = list(positions)
+        for start in range(0, len(ids), MAX_VARIABLES):
+            chunk = ids[start : start + MAX_VARIABLES]
+            stored = await self.db.execute_fetchall(
+                f"SELECT event_id FROM {EVENT_IDS_TABLE} "
+                f"WHERE event_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for (event_id,) in stored:
+                skipped.add(positions.pop(event_id))
+        await self.db.executemany(
+            f"INSERT INTO {EVENT_IDS_TABLE} (event_id, partition) "
+            "VALUES (?, ?)",
+            [(event_id, key) for event_id in positions],
+        )
+        return skipped
+
+    async def ensure_partition(self, key):
+        """
+        Create a partition and add it to the view if it does not exist yet.
+
+        :param key: The partition key.
+        """
+        if key in self.partitions:
+            return
+        table = table_name(key)
+        encode_types = self.dictionary_encoding != ENCODING_NONE
+        encode_payloads = (
+            self.dictionary_encoding == ENCODING_TYPES_AND_PAYLOADS
+        )
+        type_column = "type_id INTEGER" if encode_types else "event_type TEXT"
+        payload_column = (
+            "payload_id INTEGER" if encode_payloads else "event_payload TEXT"
+        )
+        await self.begin()
+        await self.db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                {type_column} NOT NULL,
+                {payload_column} NOT NULL,
+                received_at REAL,
+                event_id TEXT
+            )
+        """
+        )
+        # Serves event_type filters in id order and the per-type counts.
+        await self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_type_id "
+            f"ON {table} ({type_column.split()[0]}, id)"
+        )
+        self.layouts[key] = (encode_types, encode_payloads)
+        self.partitions = sorted([*self.partitions, key], key=partition_start)
+        await self.rebuild_view()
+        logger.info(f"Created partition {table}")
+
+    def partition_select(self, key):
+        """
+        Query of the view reading one partition, decoding its lookup ids.
+
+        :param key: The partition key.
+        :return: The SELECT statement.
+        """
+        table = table_name(key)
+        encode_types, encode_payloads = self.layouts[key]
+        event_type = "t.value" if encode_types else "p.event_type"
+        event_payload = "v.value" if encode_payloads else "p.event_payload"
+        query = (
+            f"SELECT p.id AS id, {event_type} AS event_type, "
+            f"{event_payload} AS event_payload, p.received_at AS received_at "
+            f"FROM {table} AS p"
+        )
+        if encode_types:
+            query += f" JOIN {TYPES_TABLE} AS t ON t.id = p.type_id"
+        if encode_payloads:
+            query += f" JOIN {PAYLOADS_TABLE} AS v ON v.id = p.payload_id"
+        return query
+
+    async def rebuild_view(self):
+        """
+        Recreate the ``received_events`` view over all partitions.
+        """
+        selects = [self.partition_select(key) for key in self.partitions]
+        groups = [
+            " UNION ALL ".join(selects[i : i + MAX_COMPOUND_TERMS])
+            for i in range(0, len(selects), MAX_COMPOUND_TERMS)
+        ]
+        if len(groups) == 1:
+            body = groups[0]
+        else:
+            body = " UNION ALL ".join(
+                f"SELECT * FROM ({group})" for group in groups
+            )
+        await self.db.execute(f"DROP VIEW IF EXISTS {VIEW_NAME}")
+        await self.db.execute(f"CREATE VIEW {VIEW_NAME} AS {body}")
+
+    async def insert(self, rows):
+        """
+        Insert rows into the current partition without committing.
+
+        Rows whose event id is already stored in any partition, or repeats
+        an earlier row, are skipped; their ids are left unused. The first id
+        and the ``received_at`` time of the rows are kept in
+        ``last_insert``. Types and payloads are replaced by their lookup ids
+        when the partition encodes them.
+
+        :param rows: ``(event_type, event_payload, event_id)`` tuples to
+            insert. The event id may be ``None``.
+        :return: The positions in ``rows`` of the skipped rows.
+        """
+        received_at = self.clock()
+        key = self.partition_key(received_at)
+        table = table_name(key)
+        await self.ensure_partition(key)
+        encode_types, encode_payloads = self.layouts[key]
+        skipped = await self.claim_event_ids(rows, key)
+        first_id = self.next_id
+        self.next_id += len(rows)
+        self.last_insert = (first_id, received_at)
+        if skipped:
+            positions = [i for i in range(len(rows)) if i not in skipped]
+            rows = [rows[i] for i in positions]
+        else:
+            positions = range(len(rows))
+        event_types = [row[0] for row in rows]
+        event_payloads = [row[1] for row in rows]
+        if encode_types:
+            event_types = await self.types.ids(event_types)
+        if encode_payloads:
+            event_payloads = await self.payloads.ids(event_payloads)
+        type_column = "type_id" if encode_types else "event_type"
+        payload_column = "payload_id" if encode_payloads else "event_payload"
+        # The statement text only changes with the partition, so sqlite3
+        # reuses the prepared statement from its cache.
+        await self.db.executemany(
+            f"INSERT INTO {table} "
+            f"(id, {type_column}, {payload_column}, event_id, received_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (first_id + i, event_type, event_payload, row[2], received_at)
+                for i, event_type, event_payload, row in zip(
+                    positions, event_types, event_payloads, rows
+                )
+            ],
+        )
+        await self.db.execute(
+            f"UPDATE {SEQUENCE_TABLE} SET next_id = ?", (self.next_id,)
+        )
+        return skipped
+
+    async def commit(self):
+        """
+        Commit the current transaction.
+        """
+        await self.db.commit()
+
+    async def rollback(self):
+        """
+        Roll back the current transaction and reload the state it changed.
+        """
+        await self.db.rollback()
+        await self.load()
+
+    async def drop_expired(self):
+        """
+        Drop the partitions whose window ended before the retention period.
+
+        Each partition goes with a single ``DROP TABLE``; no rows are
+        deleted one by one.
+
+        :return: The keys of the dropped partitions.
+        """
+        if self.retention_hours is None:
+            return []
+        cutoff = self.clock() - self.retention_hours * 3600
+        expired = [
+            key for key in self.partitions if partition_end(key) <= cutoff
+        ]
+        if not expired:
+            return []
+        await self.begin()
+        try:
+            # Keep the view non-empty when no event arrived in this window.
+            await self.ensure_partition(self.partition_key(self.clock()))
+            for key in expired:
+                await self.db.execute(f"DROP TABLE {table_name(key)}")
+            for start in range(0, len(expired), MAX_VARIABLES):
+                chunk = expired[start : start + MAX_VARIABLES]
+                await self.db.execute(
+                    f"DELETE FROM {EVENT_IDS_TABLE} "
+                    f"WHERE partition IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+            self.partitions = [
+                key for key in self.partitions if key not in expired
+            ]
+            await self.rebuild_view()
+            if any(self.layouts.pop(key)[1] for key in expired):
+                await self.prune_payloads()
+            await self.db.commit()
+        except Exception:
+            await self.rollback()
+            raise
+        logger.info(f"Dropped {len(expired)} expired partition(s)")
+        return expired
+
+    async def prune_payloads(self):
+        """
+        Delete the lookup payloads no partition refers to any more.
+        """
+        selects = [
+            f"SELECT payload_id FROM {table_name(key)}"
+            for key in self.partitions
+            if self.layouts[key][1]
+        ]
+        conditions = [
+            "id NOT IN ("
+            + " UNION ALL ".join(selects[i : i + MAX_COMPOUND_TERMS])
+            + ")"
+            for i in range(0, len(selects), MAX_COMPOUND_TERMS)
+        ]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = await self.db.execute(f"DELETE FROM {PAYLOADS_TABLE} {where}")
+        self.payloads.clear()
+        logger.info(f"Pruned {cursor.rowcount} unused payload(s)")
+
+    async def vacuum(self, pages):
+        """
+        Return up to ``pages`` free pages to the file system.
+
+        :param pages: Maximum number of pages to release.
+        :return: The number of pages released.
+        """
+        if not self.incremental_vacuum:
+            return 0
+        ((free_pages,),) = await self.db.execute_fetchall(
+            "PRAGMA freelist_count"
+        )
+        if not free_pages:
+            return 0
+        # sqlite3's execute() steps the pragma once, releasing a single page;
+        # executescript() runs it to completion.
+        await self.db.executescript(f"PRAGMA incremental_vacuum({pages})")
+        return min(free_pages, pages)
+
+    async def maintain(self, vacuum_pages):
+        """
+        Apply the retention policy and compact the database file.
+
+        :param vacuum_pages: Maximum number of pages to release.
+        """
+        await self.drop_expired()
+        released = await self.vacuum(vacuum_pages)
+        if released:
+            logger.info(f"Released {released} free page(s)")
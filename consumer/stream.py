@@ -0,0 +1,402 @@
+import asyncio
+import contextlib
+import logging
+
+import aiosqlite
+from aiohttp import web
+
+from runtime import codec
+
+from .backends import EventFilter, backend_key
+from .reads import EXPORT_FETCH_SIZE, int_param, row_to_event
+
+logger = logging.getLogger(__name__)
+
+SLOW_POLICY_DROP = "drop"
+SLOW_POLICY_DISCONNECT = "disconnect"
+SLOW_POLICIES = (SLOW_POLICY_DROP, SLOW_POLICY_DISCONNECT)
+# Seconds without events after which a comment keeps the stream open
+# through proxies.
+KEEPALIVE_INTERVAL = 15.0
+# Frames written to a subscriber at once.
+MAX_WRITE_FRAMES = 1000
+KEEPALIVE_FRAME = b": keepalive\n\n"
+# SSE ends a field at CR, LF or CRLF.
+LINE_BREAKS = str.maketrans("\r\n", "  ")
+
+
+def encode_event(row):
+    """
+    Encode a stored event as a Server-Sent Events frame.
+
+    Line breaks in the event type would end the ``event`` field and let
+    the type inject fields or frames, so they become spaces there; the
+    ``data`` field keeps the exact type.
+
+    :param row: An ``(id, event_type, event_payload, received_at)`` row.
+    :return: The frame, with the event id as the SSE ``id`` field.
+    """
+    data = codec.dumps(row_to_event(row))
+    event_type = row[1].translate(LINE_BREAKS)
+    return f"id: {row[0]}\nevent: {event_type}\ndata: {data}\n\n".encode()
+
+
+class Subscriber:
+    def __init__(self, event_type=None, queue_size=1000):
+        """
+        Initialize the Subscriber.
+
+        :param event_type: Only receive events of this type, or ``None`` for
+            all events.
+        :param queue_size: Maximum number of frames waiting to be written.
+        """
+        self.event_type = event_type
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+
+    def close(self):
+        """
+        End the subscription, discarding the frames not written yet.
+        """
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class StreamHub:
+    def __init__(
+        self,
+        backend,
+        queue_size=1000,
+        slow_policy=SLOW_POLICY_DISCONNECT,
+        poll_interval=0.5,
+        metrics=None,
+    ):
+        """
+        Initialize the StreamHub.
+
+        Pushes stored events to live subscribers. Commits of this process
+        are received from the writers, so they cost no query; shards written
+        by other worker processes are polled from a per-shard cursor while
+        anyone is subscribed. Each event is encoded once and the same frame
+        is queued for every matching subscriber. A subscriber whose queue is
+        full either loses the event or is disconnected, so a slow client
+        never holds up ingest or other subscribers.
+
+        :param backend: The StorageBackend events are read from.
+        :param queue_size: Maximum number of frames waiting per subscriber.
+        :param slow_policy: ``"disconnect"`` to close the stream of a
+            subscriber that falls behind, so it can resume from its last
+            event id, or ``"drop"`` to skip events for it.
+        :param poll_interval: Seconds between polls of shards written by
+            other processes.
+        :param metrics: Optional ConsumerMetrics counting slow subscribers.
+        :raises ValueError: If the slow policy is unknown.
+        """
+        if slow_policy not in SLOW_POLICIES:
+            raise ValueError(f"Unknown slow subscriber policy: {slow_policy}")
+        self.backend = backend
+        self.queue_size = queue_size
+        self.slow_policy = slow_policy
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        self.shards = backend.shard_backends()
+        self.subscribers = set()
+        self.by_type = {}
+        self.all_types = set()
+        self.cursors = {}
+        self.listening = False
+        self.poll_task = None
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    async def subscribe(self, event_type=None):
+        """
+        Add a subscriber. The first one starts listening for commits.
+
+        :param event_type: Only receive events of this type, or ``None``.
+        :return: The Subscriber.
+        """
+        first = not self.subscribers
+        subscriber = Subscriber(event_type, self.queue_size)
+        self.subscribers.add(subscriber)
+        if event_type is None:
+            self.all_types.add(subscriber)
+        else:
+            self.by_type.setdefault(event_type, set()).add(subscriber)
+        if first:
+            await self.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+        Remove a subscriber. The last one stops listening for commits.
+
+        :param subscriber: The Subscriber to remove.
+        """
+        if subscriber not in self.subscribers:
+            return
+        self.subscribers.discard(subscriber)
+        if subscriber.event_type is None:
+            self.all_types.discard(subscriber)
+        else:
+            members = self.by_type[subscriber.event_type]
+            members.discard(subscriber)
+            if not members:
+                del self.by_type[subscriber.event_type]
+        if not self.subscribers:
+            self.stop()
+
+    async def start(self):
+        """
+        Listen to the writers of this process and start polling the shards
+        it does not write.
+        """
+        self.listening = True
+        for shard in self.shards:
+            if not shard.read_only:
+                shard.add_commit_listener(self.publish)
+        cursors = {}
+        for shard in self.shards:
+            if not shard.read_only:
+                continue
+            try:
+                cursors[shard] = await shard.last_id()
+            except aiosqlite.Error as e:
+                logger.error(f"Not streaming events of {shard.db_path}: {e}")
+        if cursors and self.listening:
+            self.cursors = cursors
+            self.poll_task = asyncio.create_task(self.poll(list(cursors)))
+
+    def stop(self):
+        """
+        Stop listening to the writers and polling.
+        """
+        if not self.listening:
+            return
+        self.listening = False
+        for shard in self.shards:
+            if not shard.read_only:
+                shard.remove_commit_listener(self.publish)
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            self.poll_task = None
+        self.cursors = {}
+
+    async def poll(self, shards):
+        """
+        Publish the events other processes commit to their shards.
+
+        :param shards: The read-only shards to poll.
+        """
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for shard in shards:
+                try:
+                    await self.poll_shard(shard)
+                except aiosqlite.Error as e:
+                    logger.error(f"Polling {shard.db_path} failed: {e}")
+
+    async def poll_shard(self, shard):
+        """
+        Publish the events stored in a shard since its cursor.
+
+        :param shard: The SQLiteBackend to read.
+        """
+        while True:
+            rows = await shard.fetch_events(
+                EventFilter(after_id=self.cursors[shard]), EXPORT_FETCH_SIZE
+            )
+            if not rows:
+                return
+            self.cursors[shard] = rows[-1][0]
+            self.publish(rows)
+            if len(rows) < EXPORT_FETCH_SIZE:
+                return
+
+    def publish(self, rows):
+        """
+        Queue stored events for the subscribers they match.
+
+        :param rows: ``(id, event_type, event_payload, received_at)`` rows.
+        """
+        for row in rows:
+            typed = self.by_type.get(row[1])
+            if not typed and not self.all_types:
+                continue
+            item = (row[0], encode_event(row))
+            for subscriber in self.all_types:
+                self.offer(subscriber, item)
+            if typed:
+                for subscriber in typed:
+                    self.offer(subscriber, item)
+
+    def offer(self, subscriber, item):
+        """
+        Queue a frame for a subscriber, applying the slow subscriber policy
+        when its queue is full.
+
+        :param subscriber: The Subscriber.
+        :param item: An ``(id, frame)`` pair.
+        """
+        if subscriber.closed:
+            return
+        try:
+            subscriber.queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.slow_policy == SLOW_POLICY_DROP:
+            subscriber.dropped += 1
+            if self.metrics is not None:
+                self.metrics.stream_events_dropped.inc()
+            return
+        logger.warning("Disconnecting a subscriber that fell behind")
+        if self.metrics is not None:
+            self.metrics.stream_disconnects.inc()
+        subscriber.close()
+
+    async def close(self):
+        """
+        End every subscription so their streams finish on shutdown.
+        """
+        for subscriber in list(self.subscribers):
+            subscriber.close()
+
+
+stream_hub_key = web.AppKey("stream_hub", StreamHub)
+
+
+def resume_id(request):
+    """
+    Id after which a stream resumes, from the ``Last-Event-ID`` header sent
+    by reconnecting SSE clients or the ``after_id`` query parameter.
+
+    :param request: The incoming request object.
+    :return: The id, or ``None`` to only stream new events.
+    :raises web.HTTPBadRequest: If the id is not a non-negative integer.
+    """
+    header = request.headers.get("Last-Event-ID")
+    if header is None:
+        return int_param(request, "after_id")
+    try:
+        value = int(header)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise web.HTTPBadRequest(
+            text=codec.dumps({"error": "Invalid Last-Event-ID header"}),
+            content_type="application/json",
+        )
+    return value
+
+
+async def replay(response, backend, filters):
+    """
+    Write the stored events matching a filter to a stream.
+
+    :param response: The prepared stream response.
+    :param backend: The StorageBackend to read.
+    :param filters: The EventFilter to apply.
+    :return: The largest replayed id per shard number.
+    """
+    shard_count = len(backend.shard_backends())
+    replayed = {}
+    chunks = backend.export_events(filters, EXPORT_FETCH_SIZE)
+    try:
+        async for rows in chunks:
+            for row in rows:
+                replayed[row[0] % shard_count] = row[0]
+            await response.write(b"".join(map(encode_event, rows)))
+    finally:
+        await chunks.aclose()
+    return replayed
+
+
+async def handle_stream(request):
+    """
+    Stream stored events to the client as Server-Sent Events.
+
+    Only events stored after the subscription are sent, unless the client
+    resumes from an id: the events after it are then replayed from storage
+    before the live ones, skipping live events already replayed. The
+    ``event_type`` query parameter restricts the stream to one type.
+
+    :param request: The incoming request object.
+    :return: The streaming response.
+    """
+    event_type = request.query.get("event_type")
+    after_id = resume_id(request)
+    hub = request.app[stream_hub_key]
+    backend = request.app[backend_key]
+    shard_count = len(hub.shards)
+    subscriber = await hub.subscribe(event_type)
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        }
+    )
+    try:
+        await response.prepare(request)
+        replayed = {}
+        if after_id is not None:
+            replayed = await replay(
+                response,
+                backend,
+                EventFilter(event_type=event_type, after_id=after_id),
+            )
+        queue = subscriber.queue
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(KEEPALIVE_FRAME)
+                continue
+            items = [item]
+            while item is not None and len(items) < MAX_WRITE_FRAMES:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                items.append(item)
+            frames = [
+                frame
+                for event_id, frame in filter(None, items)
+                if event_id > replayed.get(event_id % shard_count, -1)
+            ]
+            if frames:
+                await response.write(b"".join(frames))
+            if items[-1] is None:
+                break
+    except (ConnectionResetError, aiosqlite.Error) as e:
+        logger.info(f"Event stream closed: {e}")
+    finally:
+        hub.unsubscribe(subscriber)
+    with contextlib.suppress(ConnectionResetError):
+        await response.write_eof()
+    return response
+
+
+async def close_streams(app):
+    """
+    End all event streams when the application shuts down.
+
+    :param app: The web application.
+    """
+    await app[stream_hub_key].close()
+
+
+def setup_stream(app, hub):
+    """
+    Register the event stream endpoint on the application.
+
+    :param app: The web application.
+    :param hub: The StreamHub feeding the streams.
+    """
+    app[stream_hub_key] = hub
+    app.on_shutdown.append(close_streams)
+    app.router.add_get("/events/stream", handle_stream)
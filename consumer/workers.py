@@ -0,0 +1,282 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import socket
+import time
+
+from aiohttp import web
+
+from runtime import PROFILE_STANDARD, use_profile
+from runtime.profile import active as active_profile
+
+from .backends import backend_key
+from .consumer import check_reload, init_app
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the worker processes.
+POLL_INTERVAL = 0.5
+# Seconds to wait for the first worker to accept connections.
+STARTUP_TIMEOUT = 30.0
+
+
+def run_worker(
+    options, index, count, host, port, drain_timeout, profile=PROFILE_STANDARD
+):
+    """
+    Run one consumer worker process until it receives SIGTERM or SIGINT.
+
+    Every worker listens on the same port through SO_REUSEPORT, so the
+    kernel spreads connections over them. Each one writes only to its own
+    shard and reads all shards. On a signal it stops accepting connections,
+    lets in-flight requests finish and flushes its writer.
+
+    :param options: Consumer configuration passed to ``init_app``.
+    :param index: Number of this worker, which is also its shard. A
+        configured ``metrics_port`` is offset by it, so every worker serves
+        its own metrics.
+    :param count: Total number of workers.
+    :param host: Host to listen on.
+    :param port: Port to listen on.
+    :param drain_timeout: Seconds in-flight requests get to finish.
+    :param profile: Runtime profile of the worker.
+    """
+    use_profile(profile)
+    options = dict(options)
+    if options.get("metrics_port") is not None:
+        options["metrics_port"] += index
+    web.run_app(
+        init_app(**options, shards=count, worker_index=index),
+        host=host,
+        port=port,
+        reuse_port=True,
+        shutdown_timeout=drain_timeout,
+        print=None,
+        auto_decompress=False,
+    )
+
+
+class WorkerSupervisor:
+    def __init__(
+        self,
+        options,
+        workers,
+        host,
+        port,
+        drain_timeout=30.0,
+        restart_delay=1.0,
+    ):
+        """
+        Initialize the WorkerSupervisor.
+
+        Runs the consumer in ``workers`` processes and restarts any that
+        crash. ``setup`` and ``cleanup`` mirror ``web.AppRunner``, so the
+        supervisor can take the place of a single-process runner. Workers
+        use the runtime profile of the supervising process.
+
+        Storage is sharded with one shard per worker, so no two processes
+        ever write to the same SQLite file. A configured ``shards`` other
+        than one must equal the worker count, and ``setup`` refuses to start
+        over databases of another shard layout rather than hiding their
+        events.
+
+        :param options: Consumer configuration passed to ``init_app``.
+        :param workers: Number of worker processes.
+        :param host: Host to listen on.
+        :param port: Port to listen on.
+        :param drain_timeout: Seconds a worker gets to finish in-flight
+            requests after SIGTERM before it is killed.
+        :param restart_delay: Seconds to wait before restarting a crashed
+            worker.
+        :raises ValueError: If the platform does not support SO_REUSEPORT,
+            or ``shards`` does not match the worker count.
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("Consumer workers require SO_REUSEPORT support")
+        configured_shards = options.get("shards", 1)
+        if configured_shards not in (1, workers):
+            raise ValueError(
+                f"shards={configured_shards} does not match the {workers} "
+                "consumer workers, each of which owns one shard"
+            )
+        self.options = {
+            key: value for key, value in options.items() if key != "shards"
+        }
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.drain_timeout = drain_timeout
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = [None] * workers
+        self.monitor_task = None
+
+    async def setup(self):
+        """
+        Create the shard databases, start the workers and wait until they
+        accept connections.
+
+        :raises ValueError: If databases of another shard layout exist.
+        """
+        # Workers open the other shards read-only, so they must exist first.
+        app = await init_app(**self.options, shards=self.workers)
+        await app[backend_key].close()
+        for index in range(self.workers):
+            self.spawn(index)
+        await self.wait_ready()
+        self.monitor_task = asyncio.create_task(self.monitor())
+        logger.info(
+            f"Started {self.workers} consumer workers on "
+            f"{self.host}:{self.port}"
+        )
+
+    def spawn(self, index):
+        """
+        Start the process of one worker.
+
+        :param index: Number of the worker.
+        """
+        process = self.context.Process(
+            target=run_worker,
+            args=(
+                self.options,
+                index,
+                self.workers,
+                self.host,
+                self.port,
+                self.drain_timeout,
+                active_profile["profile"],
+            ),
+            name=f"consumer-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def wait_ready(self):
+        """
+        Wait until a worker accepts connections.
+
+        :raises RuntimeError: If no worker is listening in time.
+        """
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Consumer workers did not start")
+                if not any(process.is_alive() for process in self.processes):
+                    raise RuntimeError("Consumer workers exited on startup")
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            writer.close()
+            await writer.wait_closed()
+            return
+
+    async def monitor(self):
+        """
+        Restart workers that exit with an error.
+
+        A worker that exits cleanly was stopped on purpose and is not
+        restarted.
+        """
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if process is None or process.is_alive():
+                    continue
+                if process.exitcode == 0:
+                    logger.info(f"Consumer worker {index} exited")
+                    self.processes[index] = None
+                    continue
+                logger.error(
+                    f"Consumer worker {index} died with exit code "
+                    f"{process.exitcode}, restarting"
+                )
+                await asyncio.sleep(self.restart_delay)
+                self.spawn(index)
+
+    def prepare_reconfigure(self, changes):
+        """
+        Validate options changed by a configuration reload and prepare a
+        rolling restart of the workers with them.
+
+        :param changes: Changed consumer options mapped to their new values.
+        :return: A coroutine function restarting the workers one at a time,
+            so the others keep serving the port meanwhile.
+        :raises ValueError: If an option cannot change at runtime or has an
+            invalid value.
+        """
+        check_reload(changes)
+
+        async def apply():
+            self.options = {**self.options, **changes}
+            if self.monitor_task is not None:
+                self.monitor_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await self.monitor_task
+            try:
+                for index, process in enumerate(self.processes):
+                    if process is None:
+                        continue
+                    await self.stop_worker(index)
+                    self.spawn(index)
+                    await asyncio.sleep(self.restart_delay)
+            finally:
+                self.monitor_task = asyncio.create_task(self.monitor())
+            logger.info(
+                f"Restarted {self.workers} consumer workers with options: "
+                f"{sorted(changes)}"
+            )
+
+        return apply
+
+    async def stop_worker(self, index):
+        """
+        Stop one worker, letting it drain, and kill it if it does not exit
+        in time.
+
+        :param index: Number of the worker.
+        """
+        process = self.processes[index]
+        process.terminate()
+        await asyncio.to_thread(process.join, self.drain_timeout + 5)
+        if process.is_alive():
+            logger.warning(f"Killing consumer worker {index}")
+            process.kill()
+            process.join()
+
+    def join(self, timeout):
+        """
+        Wait for all workers to exit.
+
+        :param timeout: Seconds to wait in total.
+        """
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+
+    async def cleanup(self):
+        """
+        Stop the workers, letting them drain, and kill any that do not exit
+        in time.
+        """
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.monitor_task
+            self.monitor_task = None
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        # Leave time to flush the writers after the drain.
+        await asyncio.to_thread(self.join, self.drain_timeout + 5)
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                logger.warning(f"Killing consumer worker {index}")
+                process.kill()
+                process.join()
+        self.processes = [None] * self.workers
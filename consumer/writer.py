@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EventWriter:
+    def __init__(
+        self,
+        storage,
+        max_queue_size=1000,
+        max_group_events=5000,
+        commit_interval_ms=5,
+        metrics=None,
+    ):
+        """
+        Initialize the EventWriter.
+
+        A single writer task drains a bounded queue of submitted batches and
+        commits them in groups, so one fsync covers many requests. Other
+        tasks that write through the same connection hold ``lock``. Functions
+        in ``listeners`` are called with the stored rows of every commit.
+
+        :param storage: The storage the events are inserted into.
+        :param max_queue_size: Maximum number of batches waiting in the queue.
+        :param max_group_events: Number of events that closes a commit group.
+        :param commit_interval_ms: Maximum time (in milliseconds) a group
+            stays open waiting for more batches.
+        :param metrics: Optional ConsumerMetrics recording commit sizes and
+            latencies.
+        """
+        self.storage = storage
+        self.lock = asyncio.Lock()
+        # Bounded by max_queue_size here rather than by the queue, so the
+        # bound can change while the writer runs.
+        self.queue = asyncio.Queue()
+        self.max_queue_size = max_queue_size
+        self.room = asyncio.Event()
+        self.max_group_events = max_group_events
+        self.commit_interval_ms = commit_interval_ms
+        self.metrics = metrics
+        self.listeners = []
+        self.task = None
+
+    def submit(self, rows, wait=True):
+        """
+        Queue rows for the next group commit.
+
+        :param rows: ``(event_type, event_payload, event_id)`` tuples to
+            insert.
+        :param wait: Whether the caller wants to be told when the rows are
+            durable.
+        :return: A future resolved with the number of stored rows once they
+            are committed, or ``None`` when ``wait`` is false. Rows skipped
+            as duplicates are not counted.
+        :raises asyncio.QueueFull: If the queue is at capacity.
+        """
+        if self.full():
+            raise asyncio.QueueFull
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self.queue.put_nowait((rows, future))
+        return future
+
+    async def put(self, rows, wait=True):
+        """
+        Queue rows for the next group commit, waiting for room in the queue.
+
+        :param rows: ``(event_type, event_payload, event_id)`` tuples to
+            insert.
+        :param wait: Whether the caller wants to be told when the rows are
+            durable.
+        :return: A future resolved with the number of stored rows once they
+            are committed, or ``None`` when ``wait`` is false. Rows skipped
+            as duplicates are not counted.
+        """
+        while self.full():
+            self.room.clear()
+            await self.room.wait()
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self.queue.put_nowait((rows, future))
+        return future
+
+    def full(self):
+        """
+        Check whether the queue is at capacity.
+
+        :return: True if a submit would raise ``asyncio.QueueFull``.
+        """
+        return self.queue.qsize() >= self.max_queue_size
+
+    def configure(self, max_queue_size, max_group_events, commit_interval_ms):
+        """
+        Change the queue bound and the commit group limits. They apply from
+        the next commit group.
+
+        :param max_queue_size: Maximum number of batches waiting in the
+            queue.
+        :param max_group_events: Number of events that closes a commit group.
+        :param commit_interval_ms: Maximum time (in milliseconds) a group
+            stays open waiting for more batches.
+        """
+        self.max_queue_size = max_queue_size
+        self.max_group_events = max_group_events
+        self.commit_interval_ms = commit_interval_ms
+        self.room.set()
+
+    def start(self):
+        """
+        Start the writer task.
+        """
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """
+        Commit everything already queued and stop the writer task.
+        """
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    async def next_group(self):
+        """
+        Collect the next commit group from the queue.
+
+        Blocks for the first batch, then keeps collecting until the group
+        holds ``max_group_events`` events or ``commit_interval_ms`` elapses.
+
+        :return: A tuple of the collected batches and whether the stop
+            sentinel was seen.
+        """
+        loop = asyncio.get_running_loop()
+        item = await self.queue.get()
+        self.room.set()
+        if item is None:
+            return [], True
+        group = [item]
+        count = len(item[0])
+        deadline = loop.time() + self.commit_interval_ms / 1000
+        while count < self.max_group_events:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            self.room.set()
+            if item is None:
+                return group, True
+            group.append(item)
+            count += len(item[0])
+        return group, False
+
+    async def commit_group(self, group):
+        """
+        Insert all batches of a group in one transaction and settle their
+        futures with the number of rows stored, which leaves out rows
+        skipped as duplicates.
+
+        :param group: ``(rows, future)`` pairs to commit.
+        """
+        rows = [row for batch, _ in group for row in batch]
+        async with self.lock:
+            started = time.perf_counter()
+            try:
+                skipped = await self.storage.insert(rows)
+                first_id, received_at = self.storage.last_insert
+                await self.storage.commit()
+            except Exception as e:
+                logger.error(f"Error committing {len(rows)} event(s): {e}")
+                if self.metrics is not None:
+                    self.metrics.commit_failures.inc()
+                try:
+                    await self.storage.rollback()
+                except Exception as rollback_err:
+                    logger.error(f"Error rolling back: {rollback_err}")
+                for _, future in group:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                return
+        if self.metrics is not None:
+            self.metrics.commit_seconds.observe(time.perf_counter() - started)
+            self.metrics.commit_group_events.observe(len(rows))
+            self.metrics.events_stored.inc(len(rows) - len(skipped))
+        if self.listeners:
+            self.notify(rows, skipped, first_id, received_at)
+        offset = 0
+        for batch, future in group:
+            stored = len(batch)
+            if skipped:
+                stored -= len(
+                    skipped.intersection(range(offset, offset + stored))
+                )
+            offset += len(batch)
+            if future is not None and not future.done():
+                future.set_result(stored)
+
+    def notify(self, rows, skipped, first_id, received_at):
+        """
+        Pass the rows of a commit to the listeners.
+
+        :param rows: The rows of the commit group.
+        :param skipped: Positions of the rows skipped as duplicates.
+        :param first_id: Id of the first row.
+        :param received_at: Time the rows were stored.
+        """
+        stored = [
+            (first_id + i, event_type, event_payload, received_at)
+            for i, (event_type, event_payload, _) in enumerate(rows)
+            if i not in skipped
+        ]
+        for listener in self.listeners:
+            try:
+                listener(stored)
+            except Exception as e:
+                logger.error(f"Commit listener failed: {e}")
+
+    async def run(self):
+        """
+        Drain the queue and commit groups until stopped.
+        """
+        stopping = False
+        while not stopping:
+            group, stopping = await self.next_group()
+            if group:
+                await self.commit_group(group)
@@ -2,12 +2,18 @@ import argparse
 import asyncio
 import json
 import logging
+import os
+import signal
 
 import aiofiles
 from aiohttp import web
 
 from consumer import init_app as consumer_init_app
+from consumer.consumer import default_options, prepare_reconfigure
+from consumer.workers import WorkerSupervisor
 from propagator import EventPropagator
+from propagator.pool import PropagatorPool
+from runtime import PROFILE_STANDARD, PROFILES, describe, use_profile
 
 
 def setup_logging():
@@ -22,13 +28,51 @@ def setup_logging():
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Optional config keys forwarded to EventPropagator as keyword arguments.
+PROPAGATOR_OPTIONS = [
+    "max_connections",
+    "max_keepalive_connections",
+    "keepalive_expiry",
+    "http2",
+    "max_batch_size",
+    "max_batch_latency_ms",
+    "wire_format",
+    "content_encoding",
+    "max_retries",
+    "retry_base_delay",
+    "retry_max_delay",
+    "retry_queue_size",
+    "breaker_failure_threshold",
+    "breaker_reset_timeout",
+    "spill_file",
+    "rate",
+    "rate_burst",
+    "workers",
+    "max_in_flight",
+    "source_mode",
+    "metrics_host",
+    "metrics_port",
+    "routes",
+    "destinations",
+]
 
-async def start_services(config_file, events_file):
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 5000
+
+ROLE_ALL = "all"
+ROLE_CONSUMER = "consumer"
+ROLE_PROPAGATOR = "propagator"
+
+
+async def load_config(config_file, propagator=True):
     """
-    Start the consumer and propagator services.
+    Read and validate the configuration file.
 
     :param config_file: Path to the configuration file.
-    :param events_file: Path to the events file.
+    :param propagator: Whether the propagator runs, which requires
+        ``endpoint`` and ``period``.
+    :return: The configuration dictionary.
+    :raises ValueError: If the file cannot be read or lacks required keys.
     """
     try:
         async with aiofiles.open(config_file, mode="r") as file:
@@ -36,6 +80,8 @@ async def start_services(config_file, events_file):
     except Exception as e:
         logger.error(f"Error loading configuration: {e}")
         raise ValueError(f"Error loading configuration: {e}")
+    if not propagator:
+        return config
 
     required_keys = ["endpoint", "period"]
     missing_keys = [key for key in required_keys if key not in config]
@@ -44,35 +90,253 @@ async def start_services(config_file, events_file):
             f"Missing required config keys: {', '.join(missing_keys)}"
         )
 
-    endpoint = config.get("endpoint")
-    period = config.get("period")
-
-    if not endpoint or not period:
+    if not config.get("endpoint") or not config.get("period"):
         raise ValueError("Config file must contain 'endpoint' and 'period'.")
+    return config
+
+
+def propagator_options(config):
+    """
+    Optional EventPropagator keyword arguments set in a configuration.
+
+    :param config: The configuration dictionary.
+    :return: A dictionary of keyword arguments.
+    """
+    return {key: config[key] for key in PROPAGATOR_OPTIONS if key in config}
 
-    # Start consumer service
-    consumer_app = await consumer_init_app()
-    consumer_runner = web.AppRunner(consumer_app)
+
+async def start_consumer(
+    config, workers=1, host=DEFAULT_HOST, port=DEFAULT_PORT
+):
+    """
+    Start the consumer service.
+
+    :param config: The configuration dictionary.
+    :param workers: Number of consumer processes. With more than one, the
+        consumer runs in supervised worker processes sharing the port.
+    :param host: Host the consumer listens on.
+    :param port: Port the consumer listens on.
+    :return: The consumer ``web.AppRunner`` or ``WorkerSupervisor``.
+    """
+    if workers > 1:
+        consumer_runner = WorkerSupervisor(
+            config.get("consumer", {}), workers, host, port
+        )
+        await consumer_runner.setup()
+        return consumer_runner
+    consumer_app = await consumer_init_app(**config.get("consumer", {}))
+    # The consumer inflates compressed bodies itself, with a size cap.
+    consumer_runner = web.AppRunner(consumer_app, auto_decompress=False)
     await consumer_runner.setup()
-    consumer_site = web.TCPSite(consumer_runner, "localhost", 5000)
+    consumer_site = web.TCPSite(consumer_runner, host, port)
     await consumer_site.start()
+    logger.info(f"Consumer listening on {host}:{port}")
+    return consumer_runner
 
-    # Start propagator service
-    propagator = EventPropagator(
-        events_file=events_file, endpoint=endpoint, period=period
+
+def create_propagator(config, events_file, processes=1):
+    """
+    Create the propagator service.
+
+    :param config: The configuration dictionary.
+    :param events_file: Path to the events file.
+    :param processes: Number of propagator processes. With more than one,
+        independent propagators run in supervised processes.
+    :return: The EventPropagator or PropagatorPool.
+    """
+    options = propagator_options(config)
+    if processes > 1:
+        return PropagatorPool(
+            events_file,
+            config["endpoint"],
+            config["period"],
+            processes,
+            **options,
+        )
+    return EventPropagator(
+        events_file=events_file,
+        endpoint=config["endpoint"],
+        period=config["period"],
+        **options,
     )
+
+
+async def start_services(
+    config_file,
+    events_file,
+    workers=1,
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    role=ROLE_ALL,
+    processes=1,
+):
+    """
+    Start the consumer and propagator services.
+
+    :param config_file: Path to the configuration file.
+    :param events_file: Path to the events file.
+    :param workers: Number of consumer processes. With more than one, the
+        consumer runs in supervised worker processes sharing the port.
+    :param host: Host the consumer listens on.
+    :param port: Port the consumer listens on.
+    :param role: ``"all"`` to run both services, ``"consumer"`` or
+        ``"propagator"`` to run one of them alone.
+    :param processes: Number of propagator processes.
+    :return: The consumer runner and the propagator, either of which is
+        ``None`` when its service does not run.
+    """
+    config = await load_config(config_file, propagator=role != ROLE_CONSUMER)
+    consumer_runner = None
+    propagator = None
+    if role != ROLE_PROPAGATOR:
+        consumer_runner = await start_consumer(config, workers, host, port)
+    if role != ROLE_CONSUMER:
+        propagator = create_propagator(config, events_file, processes)
     return consumer_runner, propagator
 
 
+class ConfigReloader:
+    def __init__(self, config_file, consumer_runner, propagator):
+        """
+        Initialize the ConfigReloader.
+
+        Applies changes of the configuration file to the running services.
+        A new configuration is validated by both services before either
+        applies it, so an invalid file or an option that needs a restart
+        leaves everything as it was. The consumer applies its options at
+        once; with worker processes they are restarted one at a time.
+
+        :param config_file: Path to the configuration file.
+        :param consumer_runner: The consumer ``web.AppRunner`` or
+            ``WorkerSupervisor``, or ``None`` if the consumer does not run.
+        :param propagator: The running EventPropagator or PropagatorPool, or
+            ``None`` if the propagator does not run.
+        """
+        self.config_file = config_file
+        self.consumer_runner = consumer_runner
+        self.propagator = propagator
+        self.config = None
+        self.mtime = None
+        self.reload_task = None
+        self.pending = False
+
+    async def load(self):
+        """
+        Read the configuration the services were started with.
+        """
+        self.mtime = self.modified_time()
+        self.config = await load_config(
+            self.config_file, propagator=self.propagator is not None
+        )
+
+    def modified_time(self):
+        """
+        Modification time of the configuration file.
+
+        :return: The time, or ``None`` if the file cannot be read.
+        """
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def request_reload(self):
+        """
+        Reload in the background, as the SIGHUP handler. A request made
+        while a reload runs is served by one more reload after it.
+        """
+        if self.reload_task is not None and not self.reload_task.done():
+            self.pending = True
+            return
+        self.reload_task = asyncio.create_task(self.reload_pending())
+
+    async def reload_pending(self):
+        """
+        Reload until no request is left.
+        """
+        while True:
+            self.pending = False
+            await self.reload()
+            if not self.pending:
+                return
+
+    def prepare_consumer(self, consumer):
+        """
+        Prepare the consumer for changed options.
+
+        :param consumer: The new consumer options.
+        :return: A function or coroutine function applying them, or
+            ``None`` if nothing changed.
+        """
+        current = self.config.get("consumer", {})
+        defaults = default_options()
+        changes = {
+            key: consumer.get(key, defaults.get(key))
+            for key in current.keys() | consumer.keys()
+            if consumer.get(key, defaults.get(key))
+            != current.get(key, defaults.get(key))
+        }
+        if not changes or self.consumer_runner is None:
+            return None
+        if isinstance(self.consumer_runner, WorkerSupervisor):
+            return self.consumer_runner.prepare_reconfigure(changes)
+        return prepare_reconfigure(self.consumer_runner.app, **changes)
+
+    async def reload(self):
+        """
+        Read the configuration file and apply it to the services.
+
+        :return: True if the configuration was applied.
+        """
+        self.mtime = self.modified_time()
+        try:
+            config = await load_config(
+                self.config_file, propagator=self.propagator is not None
+            )
+            apply_consumer = self.prepare_consumer(config.get("consumer", {}))
+            apply_propagator = None
+            if self.propagator is not None:
+                apply_propagator = self.propagator.prepare_reconfigure(
+                    config["endpoint"],
+                    config["period"],
+                    **propagator_options(config),
+                )
+        except (TypeError, ValueError) as e:
+            logger.error(f"Keeping the current configuration: {e}")
+            return False
+        if apply_consumer is not None:
+            result = apply_consumer()
+            if asyncio.iscoroutine(result):
+                await result
+        if apply_propagator is not None:
+            await apply_propagator()
+        self.config = config
+        logger.info(f"Reloaded configuration from {self.config_file}")
+        return True
+
+    async def watch(self, interval):
+        """
+        Reload whenever the configuration file is modified.
+
+        :param interval: Seconds between checks of the file.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            mtime = self.modified_time()
+            if mtime is not None and mtime != self.mtime:
+                self.request_reload()
+
+
 async def shutdown(consumer_runner, propagator_task):
     """
     Shutdown the services gracefully.
 
-    :param consumer_runner: The consumer runner.
+    :param consumer_runner: The consumer runner, or ``None``.
     :param propagator_task: The propagator task.
     """
     try:
-        await consumer_runner.cleanup()
+        if consumer_runner is not None:
+            await consumer_runner.cleanup()
         propagator_task.cancel()
         await propagator_task
     except asyncio.CancelledError:
@@ -81,42 +345,185 @@ async def shutdown(consumer_runner, propagator_task):
         logger.error(f"Error during shutdown: {e}")
 
 
-async def run_services(config_file, events_file):
+async def run_services(
+    config_file,
+    events_file,
+    workers=1,
+    reload_interval=None,
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    role=ROLE_ALL,
+    processes=1,
+):
     """
     Run the services and handle graceful shutdown.
+
+    SIGTERM stops the propagator and drains the consumer. SIGHUP reloads the
+    configuration file.
+
+    :param config_file: Path to the configuration file.
+    :param events_file: Path to the events file.
+    :param workers: Number of consumer processes.
+    :param reload_interval: Seconds between checks of the configuration file
+        for changes, or ``None`` to only reload on SIGHUP.
+    :param host: Host the consumer listens on.
+    :param port: Port the consumer listens on.
+    :param role: ``"all"``, ``"consumer"`` or ``"propagator"``.
+    :param processes: Number of propagator processes.
     """
-    consumer_runner, propagator = await start_services(config_file, events_file)
-    propagator_task = asyncio.create_task(propagator.run())
+    consumer_runner, propagator = await start_services(
+        config_file, events_file, workers, host, port, role, processes
+    )
+    reloader = ConfigReloader(config_file, consumer_runner, propagator)
+    await reloader.load()
+    if propagator is not None:
+        propagator_task = asyncio.create_task(propagator.run())
+    else:
+        # The consumer alone runs until SIGTERM.
+        propagator_task = asyncio.create_task(asyncio.Event().wait())
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, propagator_task.cancel)
+    loop.add_signal_handler(signal.SIGHUP, reloader.request_reload)
+    watch_task = None
+    if reload_interval is not None:
+        watch_task = asyncio.create_task(reloader.watch(reload_interval))
 
     try:
         await propagator_task
     except asyncio.CancelledError:
-        logger.info("Propagator task cancelled")
+        logger.info("Stopping services")
     except Exception as e:
         logger.error(f"Error running propagator: {e}")
     finally:
+        loop.remove_signal_handler(signal.SIGHUP)
+        if watch_task is not None:
+            watch_task.cancel()
+        if reloader.reload_task is not None:
+            await asyncio.gather(reloader.reload_task, return_exceptions=True)
         await shutdown(consumer_runner, propagator_task)
 
 
-def main():
+def option_parsers(suppress_defaults=False):
     """
-    Main entry point for the script.
+    Build the parent parsers of the options shared by the roles.
+
+    :param suppress_defaults: Leave options that are not given out of the
+        parsed namespace instead of setting their default.
+    :return: The common, consumer and propagator ``argparse.ArgumentParser``
+        objects.
     """
-    parser = argparse.ArgumentParser(
-        description="Run the Event Propagator and Consumer services."
-    )
-    parser.add_argument(
+
+    def default(value):
+        return argparse.SUPPRESS if suppress_defaults else value
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
         "--config",
-        default="config.json",
+        default=default("config.json"),
         help="Path to the configuration file.",
     )
-    parser.add_argument(
-        "--events", default="events_file.json", help="Path to the events file."
+    common.add_argument(
+        "--reload-interval",
+        type=float,
+        default=default(None),
+        help="Seconds between checks of the configuration file for changes. "
+        "Without it, the configuration is only reloaded on SIGHUP.",
+    )
+    common.add_argument(
+        "--profile",
+        choices=PROFILES,
+        default=default(PROFILE_STANDARD),
+        help="Runtime profile. 'fast' uses uvloop and orjson when they are "
+        "installed.",
+    )
+    consumer = argparse.ArgumentParser(add_help=False)
+    consumer.add_argument(
+        "--workers",
+        type=int,
+        default=default(1),
+        help="Number of consumer worker processes.",
+    )
+    consumer.add_argument(
+        "--host",
+        default=default(DEFAULT_HOST),
+        help="Host the consumer listens on.",
+    )
+    consumer.add_argument(
+        "--port",
+        type=int,
+        default=default(DEFAULT_PORT),
+        help="Port the consumer listens on.",
     )
-    args = parser.parse_args()
+    propagator = argparse.ArgumentParser(add_help=False)
+    propagator.add_argument(
+        "--events",
+        default=default("events_file.json"),
+        help="Path to the events file.",
+    )
+    propagator.add_argument(
+        "--processes",
+        type=int,
+        default=default(1),
+        help="Number of propagator processes.",
+    )
+    return common, consumer, propagator
+
+
+def build_parser():
+    """
+    Build the command line parser.
+
+    Without a role both services run in this process, as ``all`` does.
+    Options go before or after the role. The role parsers do not set
+    defaults, so they keep the values of options given before the role.
+
+    :return: The ``argparse.ArgumentParser``.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the Event Propagator and Consumer services.",
+        parents=option_parsers(),
+    )
+    common, consumer, propagator = option_parsers(suppress_defaults=True)
+    roles = parser.add_subparsers(dest="role", title="roles")
+    roles.add_parser(
+        ROLE_ALL,
+        parents=[common, consumer, propagator],
+        help="Run the consumer and the propagator in one process.",
+    )
+    roles.add_parser(
+        ROLE_CONSUMER,
+        parents=[common, consumer],
+        help="Run the consumer alone.",
+    )
+    roles.add_parser(
+        ROLE_PROPAGATOR,
+        parents=[common, propagator],
+        help="Run the propagator alone, sending to the configured endpoint.",
+    )
+    return parser
+
+
+def main():
+    """
+    Main entry point for the script.
+    """
+    args = build_parser().parse_args()
+    use_profile(args.profile)
+    logger.info(f"Runtime profile: {describe()}")
 
     try:
-        asyncio.run(run_services(args.config, args.events))
+        asyncio.run(
+            run_services(
+                args.config,
+                args.events,
+                args.workers,
+                args.reload_interval,
+                args.host,
+                args.port,
+                args.role or ROLE_ALL,
+                args.processes,
+            )
+        )
     except Exception as e:
         logger.error(f"Error starting services: {e}")
 
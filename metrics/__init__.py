@@ -0,0 +1,11 @@
+from .http import metrics_handler, start_metrics_server  # noqa: F401
+from .metrics import (  # noqa: F401
+    BYTE_BUCKETS,
+    CONTENT_TYPE,
+    LATENCY_BUCKETS,
+    SIZE_BUCKETS,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+)
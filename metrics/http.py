@@ -0,0 +1,48 @@
+import logging
+
+from aiohttp import web
+
+from .metrics import CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+
+def metrics_handler(registry):
+    """
+    Build a request handler exposing a registry.
+
+    :param registry: The Registry to expose.
+    :return: The request handler.
+    """
+
+    async def handle_metrics(request):
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        :param request: The incoming request object.
+        :return: The text response.
+        """
+        return web.Response(
+            body=registry.render().encode(),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    return handle_metrics
+
+
+async def start_metrics_server(registry, host, port):
+    """
+    Serve a registry on ``/metrics`` from a standalone listener.
+
+    :param registry: The Registry to expose.
+    :param host: Host to listen on.
+    :param port: Port to listen on.
+    :return: The ``web.AppRunner``, to be cleaned up by the caller.
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler(registry))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,326 @@
+import abc
+import bisect
+import math
+
+# Latency buckets in seconds.
+LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Size buckets in events.
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+# Size buckets in bytes, 1 KiB to 64 MiB.
+BYTE_BUCKETS = tuple(1024 * 4**exponent for exponent in range(9))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    """
+    Format a sample value for the text exposition format.
+
+    :param value: The sample value.
+    :return: The formatted value.
+    """
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer():
+            return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    """
+    Format label pairs for the text exposition format.
+
+    :param labels: ``(name, value)`` pairs.
+    :return: The formatted label set, or an empty string.
+    """
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return f"{{{pairs}}}"
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        """
+        Initialize the Metric.
+
+        Metrics are plain attribute updates on the event loop thread, so
+        recording a value needs no lock.
+
+        :param name: Metric name.
+        :param help: One-line description.
+        :param labelnames: Names of the labels of the metric's children.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+
+    def labels(self, *values):
+        """
+        Return the child metric for a set of label values.
+
+        :param values: One value per label name, in order.
+        :return: The child metric.
+        :raises ValueError: If the number of values is wrong.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.child()
+        return child
+
+    @abc.abstractmethod
+    def child(self):
+        """
+        Create an unlabelled metric of the same kind.
+
+        :return: The new metric.
+        """
+
+    @abc.abstractmethod
+    def samples(self):
+        """
+        Yield the samples of an unlabelled metric.
+
+        :return: An iterator of ``(suffix, extra labels, value)`` tuples.
+        """
+
+    def render(self, const_labels=()):
+        """
+        Render the metric in the text exposition format.
+
+        :param const_labels: ``(name, value)`` pairs added to every sample.
+        :return: The lines of the metric.
+        """
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        if self.labelnames:
+            members = [
+                (tuple(zip(self.labelnames, values)), child)
+                for values, child in self.children.items()
+            ]
+        else:
+            members = [((), self)]
+        for labels, metric in members:
+            labels = const_labels + labels
+            for suffix, extra, value in metric.samples():
+                lines.append(
+                    f"{self.name}{suffix}{format_labels(labels + extra)} "
+                    f"{format_value(value)}"
+                )
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        """
+        Initialize the Counter.
+
+        :param name: Metric name.
+        :param help: One-line description.
+        :param labelnames: Names of the labels of the metric's children.
+        :param function: Optional function returning the current total,
+            called only when the metric is rendered.
+        """
+        super().__init__(name, help, labelnames)
+        self.function = function
+        self.value = 0
+
+    def child(self):
+        return Counter(self.name, self.help)
+
+    def inc(self, amount=1):
+        """
+        Increase the counter.
+
+        :param amount: Amount to add.
+        """
+        self.value += amount
+
+    def samples(self):
+        value = self.function() if self.function else self.value
+        yield "", (), value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        """
+        Initialize the Gauge.
+
+        :param name: Metric name.
+        :param help: One-line description.
+        :param labelnames: Names of the labels of the metric's children.
+        :param function: Optional function returning the current value,
+            called only when the metric is rendered.
+        """
+        super().__init__(name, help, labelnames)
+        self.function = function
+        self.value = 0
+
+    def child(self):
+        return Gauge(self.name, self.help)
+
+    def set(self, value):
+        """
+        Set the gauge.
+
+        :param value: The new value.
+        """
+        self.value = value
+
+    def inc(self, amount=1):
+        """
+        Increase the gauge.
+
+        :param amount: Amount to add.
+        """
+        self.value += amount
+
+    def dec(self, amount=1):
+        """
+        Decrease the gauge.
+
+        :param amount: Amount to subtract.
+        """
+        self.value -= amount
+
+    def samples(self):
+        value = self.function() if self.function else self.value
+        yield "", (), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        """
+        Initialize the Histogram.
+
+        :param name: Metric name.
+        :param help: One-line description.
+        :param buckets: Upper bounds of the buckets, without ``+Inf``.
+        :param labelnames: Names of the labels of the metric's children.
+        """
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def child(self):
+        return Histogram(self.name, self.help, self.buckets)
+
+    def observe(self, value):
+        """
+        Record an observation.
+
+        :param value: The observed value.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            yield "_bucket", (("le", format_value(float(bound))),), total
+        yield "_sum", (), self.sum
+        yield "_count", (), total
+
+
+class Registry:
+    def __init__(self, labels=()):
+        """
+        Initialize the Registry.
+
+        Each service owns a registry, so several services or test apps in
+        one process never share metrics.
+
+        :param labels: ``(name, value)`` pairs added to every sample, such
+            as the worker process the metrics come from.
+        """
+        self.labels = tuple(labels)
+        self.metrics = {}
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        :param metric: The metric to add.
+        :return: The metric.
+        :raises ValueError: If a metric with the same name exists.
+        """
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=(), function=None):
+        """
+        Create and register a Counter.
+
+        :return: The counter.
+        """
+        return self.register(Counter(name, help, labelnames, function))
+
+    def gauge(self, name, help, labelnames=(), function=None):
+        """
+        Create and register a Gauge.
+
+        :return: The gauge.
+        """
+        return self.register(Gauge(name, help, labelnames, function))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        """
+        Create and register a Histogram.
+
+        :return: The histogram.
+        """
+        return self.register(Histogram(name, help, buckets, labelnames))
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        :return: The exposition text.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render(self.labels))
+        return "\n".join(lines) + "\n"
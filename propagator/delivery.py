@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import random
+import time
+
+import aiofiles
+
+from runtime import codec
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: the consumer is overloaded or restarting.
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """
+    Compute a retry delay using exponential backoff with full jitter.
+
+    :param attempt: Number of the upcoming attempt, starting at 1.
+    :param base_delay: Delay cap (in seconds) for the first retry.
+    :param max_delay: Upper bound (in seconds) for any delay.
+    :return: A random delay between 0 and the capped exponential bound.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class DeliveryStats:
+    def __init__(self):
+        """
+        Initialize the DeliveryStats counters.
+        """
+        self.sent_batches = 0
+        self.sent_events = 0
+        self.failed_attempts = 0
+        self.retried_batches = 0
+        self.dropped_events = 0
+        self.spilled_events = 0
+        self.replayed_events = 0
+        self.circuit_opened = 0
+
+    def as_dict(self):
+        """
+        Return a snapshot of all counters.
+
+        :return: A dictionary of counter names to values.
+        """
+        return dict(vars(self))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0, clock=None):
+        """
+        Initialize the CircuitBreaker.
+
+        After ``failure_threshold`` consecutive failures the breaker opens
+        and refuses requests for ``reset_timeout`` seconds. It then lets a
+        single probe through; a success closes it, a failure re-opens it.
+
+        :param failure_threshold: Consecutive failures that open the breaker.
+        :param reset_timeout: Seconds to wait before probing again.
+        :param clock: Monotonic clock function, for testing.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock or time.monotonic
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow_request(self):
+        """
+        Check whether a request may be sent now.
+
+        :return: True if the request may be sent.
+        """
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            return True
+        return self.state == self.CLOSED
+
+    def retry_after(self):
+        """
+        Seconds until the breaker allows a probe request.
+
+        :return: The remaining wait, or 0 if requests are allowed.
+        """
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def record_success(self):
+        """
+        Record a successful request and close the breaker.
+        """
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def abandon_probe(self):
+        """
+        Re-open the breaker if a probe ended without a response, so the
+        next probe follows after another ``reset_timeout``.
+        """
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+
+    def record_failure(self):
+        """
+        Record a failed request, opening the breaker if needed.
+
+        :return: True if this failure opened the breaker.
+        """
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED
+            and self.failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+            return True
+        return False
+
+
+class SpillFile:
+    def __init__(self, path):
+        """
+        Initialize the SpillFile.
+
+        Batches that cannot be delivered or retried are appended to the file
+        as one JSON list per line. Replaying moves the file aside first, so
+        batches spilled during a replay are kept for the next one.
+
+        :param path: Path of the append-only spill file.
+        """
+        self.path = path
+        self.replay_path = f"{path}.replay"
+
+    def has_data(self):
+        """
+        Check whether there are spilled batches waiting to be replayed.
+
+        :return: True if the spill file or an interrupted replay exists.
+        """
+        if os.path.exists(self.replay_path):
+            return True
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    async def append(self, events):
+        """
+        Append a batch to the spill file.
+
+        :param events: Events of the batch.
+        """
+        async with aiofiles.open(self.path, mode="a") as file:
+            await file.write(codec.dumps(events) + "\n")
+
+    async def replay(self):
+        """
+        Yield spilled batches in the order they were written.
+
+        An interrupted replay is resumed from its beginning, so delivery is
+        at-least-once.
+        """
+        if not os.path.exists(self.replay_path):
+            if not os.path.exists(self.path):
+                return
+            os.replace(self.path, self.replay_path)
+        async with aiofiles.open(self.replay_path, mode="r") as file:
+            async for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    yield codec.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Skipping corrupt spilled batch: {e}")
+        os.remove(self.replay_path)
@@ -0,0 +1,68 @@
+from metrics import SIZE_BUCKETS, Registry
+
+
+class PropagatorMetrics:
+    def __init__(self, propagator, registry=None):
+        """
+        Initialize the PropagatorMetrics.
+
+        Send latency and batch sizes are recorded per request. Delivery
+        counters and queue lengths are read from the propagator, summed over
+        its destinations, when the metrics are rendered, so they cost
+        nothing on the hot path.
+
+        :param propagator: The EventPropagator to report on.
+        :param registry: The Registry to register the collectors in. A new
+            one is created by default.
+        """
+        self.registry = registry if registry is not None else Registry()
+        registry = self.registry
+        self.send_seconds = registry.histogram(
+            "propagator_send_seconds",
+            "Time spent on one request to the consumer.",
+        )
+        self.batch_events = registry.histogram(
+            "propagator_batch_events",
+            "Events per request to the consumer.",
+            SIZE_BUCKETS,
+        )
+        self.requests_in_flight = registry.gauge(
+            "propagator_requests_in_flight",
+            "Requests to the consumer awaiting a response.",
+        )
+        for name, help in (
+            ("sent_batches", "Batches accepted by the consumer."),
+            ("sent_events", "Events accepted by the consumer."),
+            ("failed_attempts", "Requests that failed and may be retried."),
+            ("retried_batches", "Batches sent again after a failure."),
+            ("dropped_events", "Events given up on."),
+            ("spilled_events", "Events written to the spill file."),
+            ("replayed_events", "Events replayed from the spill file."),
+            ("circuit_opened", "Times the circuit breaker opened."),
+        ):
+            registry.counter(
+                f"propagator_{name}_total",
+                help,
+                function=lambda name=name: sum(
+                    getattr(sender.stats, name) for sender in propagator.senders
+                ),
+            )
+        registry.gauge(
+            "propagator_in_flight_events",
+            "Events generated but not yet sent by the worker pool.",
+            function=lambda: propagator.in_flight,
+        )
+        registry.gauge(
+            "propagator_retry_queue_batches",
+            "Batches waiting for a retry.",
+            function=lambda: sum(
+                len(sender.retry_queue) for sender in propagator.senders
+            ),
+        )
+        registry.gauge(
+            "propagator_batch_buffer_events",
+            "Events buffered for the next batch.",
+            function=lambda: sum(
+                len(sender.batch) for sender in propagator.senders
+            ),
+        )
@@ -0,0 +1,231 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import signal
+
+from runtime import PROFILE_STANDARD, use_profile
+from runtime.profile import active as active_profile
+
+from .propagator import EventPropagator
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the propagator processes.
+POLL_INTERVAL = 0.5
+
+
+async def run_until_signal(propagator):
+    """
+    Run a propagator until the process receives SIGTERM or SIGINT.
+
+    :param propagator: The EventPropagator to run.
+    """
+    task = asyncio.create_task(propagator.run())
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, task.cancel)
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
+def run_instance(
+    events_file, endpoint, period, options, index, profile=PROFILE_STANDARD
+):
+    """
+    Run one propagator process until it receives SIGTERM or SIGINT.
+
+    On a signal the propagator flushes its buffered events and spills or
+    drops the batches still waiting for a retry, as in a single process.
+
+    :param events_file: Path to the events file.
+    :param endpoint: Endpoint to send events to.
+    :param period: Period between sending events.
+    :param options: Other ``EventPropagator`` options.
+    :param index: Number of this instance. A configured ``metrics_port``
+        is offset by it, so every instance serves its own metrics.
+    :param profile: Runtime profile of the process.
+    """
+    use_profile(profile)
+    options = dict(options)
+    if options.get("metrics_port") is not None:
+        options["metrics_port"] += index
+    propagator = EventPropagator(
+        events_file=events_file, endpoint=endpoint, period=period, **options
+    )
+    asyncio.run(run_until_signal(propagator))
+
+
+class PropagatorPool:
+    def __init__(
+        self,
+        events_file,
+        endpoint,
+        period,
+        processes,
+        drain_timeout=30.0,
+        restart_delay=1.0,
+        **options,
+    ):
+        """
+        Initialize the PropagatorPool.
+
+        Runs ``processes`` independent propagators, each in its own process
+        with its own event loop, connection pool and event source, and
+        restarts any that crash. Processes use the runtime profile of the
+        pool's process. ``run`` and ``prepare_reconfigure`` mirror
+        ``EventPropagator``, so the pool can take the place of a single
+        propagator.
+
+        :param events_file: Path to the events file, read by every process.
+        :param endpoint: Endpoint to send events to.
+        :param period: Period between sending events.
+        :param processes: Number of propagator processes.
+        :param drain_timeout: Seconds a process gets to flush its events
+            after SIGTERM before it is killed.
+        :param restart_delay: Seconds to wait before restarting a crashed
+            process.
+        :param options: Other ``EventPropagator`` options.
+        :raises ValueError: If the options are invalid.
+        """
+        # Fail here rather than in every process.
+        EventPropagator(
+            events_file=events_file, endpoint=endpoint, period=period, **options
+        )
+        self.events_file = events_file
+        self.endpoint = endpoint
+        self.period = period
+        self.options = options
+        self.count = processes
+        self.drain_timeout = drain_timeout
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = [None] * processes
+        self.stopping = set()
+
+    def spawn(self, index):
+        """
+        Start the process of one propagator.
+
+        :param index: Number of the propagator.
+        """
+        process = self.context.Process(
+            target=run_instance,
+            args=(
+                self.events_file,
+                self.endpoint,
+                self.period,
+                self.options,
+                index,
+                active_profile["profile"],
+            ),
+            name=f"propagator-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def run(self):
+        """
+        Start the processes and restart those that exit with an error until
+        cancelled, then stop them all.
+        """
+        for index in range(self.count):
+            self.spawn(index)
+        logger.info(
+            f"Started {self.count} propagator processes sending to "
+            f"{self.endpoint}"
+        )
+        try:
+            await self.monitor()
+        finally:
+            await asyncio.gather(
+                *(
+                    self.stop_process(index)
+                    for index, process in enumerate(self.processes)
+                    if process is not None
+                )
+            )
+
+    async def monitor(self):
+        """
+        Restart processes that exit with an error.
+
+        A process that exits cleanly was stopped on purpose and is not
+        restarted.
+        """
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if (
+                    process is None
+                    or process.is_alive()
+                    or index in self.stopping
+                ):
+                    continue
+                if process.exitcode == 0:
+                    logger.info(f"Propagator process {index} exited")
+                    self.processes[index] = None
+                    continue
+                logger.error(
+                    f"Propagator process {index} died with exit code "
+                    f"{process.exitcode}, restarting"
+                )
+                await asyncio.sleep(self.restart_delay)
+                self.spawn(index)
+
+    async def stop_process(self, index):
+        """
+        Stop one process, letting it flush, and kill it if it does not exit
+        in time.
+
+        :param index: Number of the propagator.
+        """
+        process = self.processes[index]
+        self.stopping.add(index)
+        try:
+            process.terminate()
+            await asyncio.to_thread(process.join, self.drain_timeout)
+            if process.is_alive():
+                logger.warning(f"Killing propagator process {index}")
+                process.kill()
+                process.join()
+        finally:
+            self.stopping.discard(index)
+        self.processes[index] = None
+
+    def prepare_reconfigure(self, endpoint, period, **options):
+        """
+        Validate a new configuration and prepare a rolling restart of the
+        processes with it.
+
+        :param endpoint: Endpoint to send events to.
+        :param period: Period between sending events.
+        :param options: Other ``EventPropagator`` options.
+        :return: A coroutine function restarting the processes one at a
+            time, so the others keep sending meanwhile.
+        :raises ValueError: If the configuration is invalid.
+        """
+        EventPropagator(
+            events_file=self.events_file,
+            endpoint=endpoint,
+            period=period,
+            **options,
+        )
+
+        async def apply():
+            self.endpoint = endpoint
+            self.period = period
+            self.options = options
+            for index, process in enumerate(self.processes):
+                if process is None or not process.is_alive():
+                    continue
+                await self.stop_process(index)
+                self.spawn(index)
+                await asyncio.sleep(self.restart_delay)
+            logger.info(
+                f"Restarted {self.count} propagator processes sending to "
+                f"{endpoint}"
+            )
+
+        return apply
@@ -1,11 +1,48 @@
 import asyncio
-import json
+import collections
+import heapq
+import itertools
 import logging
 import random
+import time
 
 import aiofiles
 import httpx
 
+from metrics import start_metrics_server
+from runtime import codec
+
+from .delivery import (
+    RETRYABLE_STATUSES,
+    CircuitBreaker,
+    DeliveryStats,
+    SpillFile,
+    backoff_delay,
+)
+from .monitoring import PropagatorMetrics
+from .ratelimit import InFlightWindow, RateLimiter
+from .routing import DEFAULT_DESTINATION_QUEUE, Destination, Router
+from .sources import (
+    SOURCE_INDEXED,
+    SOURCE_MEMORY,
+    SOURCE_MODES,
+    SOURCE_SEQUENTIAL,
+    IndexedSource,
+    SequentialSource,
+)
+from .wire import (
+    CONTENT_TYPES,
+    WIRE_JSON,
+    EncodedEvents,
+    check_content_encoding,
+    check_wire_format,
+    compress_body,
+    decode_event,
+    encode_event,
+    is_valid_event,
+    join_batch,
+)
+
 
 def setup_logging():
     """
@@ -19,31 +56,520 @@ def setup_logging():
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Settings a running propagator takes over from a configuration reload.
+ADOPTED_OPTIONS = (
+    "endpoint",
+    "period",
+    "max_batch_size",
+    "max_batch_latency_ms",
+    "content_encoding",
+    "max_retries",
+    "retry_base_delay",
+    "retry_max_delay",
+    "retry_queue_size",
+    "rate",
+    "rate_burst",
+    "workers",
+    "max_in_flight",
+)
+
 
 class EventPropagator:
-    def __init__(self, events_file, endpoint, period):
+    def __init__(
+        self,
+        events_file,
+        endpoint,
+        period,
+        max_connections=10,
+        max_keepalive_connections=10,
+        keepalive_expiry=30.0,
+        http2=False,
+        max_batch_size=1,
+        max_batch_latency_ms=0,
+        wire_format=WIRE_JSON,
+        content_encoding=None,
+        max_retries=3,
+        retry_base_delay=0.5,
+        retry_max_delay=30.0,
+        retry_queue_size=1000,
+        breaker_failure_threshold=5,
+        breaker_reset_timeout=10.0,
+        spill_file=None,
+        rate=None,
+        rate_burst=1,
+        workers=1,
+        max_in_flight=None,
+        source_mode=SOURCE_MEMORY,
+        metrics_host="localhost",
+        metrics_port=None,
+        routes=None,
+        destinations=None,
+    ):
         """
         Initialize the EventPropagator.
 
         :param events_file: Path to the events file.
         :param endpoint: Endpoint to send events to.
         :param period: Period between sending events.
+        :param max_connections: Maximum number of pooled connections.
+        :param max_keepalive_connections: Maximum number of idle connections
+            kept alive in the pool.
+        :param keepalive_expiry: Seconds an idle connection is kept alive.
+        :param http2: Whether to negotiate HTTP/2 (requires ``httpx[http2]``).
+        :param max_batch_size: Number of buffered events that triggers a
+            flush. A value of 1 sends every event on its own.
+        :param max_batch_latency_ms: Maximum time (in milliseconds) an event
+            may wait in the batch buffer before it is flushed.
+        :param wire_format: Request body encoding, one of ``"json"``,
+            ``"ndjson"`` or ``"msgpack"`` (requires ``msgpack``).
+        :param content_encoding: Request body compression, ``None``,
+            ``"gzip"`` or ``"zstd"`` (requires Python 3.14 or
+            ``backports.zstd``).
+        :param max_retries: Number of retries for a failed batch before it is
+            spilled or dropped.
+        :param retry_base_delay: Backoff cap (in seconds) for the first retry.
+        :param retry_max_delay: Upper bound (in seconds) for any retry delay.
+        :param retry_queue_size: Maximum number of batches waiting for a
+            retry.
+        :param breaker_failure_threshold: Consecutive failures that pause
+            sending.
+        :param breaker_reset_timeout: Seconds sending stays paused before a
+            probe request.
+        :param spill_file: Optional path of an append-only file receiving
+            batches that cannot be retried; they are replayed once the
+            consumer recovers.
+        :param rate: Target number of events per second. When set, events are
+            generated on a fixed-rate schedule and sent by a pool of workers
+            instead of one at a time every ``period`` seconds.
+        :param rate_burst: Number of events that may be generated at once to
+            catch up after a stall.
+        :param workers: Number of concurrent sender coroutines.
+        :param max_in_flight: Maximum number of events generated but not yet
+            sent. Defaults to ``workers``.
+        :param source_mode: How events are read from the events file:
+            ``"memory"`` loads the file and samples at random,
+            ``"sequential"`` streams it in order and ``"indexed"`` samples at
+            random through an offset index over a memory-mapped file.
+        :param metrics_host: Host of the metrics listener.
+        :param metrics_port: Port of an optional listener serving
+            ``/metrics`` while the propagator runs.
+        :param routes: Optional routing table, a list of
+            ``{"event_types": [...], "endpoints": [...]}`` entries. Event
+            types may be ``fnmatch`` patterns; the first matching entry
+            sends an event to each of its endpoints, and unmatched events go
+            to ``endpoint``. Every endpoint gets its own connection pool,
+            batch buffer, retry queue and in-flight limit.
+        :param destinations: Optional per-endpoint overrides of the delivery
+            options above, plus ``workers`` and ``max_in_flight``. A spill
+            file is only used by the endpoints it is configured for.
         """
+        if source_mode not in SOURCE_MODES:
+            raise ValueError(f"Unknown source mode: {source_mode}")
+        check_wire_format(wire_format)
+        check_content_encoding(content_encoding)
         self.events_file = events_file
         self.endpoint = endpoint
         self.period = period
-        self.events = []
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.client = None
+        self.client_requests = collections.Counter()
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency_ms = max_batch_latency_ms
+        self.batch = []
+        self.flush_timer = None
+        self.flush_tasks = set()
+        self.wire_format = wire_format
+        self.content_encoding = content_encoding
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retry_queue_size = retry_queue_size
+        self.retry_queue = []
+        self.retry_sequence = itertools.count()
+        self.retry_wakeup = asyncio.Event()
+        self.breaker = CircuitBreaker(
+            failure_threshold=breaker_failure_threshold,
+            reset_timeout=breaker_reset_timeout,
+        )
+        self.spill = SpillFile(spill_file) if spill_file else None
+        self.stats = DeliveryStats()
+        self.rate = rate
+        self.rate_burst = rate_burst
+        self.workers = workers
+        self.max_in_flight = max_in_flight or workers
+        self.in_flight = 0
+        self.limiter = None
+        self.window = None
+        self.send_queue = None
+        self.worker_tasks = set()
+        self.active_workers = 0
+        self.running = False
+        self.source_mode = source_mode
+        self.source = None
+        self.events = EncodedEvents()
+        self.invalid_events = 0
+        self.metrics = PropagatorMetrics(self)
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.retry_task = None
+        self.router = None
+        self.encoded_routes = {}
+        if routes:
+            delivery_options = {
+                "max_connections": max_connections,
+                "max_keepalive_connections": max_keepalive_connections,
+                "keepalive_expiry": keepalive_expiry,
+                "http2": http2,
+                "max_batch_size": max_batch_size,
+                "max_batch_latency_ms": max_batch_latency_ms,
+                "content_encoding": content_encoding,
+                "max_retries": max_retries,
+                "retry_base_delay": retry_base_delay,
+                "retry_max_delay": retry_max_delay,
+                "retry_queue_size": retry_queue_size,
+                "breaker_failure_threshold": breaker_failure_threshold,
+                "breaker_reset_timeout": breaker_reset_timeout,
+                "spill_file": spill_file,
+            }
+            self.router = self.create_router(
+                routes,
+                destinations or {},
+                delivery_options,
+                workers,
+                max_in_flight,
+            )
+
+    def create_router(
+        self, routes, overrides, delivery_options, workers, max_in_flight
+    ):
+        """
+        Build the destinations of a routing table.
+
+        :param routes: The routing table.
+        :param overrides: Endpoints mapped to their option overrides.
+        :param delivery_options: Delivery options shared by all endpoints.
+        :param workers: Default number of sender coroutines per endpoint.
+        :param max_in_flight: Default in-flight limit per endpoint.
+        :return: The Router.
+        :raises ValueError: If the routing table is invalid.
+        """
+        destinations = {}
+
+        def destination(endpoint):
+            if endpoint in destinations:
+                return destinations[endpoint]
+            options = {
+                **delivery_options,
+                "spill_file": (
+                    delivery_options["spill_file"]
+                    if endpoint == self.endpoint
+                    else None
+                ),
+                **overrides.get(endpoint, {}),
+            }
+            if "wire_format" in options:
+                raise ValueError("Every endpoint uses the same wire format")
+            destination_workers = options.pop("workers", workers)
+            queue_size = options.pop(
+                "max_in_flight", max_in_flight or DEFAULT_DESTINATION_QUEUE
+            )
+            sender = EventPropagator(
+                events_file=None,
+                endpoint=endpoint,
+                period=self.period,
+                wire_format=self.wire_format,
+                **options,
+            )
+            # Delivery is reported by the routing propagator's metrics.
+            sender.metrics = self.metrics
+            destinations[endpoint] = Destination(
+                sender, destination_workers, queue_size
+            )
+            return destinations[endpoint]
+
+        table = []
+        for route in routes:
+            patterns = route.get("event_types")
+            endpoints = route.get("endpoints")
+            if not patterns or not endpoints:
+                raise ValueError("Every route needs event_types and endpoints")
+            table.append(
+                (patterns, [destination(endpoint) for endpoint in endpoints])
+            )
+        return Router(table, destination(self.endpoint))
+
+    @property
+    def senders(self):
+        """
+        The EventPropagators delivering events: one per destination when
+        routing, otherwise this one.
+        """
+        if self.router is None:
+            return [self]
+        return [destination.sender for destination in self.destinations]
+
+    @property
+    def destinations(self):
+        """
+        All destinations of the routing table, each listed once.
+        """
+        destinations = {id(d): d for d in self.router.default}
+        for _, route_destinations in self.router.routes:
+            destinations.update({id(d): d for d in route_destinations})
+        return list(destinations.values())
+
+    def restart_options(self, other):
+        """
+        Options that differ from another propagator's but only take effect
+        on a restart.
+
+        :param other: The EventPropagator to compare with.
+        :return: Names of the differing options.
+        """
+        spill_file = self.spill.path if self.spill else None
+        other_spill_file = other.spill.path if other.spill else None
+        differences = {
+            "wire_format": self.wire_format != other.wire_format,
+            "source_mode": self.source_mode != other.source_mode,
+            "spill_file": spill_file != other_spill_file,
+            "metrics_host": self.metrics_host != other.metrics_host,
+            "metrics_port": self.metrics_port != other.metrics_port,
+            "rate": (self.rate is None) != (other.rate is None),
+            "routes": (self.router is None) != (other.router is None),
+        }
+        return [name for name, differs in differences.items() if differs]
+
+    def prepare_reconfigure(self, endpoint, period, **options):
+        """
+        Validate a new configuration and prepare its application to the
+        running propagator.
+
+        The configuration is checked by building a propagator from it, so
+        nothing changes if it is invalid. The returned coroutine function
+        first switches every setting without yielding to the event loop, then
+        starts the destinations added to the routing table and drains the
+        removed ones. Buffered, queued and retried events are kept, and
+        connection pools are kept unless their limits change: ``httpx``
+        cannot resize a pool, so a new one is opened and the old one is
+        closed once its requests finish.
+
+        :param endpoint: Endpoint to send events to.
+        :param period: Period between sending events.
+        :param options: Other ``EventPropagator`` options, as in the
+            configuration file. Omitted options take their default.
+        :return: A coroutine function applying the configuration.
+        :raises ValueError: If the configuration is invalid or changes an
+            option that requires a restart.
+        """
+        candidate = EventPropagator(
+            events_file=self.events_file,
+            endpoint=endpoint,
+            period=period,
+            **options,
+        )
+        fixed = self.restart_options(candidate)
+        kept = {}
+        # Enabling or disabling routes is in ``fixed``, so both propagators
+        # route when the destinations are compared.
+        if not fixed and self.router is not None:
+            current = {d.endpoint: d for d in self.destinations}
+            for destination in candidate.destinations:
+                if destination.endpoint not in current:
+                    continue
+                kept[destination] = current[destination.endpoint]
+                fixed += destination.sender.restart_options(
+                    current[destination.endpoint].sender
+                )
+        if fixed:
+            raise ValueError(
+                f"Changing {', '.join(sorted(set(fixed)))} requires a restart"
+            )
+
+        async def apply():
+            retired = self.adopt(candidate)
+            added = []
+            removed = []
+            if self.router is not None:
+                previous = self.destinations
+                retired += self.adopt_router(candidate.router, kept)
+                current = self.destinations
+                added = [d for d in current if d not in previous]
+                removed = [d for d in previous if d not in current]
+            logger.info(f"Applied propagator configuration for {endpoint}")
+            for client in retired:
+                await client.aclose()
+            for destination in added:
+                destination.sender.metrics = self.metrics
+                if self.running:
+                    await destination.start()
+            for destination in removed:
+                await destination.drain()
+
+        return apply
+
+    def adopt(self, other):
+        """
+        Take over the settings of another propagator that a running one can
+        change.
+
+        :param other: The EventPropagator built from the new configuration.
+        :return: Replaced HTTP clients with no request in flight, to be
+            closed by the caller.
+        """
+        for name in ADOPTED_OPTIONS:
+            setattr(self, name, getattr(other, name))
+        self.breaker.failure_threshold = other.breaker.failure_threshold
+        self.breaker.reset_timeout = other.breaker.reset_timeout
+        if self.limiter is not None:
+            if self.rate is None:
+                self.limiter.rate = 1 / self.period
+            else:
+                self.limiter.rate = self.rate
+                self.limiter.burst = self.rate_burst
+        if self.window is not None:
+            self.window.resize(self.max_in_flight)
+        if self.send_queue is not None:
+            self.set_workers(self.workers)
+        retired = []
+        if (self.limits, self.http2) != (other.limits, other.http2):
+            self.limits = other.limits
+            self.http2 = other.http2
+            if self.client is not None:
+                client, self.client = self.client, None
+                if not self.client_requests[client]:
+                    retired.append(client)
+        return retired
+
+    def adopt_router(self, router, kept):
+        """
+        Switch to the routing table of a new configuration, keeping the
+        destinations whose endpoint it still uses.
+
+        :param router: The Router built from the new configuration.
+        :param kept: New destinations mapped to the current destination of
+            the same endpoint.
+        :return: Replaced HTTP clients with no request in flight.
+        """
+        retired = []
+        for new, current in kept.items():
+            retired += current.sender.adopt(new.sender)
+            current.resize(new.workers, new.max_in_flight)
+        self.router = Router(
+            [
+                (patterns, [kept.get(d, d) for d in destinations])
+                for patterns, destinations in router.routes
+            ],
+            kept.get(router.default[0], router.default[0]),
+        )
+        self.encoded_routes = {}
+        return retired
+
+    def create_client(self):
+        """
+        Create the pooled HTTP client shared by all sends.
+
+        :return: A new ``httpx.AsyncClient``.
+        """
+        return httpx.AsyncClient(limits=self.limits, http2=self.http2)
+
+    async def release_client(self, client):
+        """
+        Record the end of a request, closing the client once its last
+        request finishes if it has been replaced meanwhile.
+
+        :param client: The ``httpx.AsyncClient`` the request was made with.
+        """
+        self.client_requests[client] -= 1
+        if self.client_requests[client] > 0:
+            return
+        del self.client_requests[client]
+        if client is not self.client:
+            await client.aclose()
+
+    async def close_client(self):
+        """
+        Close the pooled HTTP client, if one is open.
+        """
+        if self.client is not None:
+            client, self.client = self.client, None
+            await client.aclose()
 
     async def load_events_from_file(self):
         """
         Load events from the specified file.
+
+        In the streaming source modes the file is opened but not loaded.
         """
         try:
+            if self.source_mode == SOURCE_SEQUENTIAL:
+                self.source = SequentialSource(self.events_file)
+                await self.source.open()
+                return
+            if self.source_mode == SOURCE_INDEXED:
+                self.source = IndexedSource(self.events_file)
+                await self.source.open()
+                return
             async with aiofiles.open(self.events_file, mode="r") as file:
-                self.events = json.loads(await file.read())
+                events = codec.loads(await file.read())
+            if not isinstance(events, list):
+                raise ValueError("Events file must contain a list")
         except Exception as e:
             logger.error(f"Error loading events: {e}")
             raise ValueError(f"Error loading events: {e}")
+        self.load_events(events)
+
+    def load_events(self, events):
+        """
+        Validate and pre-encode a list of events for sending.
+
+        Invalid events are dropped and counted, so they are never picked.
+
+        :param events: Events to be loaded.
+        """
+        self.events = EncodedEvents()
+        self.invalid_events = 0
+        for event in events:
+            if is_valid_event(event):
+                self.events.append(encode_event(event, self.wire_format))
+            else:
+                self.invalid_events += 1
+        if self.invalid_events:
+            logger.warning(
+                f"Skipped {self.invalid_events} invalid event(s) "
+                f"out of {len(events)}"
+            )
+        logger.info(f"Loaded {len(self.events)} event(s)")
+
+    def encode_event(self, event):
+        """
+        Validate and encode a single event.
+
+        :param event: Event to be encoded.
+        :return: The encoded event, or ``None`` if the event is invalid.
+        """
+        if not is_valid_event(event):
+            # Sources log the records they cannot decode themselves.
+            if event is not None:
+                logger.warning(f"Invalid event format: {event}")
+            self.invalid_events += 1
+            return None
+        return encode_event(event, self.wire_format)
+
+    async def next_event(self):
+        """
+        Pick the next event to send.
+
+        :return: The next encoded event, or ``None`` if the source produced
+            an invalid event.
+        """
+        if self.source is not None:
+            return self.encode_event(await self.source.next_event())
+        return random.choice(self.events)
 
     async def send_event(self, event):
         """
@@ -51,42 +577,424 @@ class EventPropagator:
 
         :param event: Event to be sent.
         """
-        if not isinstance(event.get("event_type"), str) or not isinstance(
-            event.get("event_payload"), str
-        ):
-            logger.warning(f"Invalid event format: {event}")
+        encoded = self.encode_event(event)
+        if encoded is not None:
+            await self.send_encoded(encoded)
+
+    async def send_encoded(self, encoded):
+        """
+        Send a pre-encoded event, batching it if batching is enabled.
+
+        With a routing table the event is queued for each of its
+        destinations instead.
+
+        :param encoded: Event encoded in the propagator's wire format.
+        """
+        if self.router is not None:
+            for destination in self.route(encoded):
+                await destination.offer(encoded)
             return
+        if self.max_batch_size > 1:
+            await self.add_to_batch(encoded)
+        else:
+            await self.send_batch([encoded])
+
+    def route(self, encoded):
+        """
+        Destinations of an encoded event.
+
+        Events sampled from memory repeat, so their destinations are
+        remembered by their encoded bytes instead of decoding them again.
+        Every lookup hashes a fresh copy of the event, which still costs
+        about a tenth of decoding it, and the cache holds at most one copy
+        of each distinct event of the corpus.
+
+        :param encoded: Event encoded in the propagator's wire format.
+        :return: A list of Destination objects.
+        """
+        if self.source is None:
+            destinations = self.encoded_routes.get(encoded)
+            if destinations is None:
+                event = decode_event(encoded, self.wire_format)
+                destinations = self.router.match(event["event_type"])
+                self.encoded_routes[encoded] = destinations
+            return destinations
+        event = decode_event(encoded, self.wire_format)
+        return self.router.match(event["event_type"])
+
+    async def add_to_batch(self, event):
+        """
+        Buffer an event and flush the batch once it is full.
+
+        The first event of a new batch arms a timer so that no event waits
+        longer than ``max_batch_latency_ms``.
 
-        async with httpx.AsyncClient() as client:
+        :param event: Encoded event to be buffered.
+        """
+        self.batch.append(event)
+        if len(self.batch) >= self.max_batch_size:
+            await self.flush_batch()
+        elif self.flush_timer is None:
+            self.flush_timer = asyncio.get_running_loop().call_later(
+                self.max_batch_latency_ms / 1000, self.schedule_flush
+            )
+
+    def schedule_flush(self):
+        """
+        Flush the batch in the background when the latency timer fires.
+        """
+        self.flush_timer = None
+        task = asyncio.create_task(self.flush_batch())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush_batch(self):
+        """
+        Send all buffered events as a single request.
+        """
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.batch = self.batch, []
+        if batch:
+            await self.send_batch(batch)
+
+    async def send_batch(self, events, attempt=0):
+        """
+        Send a list of events to the specified endpoint in one request.
+
+        Failed batches are scheduled for a retry. While the circuit breaker
+        is open no request is made and the batch waits in the retry queue.
+
+        :param events: Encoded events to be sent.
+        :param attempt: Number of previous failed attempts for this batch.
+        """
+        if not self.breaker.allow_request():
+            await self.schedule_retry(events, attempt)
+            return
+
+        if self.client is None:
+            self.client = self.create_client()
+        client = self.client
+        self.client_requests[client] += 1
+
+        metrics = self.metrics
+        metrics.batch_events.observe(len(events))
+        metrics.requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
             try:
-                response = await client.post(self.endpoint, json=[event])
-                response.raise_for_status()
-                if not response.text:
-                    logger.warning(
-                        f"Received empty response for event: {event}"
-                    )
-            except httpx.HTTPStatusError as e:
-                logger.error(
-                    f"HTTP error sending event: "
-                    f"{e.response.status_code} - {e.response.text}"
+                response = await client.post(
+                    self.endpoint,
+                    content=self.encode_body(events),
+                    headers=self.headers,
                 )
-            except httpx.RequestError as e:
-                logger.error(f"Request error sending event: {e}")
-            except Exception as e:
-                logger.error(f"Unexpected error sending event: {e}")
+            finally:
+                metrics.send_seconds.observe(time.perf_counter() - started)
+                metrics.requests_in_flight.dec()
+                await self.release_client(client)
+            response.raise_for_status()
+            if not response.text:
+                logger.warning(
+                    f"Received empty response for {len(events)} event(s)"
+                )
+        except httpx.HTTPStatusError as e:
+            logger.error(
+                f"HTTP error sending events: "
+                f"{e.response.status_code} - {e.response.text}"
+            )
+            if e.response.status_code not in RETRYABLE_STATUSES:
+                self.breaker.record_success()
+                self.stats.dropped_events += len(events)
+                return
+        except httpx.RequestError as e:
+            logger.error(f"Request error sending events: {e}")
+        except asyncio.CancelledError:
+            self.breaker.abandon_probe()
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error sending events: {e}")
+            # Otherwise a failed probe would leave the breaker half-open,
+            # refusing every later request.
+            self.breaker.abandon_probe()
+            self.stats.dropped_events += len(events)
+            return
+        else:
+            self.breaker.record_success()
+            self.stats.sent_batches += 1
+            self.stats.sent_events += len(events)
+            return
+
+        self.stats.failed_attempts += 1
+        if self.breaker.record_failure():
+            self.stats.circuit_opened += 1
+            logger.warning(
+                f"Pausing sends for {self.breaker.reset_timeout}s "
+                f"after {self.breaker.failures} failure(s)"
+            )
+        await self.schedule_retry(events, attempt + 1)
+
+    async def schedule_retry(self, events, attempt):
+        """
+        Queue a batch for a later retry, or spill it when it cannot be
+        retried.
+
+        :param events: Events of the batch.
+        :param attempt: Number of failed attempts for this batch.
+        """
+        if (
+            attempt > self.max_retries
+            or len(self.retry_queue) >= self.retry_queue_size
+        ):
+            await self.spill_or_drop(events)
+            return
+        delay = max(
+            backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay),
+            self.breaker.retry_after(),
+        )
+        due = asyncio.get_running_loop().time() + delay
+        heapq.heappush(
+            self.retry_queue, (due, next(self.retry_sequence), events, attempt)
+        )
+        self.retry_wakeup.set()
+
+    async def spill_events(self, events):
+        """
+        Append a batch to the spill file, if spilling is on.
+
+        Spilled events are stored decoded, so they can be replayed with any
+        wire format.
+
+        :param events: Encoded events of the batch.
+        :return: True if the batch was spilled.
+        """
+        if self.spill is None:
+            return False
+        try:
+            await self.spill.append(
+                [decode_event(event, self.wire_format) for event in events]
+            )
+        except Exception as e:
+            logger.error(f"Error spilling events: {e}")
+            return False
+        self.stats.spilled_events += len(events)
+        return True
+
+    async def spill_or_drop(self, events):
+        """
+        Append a batch to the spill file, or drop it if spilling is off.
+
+        :param events: Encoded events of the batch.
+        """
+        if await self.spill_events(events):
+            return
+        logger.error(f"Dropping {len(events)} undeliverable event(s)")
+        self.stats.dropped_events += len(events)
+
+    async def replay_spill(self):
+        """
+        Resend spilled batches while the consumer is reachable.
+        """
+        async for events in self.spill.replay():
+            self.stats.replayed_events += len(events)
+            encoded = [self.encode_event(event) for event in events]
+            encoded = [event for event in encoded if event is not None]
+            if encoded:
+                await self.send_batch(encoded)
+
+    async def retry_loop(self):
+        """
+        Retry queued batches when they are due and replay spilled batches
+        once the consumer has recovered.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.retry_queue:
+                if (
+                    self.spill is not None
+                    and self.breaker.state == CircuitBreaker.CLOSED
+                    and self.spill.has_data()
+                ):
+                    await self.replay_spill()
+                    continue
+                self.retry_wakeup.clear()
+                await self.retry_wakeup.wait()
+                continue
+            delay = self.retry_queue[0][0] - loop.time()
+            if delay > 0:
+                self.retry_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.retry_wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, events, attempt = heapq.heappop(self.retry_queue)
+            self.stats.retried_batches += 1
+            await self.send_batch(events, attempt)
+
+    async def spill_pending_retries(self):
+        """
+        Spill or drop every batch still waiting for a retry.
+        """
+        while self.retry_queue:
+            _, _, events, _ = heapq.heappop(self.retry_queue)
+            await self.spill_or_drop(events)
+
+    @property
+    def headers(self):
+        """
+        Request headers describing the encoded body.
+        """
+        headers = {"Content-Type": CONTENT_TYPES[self.wire_format]}
+        if self.content_encoding:
+            headers["Content-Encoding"] = self.content_encoding
+        return headers
+
+    def encode_body(self, events):
+        """
+        Join and compress pre-encoded events into a request body.
+
+        :param events: Encoded events.
+        :return: The request body.
+        """
+        body = join_batch(events, self.wire_format)
+        return compress_body(body, self.content_encoding)
 
     async def event_loop(self):
         """
         Continuously send events at the specified period.
+
+        Sends follow a fixed schedule, so the time a send takes is not added
+        to the period. With ``rate`` set, a pool of workers is used instead.
         """
+        if self.rate is not None:
+            await self.pooled_event_loop()
+            return
+
+        self.limiter = RateLimiter(1 / self.period)
         while True:
-            event = random.choice(self.events)
-            await self.send_event(event)
-            await asyncio.sleep(self.period)
+            await self.limiter.acquire()
+            event = await self.next_event()
+            if event is not None:
+                await self.send_encoded(event)
+
+    async def pooled_event_loop(self):
+        """
+        Generate events at ``rate`` per second and send them concurrently.
+
+        Generation pauses while ``max_in_flight`` events are waiting or being
+        sent, so a slow consumer cannot make the backlog grow without bound.
+        """
+        self.limiter = RateLimiter(self.rate, burst=self.rate_burst)
+        self.window = InFlightWindow(self.max_in_flight)
+        self.send_queue = asyncio.Queue()
+        self.set_workers(self.workers)
+        try:
+            while True:
+                await self.window.acquire()
+                await self.limiter.acquire()
+                event = await self.next_event()
+                if event is None:
+                    self.window.release()
+                    continue
+                self.in_flight += 1
+                self.send_queue.put_nowait(event)
+        finally:
+            workers = list(self.worker_tasks)
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.active_workers = 0
+
+    def set_workers(self, count):
+        """
+        Start or stop sender coroutines until ``count`` of them run.
+
+        A worker told to stop first sends the events queued before it was
+        told, so no event is lost.
+
+        :param count: Number of sender coroutines.
+        """
+        while self.active_workers < count:
+            task = asyncio.create_task(self.send_worker())
+            self.worker_tasks.add(task)
+            task.add_done_callback(self.worker_tasks.discard)
+            self.active_workers += 1
+        while self.active_workers > count:
+            self.send_queue.put_nowait(None)
+            self.active_workers -= 1
+
+    async def send_worker(self):
+        """
+        Send events taken from the queue until cancelled or told to stop.
+        """
+        while True:
+            event = await self.send_queue.get()
+            if event is None:
+                return
+            try:
+                await self.send_encoded(event)
+            finally:
+                self.in_flight -= 1
+                self.window.release()
+
+    async def open_delivery(self):
+        """
+        Open the pooled HTTP client and start retrying failed batches.
+        """
+        self.client = self.create_client()
+        self.retry_task = asyncio.create_task(self.retry_loop())
+
+    async def close_delivery(self):
+        """
+        Flush buffered events, spill or drop batches still waiting for a
+        retry and close the pooled HTTP client.
+        """
+        await self.flush_batch()
+        if self.flush_tasks:
+            await asyncio.gather(*self.flush_tasks, return_exceptions=True)
+        if self.retry_task is not None:
+            self.retry_task.cancel()
+            await asyncio.gather(self.retry_task, return_exceptions=True)
+            self.retry_task = None
+        await self.spill_pending_retries()
+        await self.close_client()
+        logger.info(
+            f"Delivery stats for {self.endpoint}: {self.stats.as_dict()}"
+        )
 
     async def run(self):
         """
         Load events from file and start the event loop.
+
+        The pooled HTTP client is opened here and closed when the loop is
+        cancelled, after any buffered events have been flushed. Batches
+        still waiting for a retry at that point are spilled or dropped. With
+        a routing table, every destination is opened and closed the same
+        way.
         """
         await self.load_events_from_file()
-        await self.event_loop()
+        metrics_runner = None
+        if self.metrics_port is not None:
+            metrics_runner = await start_metrics_server(
+                self.metrics.registry, self.metrics_host, self.metrics_port
+            )
+        if self.router is None:
+            await self.open_delivery()
+        else:
+            for destination in self.destinations:
+                await destination.start()
+        self.running = True
+        try:
+            await self.event_loop()
+        finally:
+            self.running = False
+            if self.router is None:
+                await self.close_delivery()
+            else:
+                for destination in self.destinations:
+                    await destination.stop()
+            if self.source is not None:
+                await self.source.close()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
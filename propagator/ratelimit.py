@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=1, clock=None):
+        """
+        Initialize the RateLimiter.
+
+        A token bucket implemented as a virtual schedule (GCRA): every permit
+        is assigned the next slot of a fixed-rate timetable, so time spent
+        sending does not add to the interval and the average rate does not
+        drift. Up to ``burst`` permits may be taken at once to catch up after
+        a stall.
+
+        :param rate: Target number of permits per second.
+        :param burst: Bucket size, the number of permits available at once.
+        :param clock: Monotonic clock function, for testing.
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        if burst < 1:
+            raise ValueError("Burst must be at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock or time.monotonic
+        self.next_slot = self.clock()
+
+    @property
+    def interval(self):
+        return 1 / self.rate
+
+    def reserve(self):
+        """
+        Reserve the next permit.
+
+        :return: Seconds to wait before the permit may be used.
+        """
+        now = self.clock()
+        earliest = now - (self.burst - 1) * self.interval
+        slot = max(self.next_slot, earliest)
+        self.next_slot = slot + self.interval
+        return max(0.0, slot - now)
+
+    async def acquire(self):
+        """
+        Wait until the next permit is available.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class InFlightWindow:
+    def __init__(self, size):
+        """
+        Initialize the InFlightWindow.
+
+        Bounds the number of events generated but not yet sent, like a
+        semaphore whose size can change while permits are held.
+
+        :param size: Maximum number of permits held at once.
+        """
+        self.size = size
+        self.used = 0
+        self.freed = asyncio.Event()
+
+    async def acquire(self):
+        """
+        Wait until a permit is free and take it.
+        """
+        while self.used >= self.size:
+            self.freed.clear()
+            await self.freed.wait()
+        self.used += 1
+
+    def release(self):
+        """
+        Return a permit.
+        """
+        self.used -= 1
+        self.freed.set()
+
+    def resize(self, size):
+        """
+        Change the number of permits. Shrinking takes effect as permits are
+        returned.
+
+        :param size: New maximum number of permits held at once.
+        """
+        self.size = size
+        self.freed.set()
@@ -0,0 +1,178 @@
+import asyncio
+import contextlib
+import fnmatch
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Events a destination may hold before new ones are spilled or dropped,
+# unless its ``max_in_flight`` is configured.
+DEFAULT_DESTINATION_QUEUE = 1000
+# Number of event types whose destinations are remembered.
+MAX_CACHED_TYPES = 10_000
+
+
+class Destination:
+    def __init__(
+        self, sender, workers=1, max_in_flight=DEFAULT_DESTINATION_QUEUE
+    ):
+        """
+        Initialize the Destination.
+
+        One endpoint events are routed to. Its sender is an EventPropagator
+        used only for delivery, so every destination has its own connection
+        pool, batch buffer, retry queue and circuit breaker. Events wait in a
+        bounded queue drained by the destination's own workers; when the
+        queue is full, events for this destination are spilled like failed
+        batches, or dropped without a spill file, instead of holding up the
+        others.
+
+        :param sender: The EventPropagator delivering to the endpoint.
+        :param workers: Number of concurrent sender coroutines.
+        :param max_in_flight: Maximum number of events waiting for this
+            destination.
+        """
+        self.sender = sender
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.queue = asyncio.Queue()
+        self.tasks = []
+        self.overflowing = False
+
+    @property
+    def endpoint(self):
+        return self.sender.endpoint
+
+    async def offer(self, encoded):
+        """
+        Queue an event for this destination without waiting for its workers.
+
+        An event that does not fit in the queue is spilled, or dropped if the
+        sender has no spill file. A warning is logged each time the queue
+        fills up.
+
+        :param encoded: Event encoded in the propagator's wire format.
+        :return: True if the event was queued, False if it was spilled or
+            dropped.
+        """
+        if self.queue.qsize() < self.max_in_flight:
+            self.overflowing = False
+            self.queue.put_nowait(encoded)
+            return True
+        if not self.overflowing:
+            self.overflowing = True
+            action = "spilling" if self.sender.spill else "dropping"
+            logger.warning(
+                f"Queue for {self.endpoint} is full ({self.max_in_flight} "
+                f"events), {action} new events until it drains"
+            )
+        if not await self.sender.spill_events([encoded]):
+            self.sender.stats.dropped_events += 1
+        return False
+
+    async def start(self):
+        """
+        Open the sender and start the workers.
+        """
+        await self.sender.open_delivery()
+        self.tasks = [
+            asyncio.create_task(self.send_worker()) for _ in range(self.workers)
+        ]
+
+    def resize(self, workers, max_in_flight):
+        """
+        Change the number of workers and the queue bound while running.
+
+        Workers beyond the new count stop once they reach a marker queued
+        behind the events already waiting. Events above a smaller bound are
+        kept and sent; only new events are spilled or dropped until the queue
+        shrinks.
+
+        :param workers: Number of concurrent sender coroutines.
+        :param max_in_flight: Maximum number of events waiting for this
+            destination.
+        """
+        self.max_in_flight = max_in_flight
+        if self.tasks:
+            self.tasks = [task for task in self.tasks if not task.done()]
+            for _ in range(workers, self.workers):
+                self.queue.put_nowait(None)
+            for _ in range(self.workers, workers):
+                self.tasks.append(asyncio.create_task(self.send_worker()))
+        self.workers = workers
+
+    async def send_worker(self):
+        """
+        Send queued events until cancelled or told to stop.
+        """
+        while True:
+            encoded = await self.queue.get()
+            if encoded is None:
+                return
+            await self.sender.send_encoded(encoded)
+
+    async def drain(self):
+        """
+        Let the workers send every queued event and finish their requests,
+        then stop.
+        """
+        for _ in self.tasks:
+            self.queue.put_nowait(None)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.stop()
+
+    async def stop(self):
+        """
+        Stop the workers, then batch and flush the events still queued.
+        """
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self.tasks = []
+        while not self.queue.empty():
+            encoded = self.queue.get_nowait()
+            if encoded is not None:
+                self.sender.batch.append(encoded)
+        await self.sender.close_delivery()
+
+
+class Router:
+    def __init__(self, routes, default):
+        """
+        Initialize the Router.
+
+        Routes are tried in order and the first one with a matching pattern
+        decides the destinations of an event type. Types no route matches go
+        to the default destination.
+
+        :param routes: ``(patterns, destinations)`` pairs, where patterns
+            are event types or ``fnmatch`` patterns such as ``user_*``.
+        :param default: Destination of unmatched event types.
+        """
+        self.routes = routes
+        self.default = [default]
+        self.cache = {}
+
+    def match(self, event_type):
+        """
+        Destinations of an event type.
+
+        :param event_type: The event type.
+        :return: A list of Destination objects.
+        """
+        destinations = self.cache.get(event_type)
+        if destinations is not None:
+            return destinations
+        destinations = self.default
+        for patterns, route_destinations in self.routes:
+            if any(
+                fnmatch.fnmatchcase(event_type, pattern) for pattern in patterns
+            ):
+                destinations = route_destinations
+                break
+        if len(self.cache) >= MAX_CACHED_TYPES:
+            self.cache.clear()
+        self.cache[event_type] = destinations
+        return destinations
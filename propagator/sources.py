@@ -0,0 +1,382 @@
+import array
+import asyncio
+import codecs
+import contextlib
+import json
+import logging
+import mmap
+import os
+import random
+import re
+
+import aiofiles
+
+from runtime import codec
+
+logger = logging.getLogger(__name__)
+
+SOURCE_MEMORY = "memory"
+SOURCE_SEQUENTIAL = "sequential"
+SOURCE_INDEXED = "indexed"
+SOURCE_MODES = (SOURCE_MEMORY, SOURCE_SEQUENTIAL, SOURCE_INDEXED)
+
+READ_CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+DECODER = json.JSONDecoder()
+
+# Strings (skipped as a whole) and the brackets of a JSON document.
+JSON_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{}]', re.DOTALL)
+# Strings, possibly cut off by the end of the text, and the punctuation
+# that ends an array element.
+ELEMENT_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(")?|[\[\]{},]', re.DOTALL)
+INDEX_MAGIC = b"EVIDX1\n"
+
+
+def element_complete(text, pos):
+    """
+    Check whether the array element starting at ``pos`` ends within ``text``.
+
+    An element ends at a closing bracket that balances or mismatches its
+    opening one, or at a ``,`` or ``]`` outside of any brackets. Reading more text cannot
+    repair an element that fails to decode once it is complete.
+
+    :param text: The buffered text.
+    :param pos: Position of the first character of the element.
+    :return: ``True`` if the end of the element is in ``text``.
+    """
+    closers = []
+    for match in ELEMENT_TOKEN.finditer(text, pos):
+        token = match.group()
+        if token.startswith('"'):
+            if match.group(1) is None:
+                return False
+        elif token in "[{":
+            closers.append("]" if token == "[" else "}")
+        elif token in "]}":
+            # A mismatched bracket cannot be balanced by more text either.
+            if not closers or closers.pop() != token or not closers:
+                return True
+        elif not closers:
+            return True
+    return False
+
+
+async def iter_file_events(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Stream events from a JSON array or NDJSON file without loading it fully.
+
+    The format is detected from the first non-whitespace character. NDJSON
+    lines that cannot be decoded are logged and yielded as ``None``.
+
+    :param path: Path to the events file.
+    :param chunk_size: Number of bytes to read at a time.
+    :raises ValueError: If the file is not valid JSON or NDJSON.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    # Characters dropped from the front of the buffer, to report positions.
+    base = 0
+    eof = False
+
+    async with aiofiles.open(path, mode="rb") as file:
+
+        async def fill(min_size=0):
+            # Reads until more than min_size characters were added, so the
+            # buffer is rebuilt once however many chunks that takes.
+            nonlocal buffer, pos, base, eof
+            if eof:
+                return False
+            texts = []
+            size = 0
+            while not eof and size <= min_size:
+                chunk = await file.read(chunk_size)
+                eof = not chunk
+                texts.append(decoder.decode(chunk, final=eof))
+                size += len(texts[-1])
+            buffer = buffer[pos:] + "".join(texts)
+            base += pos
+            pos = 0
+            return True
+
+        async def peek():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not await fill():
+                    return ""
+
+        first = await peek()
+        if first != "[":
+            # NDJSON: one event per non-empty line.
+            scan_from = 0
+            while True:
+                newline = buffer.find("\n", pos + scan_from)
+                if newline == -1:
+                    scan_from = len(buffer) - pos
+                    if await fill(scan_from):
+                        continue
+                end = len(buffer) if newline == -1 else newline
+                line = buffer[pos:end]
+                pos = end + 1
+                scan_from = 0
+                if line.strip():
+                    try:
+                        event = codec.loads(line)
+                    except ValueError as e:
+                        logger.warning(f"Undecodable line in {path}: {e}")
+                        event = None
+                    yield event
+                if newline == -1:
+                    return
+
+        pos += 1
+        if await peek() == "]":
+            return
+        while True:
+            await peek()
+            try:
+                item, end = DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Doubling the text before retrying keeps a large element
+                # linear to parse.
+                if not element_complete(buffer, pos) and await fill(
+                    len(buffer) - pos
+                ):
+                    continue
+                raise ValueError(
+                    f"Invalid array element at character {base + pos}: "
+                    f"{e.msg}"
+                ) from e
+            if (
+                end == len(buffer)
+                and not isinstance(item, (dict, list, str))
+                and await fill()
+            ):
+                continue
+            pos = end
+            yield item
+            char = await peek()
+            pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' or ']' after array element")
+
+
+def build_offset_index(data):
+    """
+    Find the byte range of every event in a JSON array or NDJSON buffer.
+
+    Scalar elements of a JSON array are not events and are skipped.
+
+    :param data: The file contents, typically a memory map.
+    :return: A flat ``array('Q')`` of ``start, end`` offset pairs.
+    """
+    offsets = array.array("Q")
+    start = 0
+    while start < len(data) and data[start : start + 1].isspace():
+        start += 1
+
+    if data[start : start + 1] != b"[":
+        while start < len(data):
+            end = data.find(b"\n", start)
+            if end == -1:
+                end = len(data)
+            if data[start:end].strip():
+                offsets.extend((start, end))
+            start = end + 1
+        return offsets
+
+    depth = 0
+    element_start = None
+    for match in JSON_TOKEN.finditer(data, start):
+        token = match.group()
+        if token in (b"[", b"{"):
+            if depth == 1 and element_start is None:
+                element_start = match.start()
+            depth += 1
+        elif token in (b"]", b"}"):
+            depth -= 1
+            if depth == 1 and element_start is not None:
+                offsets.extend((element_start, match.end()))
+                element_start = None
+            elif depth == 0:
+                break
+    return offsets
+
+
+class SequentialSource:
+    def __init__(self, path):
+        """
+        Initialize the SequentialSource.
+
+        Replays the events file in order, streaming it from disk and starting
+        over at the end.
+
+        :param path: Path to the events file.
+        """
+        self.path = path
+        self.events = None
+
+    async def open(self):
+        """
+        Check that the file contains at least one event.
+        """
+        async with contextlib.aclosing(iter_file_events(self.path)) as events:
+            async for _ in events:
+                return
+        raise ValueError("Events file is empty")
+
+    async def next_event(self):
+        """
+        Return the next event of the file.
+
+        A JSON array that cannot be decoded further is replayed from the
+        start, so a corrupt file does not stop the propagator.
+
+        :return: The next event, or ``None`` if a record cannot be decoded.
+        """
+        while True:
+            if self.events is None:
+                self.events = iter_file_events(self.path)
+            try:
+                return await self.events.__anext__()
+            except StopAsyncIteration:
+                self.events = None
+            except ValueError as e:
+                logger.warning(f"Undecodable events in {self.path}: {e}")
+                self.events = None
+                return None
+
+    async def close(self):
+        """
+        Stop streaming the file.
+        """
+        if self.events is not None:
+            await self.events.aclose()
+            self.events = None
+
+
+class IndexedSource:
+    def __init__(self, path, index_path=None):
+        """
+        Initialize the IndexedSource.
+
+        Samples events at random from a memory-mapped events file through an
+        index of byte offsets. The index is saved next to the file and reused
+        while the file is unchanged, so startup does not parse the corpus.
+
+        :param path: Path to the events file.
+        :param index_path: Path of the offset index file. Defaults to the
+            events file path with an ``.idx`` suffix.
+        """
+        self.path = path
+        self.index_path = index_path or f"{path}.idx"
+        self.file = None
+        self.data = None
+        self.offsets = None
+
+    def index_header(self):
+        """
+        Build the index header identifying the current events file.
+
+        :return: The header bytes.
+        """
+        stat = os.stat(self.path)
+        return INDEX_MAGIC + f"{stat.st_size} {stat.st_mtime_ns}\n".encode()
+
+    def load_index(self):
+        """
+        Load the saved offset index if it matches the events file.
+
+        :return: The offsets, or ``None`` if the index is missing or stale.
+        """
+        header = self.index_header()
+        try:
+            with open(self.index_path, "rb") as file:
+                if file.read(len(header)) != header:
+                    return None
+                offsets = array.array("Q")
+                offsets.frombytes(file.read())
+                if len(offsets) % 2:
+                    return None
+                return offsets
+        except (OSError, ValueError):
+            return None
+
+    def save_index(self, offsets):
+        """
+        Save the offset index next to the events file.
+
+        :param offsets: The offsets to save.
+        """
+        try:
+            with open(self.index_path, "wb") as file:
+                file.write(self.index_header())
+                file.write(offsets.tobytes())
+        except OSError as e:
+            logger.warning(f"Could not save events index: {e}")
+
+    def open_sync(self):
+        """
+        Map the events file and load or build its offset index.
+        """
+        with contextlib.ExitStack() as stack:
+            file = stack.enter_context(open(self.path, "rb"))
+            if os.fstat(file.fileno()).st_size == 0:
+                raise ValueError("Events file is empty")
+            data = stack.enter_context(
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+            offsets = self.load_index()
+            if offsets is None:
+                logger.info(f"Building events index for {self.path}")
+                offsets = build_offset_index(data)
+                self.save_index(offsets)
+            if not offsets:
+                raise ValueError("Events file is empty")
+            # Keep the file and the mapping open only once they are usable.
+            stack.pop_all()
+        self.file, self.data, self.offsets = file, data, offsets
+
+    async def open(self):
+        """
+        Map the events file and load or build its offset index.
+        """
+        await asyncio.to_thread(self.open_sync)
+
+    def __len__(self):
+        """
+        Number of indexed events.
+        """
+        return len(self.offsets) // 2
+
+    async def next_event(self):
+        """
+        Return a randomly chosen event.
+
+        :return: The decoded event, or ``None`` if the record cannot be
+            decoded.
+        """
+        i = random.randrange(len(self)) * 2
+        start, end = self.offsets[i], self.offsets[i + 1]
+        try:
+            return codec.loads(self.data[start:end])
+        except ValueError as e:
+            logger.warning(
+                f"Undecodable event at byte {start} of {self.path}: {e}"
+            )
+            return None
+
+    async def close(self):
+        """
+        Unmap and close the events file.
+        """
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+            self.data = self.file = None
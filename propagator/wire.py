@@ -0,0 +1,186 @@
+import array
+import gzip
+
+from runtime import codec
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:  # pragma: no cover - depends on the Python version
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+WIRE_JSON = "json"
+WIRE_NDJSON = "ndjson"
+WIRE_MSGPACK = "msgpack"
+
+CONTENT_TYPES = {
+    WIRE_JSON: "application/json",
+    WIRE_NDJSON: "application/x-ndjson",
+    WIRE_MSGPACK: "application/msgpack",
+}
+
+ENCODING_GZIP = "gzip"
+ENCODING_ZSTD = "zstd"
+
+
+def check_wire_format(wire_format):
+    """
+    Check that a wire format is known and its encoder is installed.
+
+    :param wire_format: Name of the wire format.
+    :raises ValueError: If the wire format cannot be used.
+    """
+    if wire_format not in CONTENT_TYPES:
+        raise ValueError(f"Unknown wire format: {wire_format}")
+    if wire_format == WIRE_MSGPACK and msgpack is None:
+        raise ValueError("The msgpack wire format requires the msgpack package")
+
+
+def is_valid_event(event):
+    """
+    Check that an event has string type and payload.
+
+    :param event: Event to be checked.
+    :return: True if the event is valid.
+    """
+    return (
+        isinstance(event, dict)
+        and isinstance(event.get("event_type"), str)
+        and isinstance(event.get("event_payload"), str)
+    )
+
+
+def encode_event(event, wire_format):
+    """
+    Encode a single event in the given wire format.
+
+    :param event: Event to be encoded.
+    :param wire_format: Name of the wire format.
+    :return: The encoded event, ready to be joined into a batch.
+    """
+    if wire_format == WIRE_MSGPACK:
+        return msgpack.packb(event)
+    return codec.dumps_bytes(event)
+
+
+def decode_event(data, wire_format):
+    """
+    Decode a single event encoded by ``encode_event``.
+
+    :param data: The encoded event.
+    :param wire_format: Name of the wire format.
+    :return: The decoded event.
+    """
+    if wire_format == WIRE_MSGPACK:
+        return msgpack.unpackb(data)
+    return codec.loads(data)
+
+
+def msgpack_array_header(length):
+    """
+    Build the msgpack header of an array with ``length`` elements.
+
+    :param length: Number of array elements.
+    :return: The header bytes.
+    """
+    if length < 16:
+        return bytes((0x90 | length,))
+    if length < 2**16:
+        return b"\xdc" + length.to_bytes(2, "big")
+    return b"\xdd" + length.to_bytes(4, "big")
+
+
+def join_batch(encoded_events, wire_format):
+    """
+    Assemble pre-encoded events into a request body without re-encoding.
+
+    :param encoded_events: Events encoded by ``encode_event``.
+    :param wire_format: Name of the wire format.
+    :return: The encoded request body.
+    """
+    if wire_format == WIRE_NDJSON:
+        return b"\n".join(encoded_events) + b"\n"
+    if wire_format == WIRE_MSGPACK:
+        return msgpack_array_header(len(encoded_events)) + b"".join(
+            encoded_events
+        )
+    return b"[" + b",".join(encoded_events) + b"]"
+
+
+def encode_batch(events, wire_format):
+    """
+    Encode a list of events in the given wire format.
+
+    :param events: Events to be encoded.
+    :param wire_format: Name of the wire format.
+    :return: The encoded request body.
+    """
+    return join_batch(
+        [encode_event(event, wire_format) for event in events], wire_format
+    )
+
+
+class EncodedEvents:
+    def __init__(self):
+        """
+        Initialize the EncodedEvents.
+
+        An append-only sequence of encoded events stored back to back in one
+        buffer, with their end offsets in a compact array.
+        """
+        self.data = bytearray()
+        self.offsets = array.array("Q", [0])
+
+    def append(self, encoded):
+        """
+        Append an encoded event.
+
+        :param encoded: The encoded event.
+        """
+        self.data += encoded
+        self.offsets.append(len(self.data))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("Event index out of range")
+        return bytes(self.data[self.offsets[index] : self.offsets[index + 1]])
+
+
+def check_content_encoding(content_encoding):
+    """
+    Check that a content encoding is known and its compressor is installed.
+
+    :param content_encoding: Name of the content encoding, or ``None``.
+    :raises ValueError: If the content encoding cannot be used.
+    """
+    if content_encoding not in (None, ENCODING_GZIP, ENCODING_ZSTD):
+        raise ValueError(f"Unknown content encoding: {content_encoding}")
+    if content_encoding == ENCODING_ZSTD and zstd is None:
+        raise ValueError(
+            "The zstd content encoding requires Python 3.14 or backports.zstd"
+        )
+
+
+def compress_body(body, content_encoding):
+    """
+    Compress a request body with the given content encoding.
+
+    :param body: The encoded request body.
+    :param content_encoding: Name of the content encoding, or ``None``.
+    :return: The compressed request body.
+    """
+    if content_encoding == ENCODING_GZIP:
+        return gzip.compress(body, mtime=0)
+    if content_encoding == ENCODING_ZSTD:
+        return zstd.compress(body)
+    return body
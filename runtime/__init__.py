@@ -0,0 +1,7 @@
+from .profile import (  # noqa: F401
+    PROFILE_FAST,
+    PROFILE_STANDARD,
+    PROFILES,
+    describe,
+    use_profile,
+)
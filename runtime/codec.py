@@ -0,0 +1,76 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+LIBRARY_JSON = "json"
+LIBRARY_ORJSON = "orjson"
+
+
+def json_dumps(obj):
+    """
+    Encode a value as JSON text with the standard library.
+
+    :param obj: The value to encode.
+    :return: The JSON text.
+    """
+    return json.dumps(obj)
+
+
+def json_dumps_bytes(obj):
+    """
+    Encode a value as compact UTF-8 JSON with the standard library.
+
+    :param obj: The value to encode.
+    :return: The JSON bytes.
+    """
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def orjson_dumps(obj):
+    """
+    Encode a value as JSON text with orjson.
+
+    :param obj: The value to encode.
+    :return: The JSON text.
+    """
+    return orjson.dumps(obj).decode()
+
+
+# The active encoder and decoder, switched by ``use_library``. Callers look
+# them up on this module at call time, so a switch reaches every caller.
+library = LIBRARY_JSON
+loads = json.loads
+dumps = json_dumps
+dumps_bytes = json_dumps_bytes
+
+
+def use_library(name):
+    """
+    Switch the JSON library used by both services.
+
+    Both libraries decode to the same values and raise a ``ValueError``
+    subclass on invalid input. orjson writes non-ASCII characters as UTF-8
+    instead of escaping them.
+
+    :param name: ``"json"`` or ``"orjson"``.
+    :return: The library in use, which is ``"json"`` if orjson was asked
+        for but is not installed.
+    :raises ValueError: If the library is unknown.
+    """
+    global library, loads, dumps, dumps_bytes
+    if name not in (LIBRARY_JSON, LIBRARY_ORJSON):
+        raise ValueError(f"Unknown JSON library: {name}")
+    if name == LIBRARY_ORJSON and orjson is not None:
+        library = LIBRARY_ORJSON
+        loads = orjson.loads
+        dumps = orjson_dumps
+        dumps_bytes = orjson.dumps
+    else:
+        library = LIBRARY_JSON
+        loads = json.loads
+        dumps = json_dumps
+        dumps_bytes = json_dumps_bytes
+    return library
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+
+from . import codec
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover - optional dependency
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_STANDARD = "standard"
+PROFILE_FAST = "fast"
+PROFILES = (PROFILE_STANDARD, PROFILE_FAST)
+
+LOOP_ASYNCIO = "asyncio"
+LOOP_UVLOOP = "uvloop"
+
+# The profile in use and what it resolved to, set by ``use_profile``.
+active = {
+    "profile": PROFILE_STANDARD,
+    "json": codec.LIBRARY_JSON,
+    "event_loop": LOOP_ASYNCIO,
+}
+
+
+def use_profile(name):
+    """
+    Select the runtime profile of this process.
+
+    The ``standard`` profile uses the default asyncio event loop and the
+    ``json`` module. The ``fast`` profile installs uvloop as the event loop
+    policy and encodes and decodes JSON with orjson; either library that is
+    not installed falls back to the standard one. Call it before the event
+    loop is created. Worker processes select their profile themselves.
+
+    :param name: ``"standard"`` or ``"fast"``.
+    :return: A dictionary describing the profile and the event loop and
+        JSON library it resolved to.
+    :raises ValueError: If the profile is unknown.
+    """
+    if name not in PROFILES:
+        raise ValueError(f"Unknown runtime profile: {name}")
+    fast = name == PROFILE_FAST
+    json_library = codec.use_library(
+        codec.LIBRARY_ORJSON if fast else codec.LIBRARY_JSON
+    )
+    if fast and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        event_loop = LOOP_UVLOOP
+    else:
+        asyncio.set_event_loop_policy(None)
+        event_loop = LOOP_ASYNCIO
+    active.update(profile=name, json=json_library, event_loop=event_loop)
+    if fast and json_library != codec.LIBRARY_ORJSON:
+        logger.warning("orjson is not installed, using the json module")
+    if fast and event_loop != LOOP_UVLOOP:
+        logger.warning("uvloop is not installed, using the asyncio loop")
+    return dict(active)
+
+
+def describe():
+    """
+    Describe the runtime profile in use, for startup logs.
+
+    :return: A one-line description.
+    """
+    return (
+        f"{active['profile']} (event loop: {active['event_loop']}, "
+        f"JSON: {active['json']})"
+    )
@@ -0,0 +1,14 @@
+from runtime import PROFILE_STANDARD, PROFILES, use_profile
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--runtime-profile",
+        choices=PROFILES,
+        default=PROFILE_STANDARD,
+        help="Runtime profile the test suite runs with.",
+    )
+
+
+def pytest_configure(config):
+    use_profile(config.getoption("--runtime-profile"))
@@ -0,0 +1,149 @@
+import os
+import tempfile
+
+import pytest
+from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+
+from consumer import init_app
+from consumer.aggregates import (
+    Aggregator,
+    HyperLogLog,
+    WindowCounter,
+    aggregator_key,
+)
+from consumer.backends import open_backend
+
+# 2026-10-17 00:00:00 UTC
+DAY = 1792195200.0
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_sliding_and_tumbling_windows():
+    """
+    Test the sliding count and the last complete window of a counter.
+    """
+    counter = WindowCounter(1.0, 60)
+    counter.add(DAY + 30, 5)
+    counter.add(DAY + 70, 2)
+    counter.add(DAY + 100, 1)
+
+    assert counter.sliding(DAY + 100) == 3
+    assert counter.previous(DAY + 100) == 5
+    assert counter.sliding(DAY + 1000) == 0
+
+
+def test_ring_reuses_stale_slots():
+    """
+    Test that a slot from an older lap of the ring is reset before reuse.
+    """
+    counter = WindowCounter(1.0, 2)
+    counter.add(DAY, 7)
+    counter.add(DAY + 4, 1)
+
+    assert counter.sliding(DAY + 4) == 1
+    assert counter.total(0, int(DAY) + 4) == 1
+
+
+def test_hyperloglog_estimate():
+    """
+    Test that distinct strings are estimated within a few percent and that
+    merging counts shared strings once.
+    """
+    first = HyperLogLog()
+    second = HyperLogLog()
+    for i in range(10000):
+        first.add(f"payload-{i}")
+        second.add(f"payload-{i + 5000}")
+    first.add("payload-1")
+
+    assert abs(first.count() - 10000) < 500
+    first.merge(second)
+    assert abs(first.count() - 15000) < 750
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_restored(tmp_path):
+    """
+    Test that the aggregates survive a restart through their checkpoint.
+    """
+    path = str(tmp_path / "events.db")
+    clock = Clock(DAY + 10)
+    backend = await open_backend(path)
+    aggregator = Aggregator(backend, clock=clock)
+    await aggregator.load()
+    aggregator.record(
+        [
+            (1, "message", "hello", DAY + 10),
+            (2, "message", "hello", DAY + 10),
+            (3, "user", "welcome", DAY + 10),
+        ]
+    )
+    await aggregator.checkpoint()
+    await backend.close()
+
+    backend = await open_backend(path)
+    restored = Aggregator(backend, clock=clock)
+    await restored.load()
+    summary = await restored.summary("message")
+    await backend.close()
+
+    assert list(summary) == ["message"]
+    assert summary["message"]["total"] == 2
+    assert summary["message"]["distinct_payloads"] == 1
+    assert summary["message"]["windows"]["1m"]["count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_untracked_types(tmp_path):
+    """
+    Test that types beyond the limit are only counted as untracked.
+    """
+    backend = await open_backend(str(tmp_path / "events.db"))
+    aggregator = Aggregator(backend, max_types=1)
+    aggregator.record([(1, "a", "x", DAY), (2, "b", "x", DAY)])
+    await backend.close()
+
+    assert list(aggregator.types) == ["a"]
+    assert aggregator.untracked_events == 1
+
+
+class TestAggregatesEndpoint(AioHTTPTestCase):
+    async def get_application(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        return await init_app(db_path=os.path.join(db_dir.name, "events.db"))
+
+    @unittest_run_loop
+    async def test_aggregates(self):
+        """
+        Test that stored events are reported per type.
+        """
+        events = [
+            {"event_type": "message", "event_payload": "hello"},
+            {"event_type": "message", "event_payload": "bye"},
+            {"event_type": "user", "event_payload": "welcome"},
+        ]
+        resp = await self.client.post("/event", json=events)
+        assert resp.status == 200
+
+        resp = await self.client.get("/events/aggregates")
+        assert resp.status == 200
+        body = await resp.json()
+        assert body["untracked_events"] == 0
+        message = body["event_types"]["message"]
+        assert message["total"] == 2
+        assert message["distinct_payloads"] == 2
+        assert message["windows"]["1h"]["count"] == 2
+        assert message["windows"]["1m"]["rate"] == pytest.approx(2 / 60)
+        assert body["event_types"]["user"]["total"] == 1
+
+        resp = await self.client.get("/events/aggregates?event_type=user")
+        assert list((await resp.json())["event_types"]) == ["user"]
+        assert len(self.app[aggregator_key].types) == 2
@@ -0,0 +1,220 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from consumer.backends import (
+    SHARD_BY_ROUND_ROBIN,
+    EventFilter,
+    SQLiteBackend,
+    open_backend,
+)
+
+
+@pytest_asyncio.fixture
+async def sharded(tmp_path):
+    """
+    Fixture to open a started three-shard backend.
+    """
+    backend = await open_backend(
+        str(tmp_path / "events.db"), shards=3, shard_dir=str(tmp_path / "s")
+    )
+    backend.start()
+    yield backend
+    await backend.stop()
+    await backend.close()
+
+
+async def store(backend, *event_types):
+    rows = [(event_type, "payload", None) for event_type in event_types]
+    await backend.submit(rows)
+
+
+async def export(backend, filters, chunk_size):
+    return [
+        row
+        async for chunk in backend.export_events(filters, chunk_size)
+        for row in chunk
+    ]
+
+
+def test_global_id_bounds():
+    """
+    Test that global id bounds map to the right local ids of a shard.
+    """
+    backend = SQLiteBackend("unused.db", shard=1, shard_count=3)
+    # Global ids of shard 1 are 4, 7, 10, 13 for local ids 1, 2, 3, 4.
+    for after_id, before_id, local in ((7, 13, (2, 4)), (6, 11, (1, 4))):
+        _, params = backend.where_clause(
+            EventFilter(after_id=after_id, before_id=before_id)
+        )
+        assert tuple(params) == local
+    assert backend.global_row((3, "t", "p", 0.0))[0] == 10
+
+
+@pytest.mark.asyncio
+async def test_open_backend_rejects_invalid_config(tmp_path):
+    """
+    Test that invalid shard settings are rejected.
+    """
+    path = str(tmp_path / "events.db")
+    with pytest.raises(ValueError):
+        await open_backend(path, shards=0)
+    with pytest.raises(ValueError):
+        await open_backend(path, shards=2, shard_by="random")
+
+
+@pytest.mark.asyncio
+async def test_open_backend_rejects_other_layout(tmp_path):
+    """
+    Test that the shard count cannot change on existing databases.
+    """
+    db_path = str(tmp_path / "events.db")
+    backend = await open_backend(db_path)
+    await backend.close()
+
+    with pytest.raises(ValueError, match="events.db"):
+        await open_backend(db_path, shards=2)
+
+    (tmp_path / "events.db").unlink()
+    backend = await open_backend(db_path, shards=3)
+    await backend.close()
+    with pytest.raises(ValueError, match="events-2.db"):
+        await open_backend(db_path, shards=2)
+    with pytest.raises(ValueError, match="events-0.db"):
+        await open_backend(db_path)
+
+
+@pytest.mark.asyncio
+async def test_sharded_by_event_type(sharded, tmp_path):
+    """
+    Test that each event type is stored in a single shard file.
+    """
+    await store(sharded, *"abcdefab")
+
+    assert sorted(p.name for p in (tmp_path / "s").glob("*.db")) == [
+        "events-0.db",
+        "events-1.db",
+        "events-2.db",
+    ]
+    for shard in sharded.shards:
+        counts = await shard.count_events(EventFilter())
+        for event_type in counts:
+            assert sharded.shard_of(event_type) == shard.shard
+    assert await sharded.count_events(EventFilter()) == {
+        "a": 2,
+        "b": 2,
+        "c": 1,
+        "d": 1,
+        "e": 1,
+        "f": 1,
+    }
+    assert await sharded.count_events(EventFilter(event_type="a")) == {"a": 2}
+
+
+@pytest.mark.asyncio
+async def test_merged_reads(sharded):
+    """
+    Test that pages and exports are merged in id order across shards.
+    """
+    await store(sharded, *"abcdef" * 3)
+    everything = await export(sharded, EventFilter(), 2)
+    ids = [row[0] for row in everything]
+    assert len(ids) == 18
+    assert ids == sorted(set(ids))
+
+    pages = []
+    after_id = None
+    while True:
+        rows = await sharded.fetch_events(EventFilter(after_id=after_id), 4)
+        pages.extend(rows)
+        if len(rows) < 4:
+            break
+        after_id = rows[-1][0]
+    assert pages == everything
+
+    only_a = await export(sharded, EventFilter(event_type="a"), 1)
+    assert [row[1] for row in only_a] == ["a"] * 3
+
+
+@pytest.mark.asyncio
+async def test_export_releases_connection_between_chunks(tmp_path):
+    """
+    Test that a paused export does not hold a read connection.
+    """
+    backend = SQLiteBackend(str(tmp_path / "events.db"), read_pool_size=1)
+    await backend.open()
+    backend.start()
+    try:
+        await store(backend, *"ab" * 3)
+        stream = backend.export_events(EventFilter(), 2)
+        first = await anext(stream)
+        rows = await asyncio.wait_for(
+            backend.fetch_events(EventFilter(), 10), timeout=5
+        )
+        rest = [row async for chunk in stream for row in chunk]
+        assert first + rest == rows
+    finally:
+        await backend.stop()
+        await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_round_robin(tmp_path):
+    """
+    Test that round-robin sharding rotates chunks over the shards.
+    """
+    backend = await open_backend(
+        str(tmp_path / "events.db"), shards=2, shard_by=SHARD_BY_ROUND_ROBIN
+    )
+    backend.start()
+    try:
+        for _ in range(4):
+            await store(backend, "a", "a")
+        for shard in backend.shards:
+            assert await shard.count_events(EventFilter()) == {"a": 4}
+    finally:
+        await backend.stop()
+        await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_round_robin_deduplicates_across_shards(tmp_path):
+    """
+    Test that rows with an event id are routed by the id, so a repeated id
+    is caught whichever chunk carries it.
+    """
+    backend = await open_backend(
+        str(tmp_path / "events.db"), shards=2, shard_by=SHARD_BY_ROUND_ROBIN
+    )
+    backend.start()
+    try:
+        rows = [("a", "payload", f"e{i}") for i in range(4)]
+        assert await backend.submit(rows) == 4
+        assert await backend.submit(rows) == 0
+        assert await backend.submit([("a", "payload", None)] * 2) == 2
+    finally:
+        await backend.stop()
+        await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_submit_is_all_or_nothing(tmp_path):
+    """
+    Test that a full shard rejects the whole submit.
+    """
+    backend = await open_backend(
+        str(tmp_path / "events.db"), shards=2, max_queue_size=1
+    )
+    try:
+        first = backend.shard_of("a")
+        other = next(t for t in "bcdefgh" if backend.shard_of(t) != first)
+        backend.submit([("a", "payload", None)], wait=False)
+
+        with pytest.raises(asyncio.QueueFull):
+            backend.submit(
+                [(other, "payload", None), ("a", "payload", None)], wait=False
+            )
+        assert backend.shards[1 - first].writer.queue.empty()
+    finally:
+        await backend.close()
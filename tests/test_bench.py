@@ -0,0 +1,51 @@
+import pytest
+
+from bench.bench import compare, percentile, run_scenario
+
+
+def test_percentile():
+    """
+    Test nearest-rank percentiles.
+    """
+    values = list(range(100, 0, -1))
+
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([7], 0.99) == 7
+    assert percentile([], 0.5) is None
+
+
+def test_compare_flags_regressions():
+    """
+    Test that only changes beyond the tolerance in the wrong direction are
+    flagged.
+    """
+    baseline = {
+        "default": {"events_per_sec": 1000.0, "latency_p99_ms": 10.0},
+        "removed": {"events_per_sec": 1000.0},
+    }
+    results = {
+        "default": {"events_per_sec": 700.0, "latency_p99_ms": 5.0},
+        "added": {"events_per_sec": 1.0},
+    }
+
+    assert compare(results, baseline, tolerance=0.2) == [
+        "default: events_per_sec 1000.0 -> 700.0 (-30%)"
+    ]
+    assert compare(results, baseline, tolerance=0.5) == []
+
+
+@pytest.mark.asyncio
+async def test_run_scenario(tmp_path):
+    """
+    Test a short end-to-end run against a consumer process.
+    """
+    result = await run_scenario(
+        "smoke", {"batch_size": 10, "concurrency": 2}, 0.5, tmp_path
+    )
+
+    assert result["events_sent"] > 0
+    assert result["events_stored"] >= result["events_sent"]
+    assert result["latency_p50_ms"] <= result["latency_p99_ms"]
+    assert result["consumer_max_rss_bytes"] > 0
+    assert result["params"]["batch_size"] == 10
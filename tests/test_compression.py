@@ -0,0 +1,86 @@
+import gzip
+import json
+
+import pytest
+
+from consumer.compression import DecompressingStream, zstd
+from consumer.parsing import (
+    MalformedBodyError,
+    PayloadTooLargeError,
+    iter_json_array,
+)
+from tests.test_parsing import FakeStream
+
+
+async def read_all(stream, n=16):
+    chunks = []
+    while True:
+        chunk = await stream.read(n)
+        assert len(chunk) <= n
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+@pytest.mark.asyncio
+async def test_gzip_inflated_in_bounded_reads():
+    """
+    Test that gzip bodies are inflated without exceeding the read size.
+    """
+    body = json.dumps([{"event_type": "message", "event_payload": "hi"}] * 50)
+    stream = DecompressingStream(
+        FakeStream(gzip.compress(body.encode())), "gzip"
+    )
+    assert await read_all(stream) == body.encode()
+
+
+@pytest.mark.asyncio
+async def test_zstd_inflated_in_bounded_reads():
+    """
+    Test that zstd bodies are inflated without exceeding the read size.
+    """
+    if zstd is None:
+        pytest.skip("zstd is not available")
+    body = b"[" + b"1," * 500 + b"1]"
+    stream = DecompressingStream(FakeStream(zstd.compress(body)), "zstd")
+    assert await read_all(stream) == body
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("data", [b"[1, 2]", b"", b"\x1f"])
+async def test_body_not_in_declared_encoding(data):
+    """
+    Test that a body without the magic number of its declared encoding is
+    rejected rather than passed through.
+    """
+    with pytest.raises(MalformedBodyError):
+        await read_all(DecompressingStream(FakeStream(data), "gzip"))
+
+
+@pytest.mark.asyncio
+async def test_decompressed_size_is_capped():
+    """
+    Test that a small compressed body expanding past the limit is rejected.
+    """
+    bomb = gzip.compress(b"[" + b" " * 10_000_000 + b"]")
+    stream = DecompressingStream(FakeStream(bomb), "gzip")
+    with pytest.raises(PayloadTooLargeError):
+        async for _ in iter_json_array(stream, max_body_size=1024 * 1024):
+            pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "data",
+    [
+        gzip.compress(b"[1]")[:-4],
+        gzip.compress(b"[1]") + b"junk",
+        b"\x1f\x8bnot gzip",
+    ],
+)
+async def test_invalid_gzip(data):
+    """
+    Test that truncated, trailing or corrupt gzip bodies are rejected.
+    """
+    with pytest.raises(MalformedBodyError):
+        await read_all(DecompressingStream(FakeStream(data), "gzip"))
@@ -1,14 +1,44 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import unittest
 from unittest import mock
 
 from aiohttp import web
-from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+from aiohttp.test_utils import AioHTTPTestCase, TestServer, unittest_run_loop
 
 from consumer import init_app
+from consumer.backends import backend_key
+from consumer.compression import zstd
+from consumer.consumer import prepare_reconfigure, settings_key
+from consumer.dedup import recent_ids_key
+from consumer.parsing import msgpack
+
+
+class ConsumerTestServer(TestServer):
+    async def start_server(self, **kwargs):
+        # TestServer drops runner options given to its constructor.
+        await super().start_server(auto_decompress=False, **kwargs)
 
 
 class TestConsumer(AioHTTPTestCase):
     async def get_application(self):
-        return await init_app()
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        return await init_app(db_path=os.path.join(db_dir.name, "events.db"))
+
+    async def get_server(self, app):
+        # Compressed bodies are inflated by the consumer, as in main.py.
+        return ConsumerTestServer(app)
+
+    async def count_events(self):
+        async with self.app[backend_key].db.execute(
+            "SELECT COUNT(*) FROM received_events"
+        ) as cursor:
+            (count,) = await cursor.fetchone()
+        return count
 
     @unittest_run_loop
     async def test_handle_event_success(self):
@@ -67,8 +97,10 @@ class TestConsumer(AioHTTPTestCase):
         """
         Test handling events with an internal server error.
         """
-        with mock.patch(
-            "aiosqlite.connect", side_effect=Exception("Database error")
+        with mock.patch.object(
+            self.app[backend_key].db,
+            "executemany",
+            side_effect=Exception("Database error"),
         ):
             data = [{"event_type": "type1", "event_payload": "payload1"}]
             resp = await self.client.post(
@@ -123,3 +155,432 @@ class TestConsumer(AioHTTPTestCase):
         assert resp.status == 400
         json_resp = await resp.json()
         assert json_resp == {"error": "Invalid JSON format"}
+
+    @unittest_run_loop
+    async def test_handle_event_bulk_insert(self):
+        """
+        Test that a batch is stored through the shared writer connection.
+        """
+        db = self.app[backend_key].db
+        data = [
+            {"event_type": "message", "event_payload": str(i)}
+            for i in range(1000)
+        ]
+        resp = await self.client.post("/event", json=data)
+        assert resp.status == 200
+        assert self.app[backend_key].db is db
+        assert await self.count_events() == 1000
+
+    @unittest_run_loop
+    async def test_db_tuned_for_ingest(self):
+        """
+        Test that the writer connection uses WAL and synchronous=NORMAL.
+        """
+        db = self.app[backend_key].db
+        async with db.execute("PRAGMA journal_mode") as cursor:
+            assert (await cursor.fetchone())[0] == "wal"
+        async with db.execute("PRAGMA synchronous") as cursor:
+            assert (await cursor.fetchone())[0] == 1
+
+    @unittest_run_loop
+    async def test_handle_event_queue_full(self):
+        """
+        Test that a full ingest queue answers 503 with Retry-After.
+        """
+        with mock.patch.object(
+            self.app[backend_key], "submit", side_effect=asyncio.QueueFull
+        ):
+            data = [{"event_type": "type1", "event_payload": "payload1"}]
+            resp = await self.client.post("/event", json=data)
+            assert resp.status == 503
+            assert resp.headers["Retry-After"] == "1"
+            json_resp = await resp.json()
+            assert json_resp == {"error": "Ingest queue is full"}
+
+    @unittest_run_loop
+    async def test_concurrent_requests_share_commits(self):
+        """
+        Test that concurrent requests are committed in groups.
+        """
+        db = self.app[backend_key].db
+        data = [{"event_type": "type1", "event_payload": "payload1"}]
+        with mock.patch.object(db, "commit", wraps=db.commit) as mock_commit:
+            responses = await asyncio.gather(
+                *(self.client.post("/event", json=data) for _ in range(50))
+            )
+            assert all(resp.status == 200 for resp in responses)
+            assert mock_commit.call_count < 50
+        assert await self.count_events() == 50
+
+    @unittest_run_loop
+    async def test_handle_event_streamed_in_chunks(self):
+        """
+        Test that large bodies are handed to the writer in chunks.
+        """
+        data = [
+            {"event_type": "message", "event_payload": str(i)}
+            for i in range(25)
+        ]
+        settings = self.app[settings_key]
+        backend = self.app[backend_key]
+        with mock.patch.object(
+            settings, "ingest_chunk_events", 10
+        ), mock.patch.object(backend, "put", wraps=backend.put) as mock_put:
+            resp = await self.client.post("/event", json=data)
+            assert resp.status == 200
+            assert mock_put.call_count == 2
+        assert await self.count_events() == 25
+
+    @unittest_run_loop
+    async def test_handle_event_invalid_after_chunk(self):
+        """
+        Test that an invalid event after a flushed chunk reports what was
+        accepted.
+        """
+        data = [
+            {"event_type": "message", "event_payload": str(i)} for i in range(3)
+        ] + [{"event_type": "message"}]
+        with mock.patch.object(
+            self.app[settings_key], "ingest_chunk_events", 2
+        ):
+            resp = await self.client.post("/event", json=data)
+            assert resp.status == 400
+            json_resp = await resp.json()
+            assert json_resp == {
+                "error": "Invalid event data format",
+                "accepted": 2,
+            }
+
+    @unittest_run_loop
+    async def test_handle_event_body_too_large(self):
+        """
+        Test that bodies over max_body_size are rejected with 413.
+        """
+        data = [{"event_type": "type1", "event_payload": "x" * 200}]
+        with mock.patch.object(self.app[settings_key], "max_body_size", 100):
+            resp = await self.client.post("/event", json=data)
+            assert resp.status == 413
+            json_resp = await resp.json()
+            assert json_resp == {"error": "Request body too large"}
+
+    @unittest_run_loop
+    async def test_handle_event_too_many_events(self):
+        """
+        Test that requests over max_events_per_request are rejected with 413.
+        """
+        data = [{"event_type": "type1", "event_payload": "payload1"}] * 3
+        with mock.patch.object(
+            self.app[settings_key], "max_events_per_request", 2
+        ):
+            resp = await self.client.post("/event", json=data)
+            assert resp.status == 413
+            json_resp = await resp.json()
+            assert json_resp == {"error": "Too many events in request"}
+        assert await self.count_events() == 0
+
+    @unittest_run_loop
+    async def test_duplicates_count_towards_event_limit(self):
+        """
+        Test that deduplicated events still count towards
+        max_events_per_request.
+        """
+        data = [{"event_type": "type1", "event_payload": "a", "event_id": "e1"}]
+        await self.client.post("/event", json=data)
+
+        settings = self.app[settings_key]
+        with mock.patch.object(
+            settings, "max_events_per_request", 2
+        ), mock.patch.object(settings, "ingest_chunk_events", 1):
+            resp = await self.client.post("/event", json=data * 3)
+            assert resp.status == 413
+
+    @unittest_run_loop
+    async def test_handle_event_ndjson(self):
+        """
+        Test handling events sent as NDJSON.
+        """
+        data = (
+            '{"event_type": "type1", "event_payload": "payload1"}\n'
+            '{"event_type": "type2", "event_payload": "payload2"}\n'
+        )
+        resp = await self.client.post(
+            "/event",
+            data=data,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert resp.status == 200
+        assert await self.count_events() == 2
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    @unittest_run_loop
+    async def test_handle_event_msgpack(self):
+        """
+        Test handling events sent as msgpack.
+        """
+        data = [{"event_type": "type1", "event_payload": "payload1"}] * 3
+        resp = await self.client.post(
+            "/event",
+            data=msgpack.packb(data),
+            headers={"Content-Type": "application/msgpack"},
+        )
+        assert resp.status == 200
+        assert await self.count_events() == 3
+
+    @unittest_run_loop
+    async def test_handle_event_msgpack_unavailable(self):
+        """
+        Test that msgpack bodies are refused when msgpack is not installed.
+        """
+        with mock.patch("consumer.parsing.msgpack", None):
+            resp = await self.client.post(
+                "/event",
+                data=b"\x90",
+                headers={"Content-Type": "application/msgpack"},
+            )
+            assert resp.status == 415
+            json_resp = await resp.json()
+            assert json_resp == {"error": "Unsupported content type"}
+
+    @unittest_run_loop
+    async def test_handle_event_gzip(self):
+        """
+        Test handling a gzip-compressed batch.
+        """
+        data = [{"event_type": "type1", "event_payload": "payload1"}] * 10
+        resp = await self.client.post(
+            "/event",
+            data=gzip.compress(json.dumps(data).encode()),
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+            },
+        )
+        assert resp.status == 200
+        assert await self.count_events() == 10
+
+    @unittest_run_loop
+    async def test_handle_event_encoding_mismatch(self):
+        """
+        Test that a body that does not match its Content-Encoding is
+        rejected with 400.
+        """
+        data = [{"event_type": "type1", "event_payload": "payload1"}]
+        resp = await self.client.post(
+            "/event",
+            data=json.dumps(data).encode(),
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+            },
+        )
+        assert resp.status == 400
+        assert await self.count_events() == 0
+
+    @unittest.skipIf(zstd is None, "zstd is not available")
+    @unittest_run_loop
+    async def test_handle_event_zstd(self):
+        """
+        Test handling a zstd-compressed batch.
+        """
+        data = [{"event_type": "type1", "event_payload": "payload1"}] * 10
+        resp = await self.client.post(
+            "/event",
+            data=zstd.compress(json.dumps(data).encode()),
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "zstd",
+            },
+        )
+        assert resp.status == 200
+        assert await self.count_events() == 10
+
+    @unittest_run_loop
+    async def test_handle_event_unsupported_encoding(self):
+        """
+        Test that unknown content encodings are refused.
+        """
+        resp = await self.client.post(
+            "/event",
+            data=b"[]",
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "compress",
+            },
+        )
+        assert resp.status == 415
+        json_resp = await resp.json()
+        assert json_resp == {"error": "Unsupported content encoding"}
+
+    @unittest_run_loop
+    async def test_metrics(self):
+        """
+        Test that ingest outcomes are exported on /metrics.
+        """
+        data = [
+            {"event_type": "type1", "event_payload": "payload1"},
+            {"event_type": "type2", "event_payload": "payload2"},
+        ]
+        await self.client.post("/event", json=data)
+        await self.client.post("/event", json=[{"event_type": "type1"}])
+
+        resp = await self.client.get("/metrics")
+        assert resp.status == 200
+        assert resp.headers["Content-Type"].startswith("text/plain")
+        lines = (await resp.text()).splitlines()
+        assert "consumer_events_received_total 3" in lines
+        assert "consumer_events_stored_total 2" in lines
+        assert (
+            'consumer_events_rejected_total{reason="invalid_event"} 1' in lines
+        )
+        assert 'consumer_requests_total{path="/event",status="400"} 1' in lines
+        assert "consumer_commit_seconds_count 1" in lines
+        assert "consumer_queue_depth 0" in lines
+
+    @unittest_run_loop
+    async def test_duplicate_event_ids(self):
+        """
+        Test that events with an already stored event_id are deduplicated.
+        """
+        data = [
+            {"event_type": "type1", "event_payload": "a", "event_id": "e1"},
+            {"event_type": "type1", "event_payload": "b", "event_id": "e2"},
+            {"event_type": "type1", "event_payload": "b", "event_id": "e2"},
+            {"event_type": "type1", "event_payload": "c"},
+        ]
+        resp = await self.client.post("/event", json=data)
+        assert await resp.json() == {
+            "status": "success",
+            "accepted": 3,
+            "deduplicated": 1,
+        }
+
+        resp = await self.client.post("/event", json=data)
+        assert await resp.json() == {
+            "status": "success",
+            "accepted": 1,
+            "deduplicated": 3,
+        }
+        assert await self.count_events() == 4
+
+    @unittest_run_loop
+    async def test_duplicate_event_ids_without_cache(self):
+        """
+        Test that the stored ids catch duplicates the cache missed.
+        """
+        self.app[recent_ids_key].ids.clear()
+        self.app[recent_ids_key].capacity = 0
+        data = [{"event_type": "type1", "event_payload": "a", "event_id": "e1"}]
+        await self.client.post("/event", json=data)
+
+        resp = await self.client.post("/event", json=data)
+        assert await resp.json() == {
+            "status": "success",
+            "accepted": 0,
+            "deduplicated": 1,
+        }
+        assert await self.count_events() == 1
+
+    @unittest_run_loop
+    async def test_idempotency_key(self):
+        """
+        Test that a retried request with the same Idempotency-Key is not
+        stored twice.
+        """
+        data = [
+            {"event_type": "type1", "event_payload": "a"},
+            {"event_type": "type1", "event_payload": "a"},
+        ]
+        for _ in range(2):
+            resp = await self.client.post(
+                "/event", json=data, headers={"Idempotency-Key": "batch-1"}
+            )
+        assert await resp.json() == {
+            "status": "success",
+            "accepted": 0,
+            "deduplicated": 2,
+        }
+
+        resp = await self.client.post(
+            "/event", json=data, headers={"Idempotency-Key": "batch-2"}
+        )
+        assert (await resp.json())["accepted"] == 2
+        assert await self.count_events() == 4
+
+    @unittest_run_loop
+    async def test_invalid_event_id(self):
+        """
+        Test that a non-string event_id is rejected.
+        """
+        data = [{"event_type": "type1", "event_payload": "a", "event_id": 1}]
+        resp = await self.client.post("/event", json=data)
+        assert resp.status == 400
+
+    @unittest_run_loop
+    async def test_reconfigure(self):
+        """
+        Test that reloaded options apply to the running consumer only once
+        the prepared changes are applied.
+        """
+        apply = prepare_reconfigure(
+            self.app,
+            max_events_per_request=2,
+            max_queue_size=5,
+            commit_interval_ms=0,
+            dedup_cache_size=1,
+        )
+        data = [{"event_type": "type1", "event_payload": "payload1"}] * 3
+        resp = await self.client.post("/event", json=data)
+        assert resp.status == 200
+
+        apply()
+
+        resp = await self.client.post("/event", json=data)
+        assert resp.status == 413
+        writer = self.app[backend_key].writer
+        assert writer.max_queue_size == 5
+        assert writer.commit_interval_ms == 0
+        assert self.app[recent_ids_key].capacity == 1
+
+    @unittest_run_loop
+    async def test_reconfigure_rejects_restart_options(self):
+        """
+        Test that options which need a restart and invalid values are
+        rejected before anything changes.
+        """
+        with self.assertRaisesRegex(ValueError, "requires a restart"):
+            prepare_reconfigure(self.app, db_path="other.db")
+        with self.assertRaisesRegex(ValueError, "Invalid value"):
+            prepare_reconfigure(self.app, max_queue_size=0)
+        with self.assertRaisesRegex(ValueError, "Unknown ack mode"):
+            prepare_reconfigure(self.app, ack_mode="eventually")
+
+
+class TestConsumerFireAndForget(AioHTTPTestCase):
+    async def get_application(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        return await init_app(
+            db_path=os.path.join(db_dir.name, "events.db"),
+            ack_mode="fire_and_forget",
+        )
+
+    @unittest_run_loop
+    async def test_handle_event_accepted(self):
+        """
+        Test that events are acknowledged before they are committed.
+        """
+        data = [{"event_type": "type1", "event_payload": "payload1"}]
+        resp = await self.client.post("/event", json=data)
+        assert resp.status == 202
+        json_resp = await resp.json()
+        assert json_resp == {
+            "status": "accepted",
+            "accepted": 1,
+            "deduplicated": 0,
+        }
+
+        await self.app[backend_key].stop()
+        async with self.app[backend_key].db.execute(
+            "SELECT COUNT(*) FROM received_events"
+        ) as cursor:
+            assert (await cursor.fetchone())[0] == 1
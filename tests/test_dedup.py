@@ -0,0 +1,34 @@
+from consumer.dedup import RecentIds, event_id
+
+
+def test_recent_ids_evicts_least_recently_used():
+    """
+    Test that the cache keeps the most recently used ids.
+    """
+    recent = RecentIds(capacity=2)
+    recent.add_all(["a", "b"])
+    assert "a" in recent
+    recent.add_all(["c"])
+
+    assert "a" in recent
+    assert "b" not in recent
+    assert len(recent) == 2
+
+
+def test_recent_ids_disabled():
+    """
+    Test that a cache without capacity remembers nothing.
+    """
+    recent = RecentIds(capacity=0)
+    recent.add_all(["a"])
+
+    assert "a" not in recent
+
+
+def test_event_id():
+    """
+    Test that own ids win over ids derived from the idempotency key.
+    """
+    assert event_id({"event_id": "own"}, "key", 3) == "own"
+    assert event_id({}, "key", 3) == "key:3"
+    assert event_id({}, None, 3) is None
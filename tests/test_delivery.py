@@ -0,0 +1,109 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from propagator.delivery import CircuitBreaker, SpillFile, backoff_delay
+
+
+def test_backoff_delay_full_jitter():
+    """
+    Test that delays are drawn from [0, min(max_delay, base * 2^n)].
+    """
+    with patch("propagator.delivery.random.uniform") as mock_uniform:
+        backoff_delay(1, 0.5, 30.0)
+        mock_uniform.assert_called_with(0, 0.5)
+        backoff_delay(4, 0.5, 30.0)
+        mock_uniform.assert_called_with(0, 4.0)
+        backoff_delay(20, 0.5, 30.0)
+        mock_uniform.assert_called_with(0, 30.0)
+
+
+def test_circuit_breaker_opens_and_probes():
+    """
+    Test the closed -> open -> half-open -> closed cycle.
+    """
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=10.0, clock=lambda: now[0]
+    )
+
+    assert breaker.allow_request()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == 10.0
+
+    now[0] = 10.0
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_circuit_breaker_failed_probe_reopens():
+    """
+    Test that a failed probe re-opens the breaker.
+    """
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout=5.0, clock=lambda: now[0]
+    )
+    breaker.record_failure()
+    now[0] = 5.0
+    assert breaker.allow_request()
+    assert breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_at == 5.0
+
+
+def test_circuit_breaker_abandoned_probe_reopens():
+    """
+    Test that a probe ending without a response re-opens the breaker and
+    another probe follows after the reset timeout.
+    """
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout=5.0, clock=lambda: now[0]
+    )
+    breaker.abandon_probe()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    now[0] = 5.0
+    assert breaker.allow_request()
+    breaker.abandon_probe()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    now[0] = 10.0
+    assert breaker.allow_request()
+
+
+@pytest.mark.asyncio
+async def test_spill_file_append_and_replay(tmp_path):
+    """
+    Test that spilled batches are replayed in order and then removed.
+    """
+    spill = SpillFile(str(tmp_path / "spill.ndjson"))
+    assert not spill.has_data()
+
+    batches = [
+        [{"event_type": "message", "event_payload": str(i)}] for i in (1, 2)
+    ]
+    for batch in batches:
+        await spill.append(batch)
+    assert spill.has_data()
+
+    replayed = []
+    async for batch in spill.replay():
+        replayed.append(batch)
+        # Batches spilled during a replay are kept for the next one.
+        await spill.append(batch)
+
+    assert replayed == batches
+    assert spill.has_data()
+    lines = (tmp_path / "spill.ndjson").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == batches
@@ -0,0 +1,61 @@
+from unittest.mock import AsyncMock
+
+import pytest
+import pytest_asyncio
+
+from consumer.backends import open_db
+from consumer.lookup import LookupTable
+
+
+@pytest_asyncio.fixture
+async def db(tmp_path):
+    """
+    Fixture to open a writer connection on a fresh database.
+    """
+    db = await open_db(str(tmp_path / "events.db"))
+    yield db
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_ids_are_stable(db):
+    """
+    Test that each value gets one id, reused across calls.
+    """
+    table = LookupTable(db, "lookup")
+    await table.create()
+
+    first = await table.ids(["hello", "welcome", "hello"])
+    second = await table.ids(["welcome", "bye"])
+
+    assert first == [1, 2, 1]
+    assert second == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_cached_ids_need_no_query(db):
+    """
+    Test that values in the cache are resolved without a query.
+    """
+    table = LookupTable(db, "lookup")
+    await table.create()
+    await table.ids(["hello"])
+    table.resolve = AsyncMock()
+
+    assert await table.ids(["hello", "hello"]) == [1, 1]
+    table.resolve.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_cache_is_bounded(db):
+    """
+    Test that the least recently used ids are evicted, and that evicted
+    values keep their id.
+    """
+    table = LookupTable(db, "lookup", capacity=2)
+    await table.create()
+    await table.ids(["a", "b"])
+    await table.ids(["a", "c"])
+
+    assert list(table.cache) == ["a", "c"]
+    assert await table.ids(["b"]) == [2]
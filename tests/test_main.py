@@ -1,4 +1,4 @@
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from aiohttp import web
@@ -134,3 +134,192 @@ async def test_start_services_invalid_json(mock_open):
         await main.start_services("config.json", "events_file.json")
 
     assert "Expecting property name enclosed" in str(excinfo.value)
+
+
+@pytest.mark.asyncio
+@patch("main.aiofiles.open")
+@patch("main.WorkerSupervisor")
+async def test_start_services_workers(mock_supervisor, mock_open):
+    """
+    Test that several workers run the consumer under a supervisor.
+
+    :param mock_supervisor: Mocked WorkerSupervisor class.
+    :param mock_open: Mocked aiofiles.open function.
+    """
+    mock_open.return_value = FakeAsyncOpen(
+        content='{"endpoint": "http://localhost:5000/event", "period": 5, '
+        '"consumer": {"db_path": "test.db"}}'
+    )
+    mock_supervisor.return_value.setup = AsyncMock()
+
+    consumer_runner, _ = await main.start_services(
+        "config.json", "events_file.json", workers=4
+    )
+
+    assert consumer_runner is mock_supervisor.return_value
+    mock_supervisor.assert_called_once_with(
+        {"db_path": "test.db"}, 4, "localhost", 5000
+    )
+    consumer_runner.setup.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("main.aiofiles.open")
+@patch("main.prepare_reconfigure")
+async def test_reload_applies_changes(mock_prepare, mock_open):
+    """
+    Test that a reload passes changed options to both services.
+
+    :param mock_prepare: Mocked consumer prepare_reconfigure function.
+    :param mock_open: Mocked aiofiles.open function.
+    """
+    mock_open.return_value = FakeAsyncOpen(
+        content='{"endpoint": "http://localhost:5000/event", "period": 5, '
+        '"consumer": {"max_queue_size": 10, "db_path": "test.db"}}'
+    )
+    propagator = MagicMock()
+    propagator.prepare_reconfigure.return_value = AsyncMock()
+    reloader = main.ConfigReloader("config.json", MagicMock(), propagator)
+    await reloader.load()
+
+    mock_open.return_value = FakeAsyncOpen(
+        content='{"endpoint": "http://localhost:5001/event", "period": 2, '
+        '"max_batch_size": 50, "consumer": {"db_path": "test.db"}}'
+    )
+    assert await reloader.reload()
+
+    mock_prepare.assert_called_once_with(
+        reloader.consumer_runner.app, max_queue_size=1000
+    )
+    mock_prepare.return_value.assert_called_once_with()
+    propagator.prepare_reconfigure.assert_called_once_with(
+        "http://localhost:5001/event", 2, max_batch_size=50
+    )
+    propagator.prepare_reconfigure.return_value.assert_awaited_once()
+    assert reloader.config["period"] == 2
+
+
+@pytest.mark.asyncio
+@patch("main.aiofiles.open")
+@patch("main.prepare_reconfigure")
+async def test_reload_rejected_keeps_config(mock_prepare, mock_open):
+    """
+    Test that a configuration one service rejects is applied to neither.
+
+    :param mock_prepare: Mocked consumer prepare_reconfigure function.
+    :param mock_open: Mocked aiofiles.open function.
+    """
+    mock_open.return_value = FakeAsyncOpen(
+        content='{"endpoint": "http://localhost:5000/event", "period": 5}'
+    )
+    propagator = MagicMock()
+    propagator.prepare_reconfigure.side_effect = ValueError(
+        "Changing wire_format requires a restart"
+    )
+    reloader = main.ConfigReloader("config.json", MagicMock(), propagator)
+    await reloader.load()
+
+    mock_open.return_value = FakeAsyncOpen(
+        content='{"endpoint": "http://localhost:5000/event", "period": 5, '
+        '"wire_format": "ndjson", "consumer": {"max_queue_size": 10}}'
+    )
+    assert not await reloader.reload()
+
+    mock_prepare.return_value.assert_not_called()
+    assert reloader.config == {
+        "endpoint": "http://localhost:5000/event",
+        "period": 5,
+    }
+
+
+@pytest.mark.asyncio
+@patch("main.aiofiles.open")
+@patch("main.consumer_init_app", new_callable=AsyncMock)
+@patch("main.web.TCPSite")
+async def test_start_services_consumer_role(
+    mock_site, mock_init_app, mock_open
+):
+    """
+    Test that the consumer role starts only the consumer, on the given host
+    and port, without requiring propagator settings.
+
+    :param mock_site: Mocked web.TCPSite class.
+    :param mock_init_app: Mocked consumer_init_app function.
+    :param mock_open: Mocked aiofiles.open function.
+    """
+    mock_open.return_value = FakeAsyncOpen(content='{"consumer": {}}')
+    mock_init_app.return_value = web.Application()
+    mock_site.return_value.start = AsyncMock()
+
+    consumer_runner, propagator = await main.start_services(
+        "config.json",
+        "events_file.json",
+        host="0.0.0.0",
+        port=6000,
+        role=main.ROLE_CONSUMER,
+    )
+
+    assert propagator is None
+    mock_site.assert_called_once_with(consumer_runner, "0.0.0.0", 6000)
+    await consumer_runner.cleanup()
+
+
+@pytest.mark.asyncio
+@patch("main.aiofiles.open")
+@patch("main.consumer_init_app", new_callable=AsyncMock)
+async def test_start_services_propagator_role(mock_init_app, mock_open):
+    """
+    Test that the propagator role starts no consumer and runs a process
+    pool when asked for several processes.
+
+    :param mock_init_app: Mocked consumer_init_app function.
+    :param mock_open: Mocked aiofiles.open function.
+    """
+    mock_open.return_value = FakeAsyncOpen(
+        content='{"endpoint": "http://consumer:5000/event", "period": 5}'
+    )
+
+    consumer_runner, propagator = await main.start_services(
+        "config.json",
+        "events_file.json",
+        role=main.ROLE_PROPAGATOR,
+        processes=3,
+    )
+
+    assert consumer_runner is None
+    assert isinstance(propagator, main.PropagatorPool)
+    assert propagator.count == 3
+    assert propagator.endpoint == "http://consumer:5000/event"
+    mock_init_app.assert_not_called()
+
+
+def test_parser_roles():
+    """
+    Test that options follow or precede the role, and that no role runs
+    both services.
+    """
+    parser = main.build_parser()
+
+    args = parser.parse_args(["--workers", "2"])
+    assert (args.role, args.workers) == (None, 2)
+    args = parser.parse_args(
+        ["consumer", "--host", "0.0.0.0", "--port", "6000"]
+    )
+    assert (args.role, args.host, args.port) == ("consumer", "0.0.0.0", 6000)
+    args = parser.parse_args(["propagator", "--processes", "4"])
+    assert (args.role, args.processes) == ("propagator", 4)
+    with pytest.raises(SystemExit):
+        parser.parse_args(["propagator", "--workers", "2"])
+
+    args = parser.parse_args(["--port", "9000", "consumer"])
+    assert (args.role, args.port, args.host) == (
+        "consumer",
+        9000,
+        main.DEFAULT_HOST,
+    )
+    args = parser.parse_args(
+        ["--config", "a.json", "all", "--processes", "2", "--port", "7000"]
+    )
+    assert (args.config, args.processes, args.port) == ("a.json", 2, 7000)
+    args = parser.parse_args(["--port", "9000", "consumer", "--port", "9001"])
+    assert args.port == 9001
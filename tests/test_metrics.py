@@ -0,0 +1,88 @@
+import pytest
+
+from metrics import Registry
+
+
+def test_counter_and_gauge_render():
+    """
+    Test that counters, labelled counters and gauges are rendered.
+    """
+    registry = Registry()
+    registry.counter("requests_total", "Requests.").inc(3)
+    rejected = registry.counter("rejected_total", "Rejected.", ("reason",))
+    rejected.labels("queue_full").inc()
+    rejected.labels('say "hi"').inc(2)
+    registry.gauge("depth", "Depth.", function=lambda: 7)
+
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        "requests_total 3\n"
+        "# HELP rejected_total Rejected.\n"
+        "# TYPE rejected_total counter\n"
+        'rejected_total{reason="queue_full"} 1\n'
+        'rejected_total{reason="say \\"hi\\""} 2\n'
+        "# HELP depth Depth.\n"
+        "# TYPE depth gauge\n"
+        "depth 7\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    """
+    Test that observations land in the first bucket not below them.
+    """
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency.", (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_registry_labels_every_sample():
+    """
+    Test that registry labels are added to every sample.
+    """
+    registry = Registry((("worker", "1"),))
+    rejected = registry.counter("rejected_total", "Rejected.", ("reason",))
+    rejected.labels("queue_full").inc()
+    registry.histogram("latency_seconds", "Latency.", (0.1,)).observe(0.05)
+
+    assert [
+        line for line in registry.render().splitlines() if line[0] != "#"
+    ] == [
+        'rejected_total{worker="1",reason="queue_full"} 1',
+        'latency_seconds_bucket{worker="1",le="0.1"} 1',
+        'latency_seconds_bucket{worker="1",le="+Inf"} 1',
+        'latency_seconds_sum{worker="1"} 0.05',
+        'latency_seconds_count{worker="1"} 1',
+    ]
+
+
+def test_labels_must_match():
+    """
+    Test that the number of label values is checked.
+    """
+    counter = Registry().counter("rejected_total", "Rejected.", ("reason",))
+
+    with pytest.raises(ValueError):
+        counter.labels()
+    assert counter.labels("x") is counter.labels("x")
+
+
+def test_duplicate_metric_rejected():
+    """
+    Test that a name can only be registered once.
+    """
+    registry = Registry()
+    registry.gauge("depth", "Depth.")
+
+    with pytest.raises(ValueError):
+        registry.counter("depth", "Depth.")
@@ -0,0 +1,217 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from consumer.parsing import (
+    InvalidEventDataError,
+    MalformedBodyError,
+    PayloadTooLargeError,
+    get_body_parser,
+    iter_json_array,
+    iter_msgpack,
+    iter_ndjson,
+)
+
+
+class FakeStream:
+    """
+    Minimal stand-in for a request body stream.
+
+    :param data: Bytes returned by successive reads.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+        self.reads = 0
+
+    async def read(self, n):
+        """
+        Return at most ``n`` bytes of the remaining data.
+
+        :return: The next chunk, or ``b""`` at the end of the data.
+        """
+        self.reads += 1
+        chunk = self.data[self.pos : self.pos + n]
+        self.pos += len(chunk)
+        return chunk
+
+
+async def parse(data, max_body_size=1024 * 1024, chunk_size=3):
+    return [
+        item
+        async for item in iter_json_array(
+            FakeStream(data), max_body_size, chunk_size=chunk_size
+        )
+    ]
+
+
+@pytest.mark.asyncio
+async def test_parse_elements_split_across_chunks():
+    """
+    Test that elements spanning several reads are parsed correctly.
+    """
+    events = [
+        {"event_type": "message", "event_payload": "héllo"},
+        {"event_type": "user_joined", "event_payload": "Peter"},
+    ]
+    assert await parse(json.dumps(events).encode()) == events
+
+
+@pytest.mark.asyncio
+async def test_parse_numbers_not_truncated():
+    """
+    Test that numbers ending on a chunk boundary are not cut short.
+    """
+    assert await parse(b"[123456, 7]", chunk_size=4) == [123456, 7]
+
+
+@pytest.mark.asyncio
+async def test_parse_empty_array():
+    """
+    Test that an empty array yields nothing.
+    """
+    assert await parse(b" [ ] ") == []
+
+
+@pytest.mark.asyncio
+async def test_stream_is_read_incrementally():
+    """
+    Test that the first element is yielded before the body is consumed.
+    """
+    stream = FakeStream(json.dumps([{"a": 1}] * 100).encode())
+    iterator = iter_json_array(stream, 1024 * 1024, chunk_size=16)
+    assert await iterator.__anext__() == {"a": 1}
+    assert stream.pos < len(stream.data)
+    await iterator.aclose()
+
+
+@pytest.mark.asyncio
+async def test_parse_large_element_in_few_attempts():
+    """
+    Test that a large element is decoded in a logarithmic number of attempts
+    rather than once per chunk.
+    """
+    event = {"event_type": "message", "event_payload": "x" * 1024 * 1024}
+    data = json.dumps([event, event]).encode()
+    with patch("consumer.parsing.DECODER.raw_decode") as raw_decode:
+        raw_decode.side_effect = json.JSONDecoder().raw_decode
+        assert await parse(data, 4 * 1024 * 1024, chunk_size=1024) == [
+            event,
+            event,
+        ]
+    assert raw_decode.call_count < 50
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "data", [b"[", b"[1,]", b"[1 2]", b"[1] x", b"{", b"\xff"]
+)
+async def test_parse_invalid_json(data):
+    """
+    Test that malformed bodies raise MalformedBodyError.
+    """
+    with pytest.raises(MalformedBodyError):
+        await parse(data)
+
+
+@pytest.mark.asyncio
+async def test_parse_not_a_list():
+    """
+    Test that a valid non-list body raises InvalidEventDataError.
+    """
+    with pytest.raises(InvalidEventDataError):
+        await parse(b'{"event_type": "message"}')
+
+
+@pytest.mark.asyncio
+async def test_parse_body_too_large():
+    """
+    Test that reading past the size limit raises PayloadTooLargeError.
+    """
+    with pytest.raises(PayloadTooLargeError):
+        await parse(json.dumps([1] * 100).encode(), max_body_size=50)
+
+
+@pytest.mark.asyncio
+async def test_parse_ndjson():
+    """
+    Test that NDJSON lines split across reads are parsed one by one.
+    """
+    events = [
+        {"event_type": "message", "event_payload": str(i)} for i in (1, 2)
+    ]
+    data = "\n".join(json.dumps(event) for event in events).encode() + b"\n\n"
+    items = [
+        item async for item in iter_ndjson(FakeStream(data), 1024, chunk_size=5)
+    ]
+    assert items == events
+
+
+@pytest.mark.asyncio
+async def test_parse_ndjson_large_line():
+    """
+    Test that a line spanning many reads is parsed whole.
+    """
+    event = {"event_type": "message", "event_payload": "x" * 1024 * 1024}
+    data = (json.dumps(event) + "\n").encode() * 2
+    items = [
+        item
+        async for item in iter_ndjson(
+            FakeStream(data), 4 * 1024 * 1024, chunk_size=1024
+        )
+    ]
+    assert items == [event, event]
+
+
+@pytest.mark.asyncio
+async def test_parse_ndjson_invalid_line():
+    """
+    Test that a malformed NDJSON line raises MalformedBodyError.
+    """
+    with pytest.raises(MalformedBodyError):
+        async for _ in iter_ndjson(FakeStream(b'{"a": 1}\n{"a"\n'), 1024):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_parse_msgpack():
+    """
+    Test that a msgpack array split across reads is parsed element by element.
+    """
+    msgpack = pytest.importorskip("msgpack")
+    events = [{"event_type": "message", "event_payload": "x" * 20}] * 3
+    stream = FakeStream(msgpack.packb(events))
+    items = [item async for item in iter_msgpack(stream, 1024, chunk_size=7)]
+    assert items == events
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        (b"\x92\x01", MalformedBodyError),
+        (b"\x91\x01\x02", MalformedBodyError),
+        (b"\x91\xc1", MalformedBodyError),
+        (b"\x81\x01\x02", InvalidEventDataError),
+    ],
+)
+async def test_parse_msgpack_invalid(data, error):
+    """
+    Test that truncated, trailing or non-list msgpack bodies are rejected.
+    """
+    pytest.importorskip("msgpack")
+    with pytest.raises(error):
+        async for _ in iter_msgpack(FakeStream(data), 1024):
+            pass
+
+
+def test_get_body_parser():
+    """
+    Test that parsers are chosen by content type with JSON as the default.
+    """
+    assert get_body_parser("application/x-ndjson") == (iter_ndjson, "NDJSON")
+    assert get_body_parser("text/plain") == (iter_json_array, "JSON")
+    with patch("consumer.parsing.msgpack", None):
+        assert get_body_parser("application/msgpack") is None
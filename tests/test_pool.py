@@ -0,0 +1,78 @@
+import asyncio
+import json
+import socket
+
+import pytest
+from aiohttp import web
+
+from propagator.pool import PropagatorPool
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_pool_runs_independent_processes(tmp_path):
+    """
+    Test that every process of the pool sends events and flushes its batch
+    when the pool is stopped.
+    """
+    received = []
+    requests = 0
+
+    async def handle(request):
+        nonlocal requests
+        requests += 1
+        received.extend(await request.json())
+        return web.json_response({"status": "success"})
+
+    app = web.Application()
+    app.router.add_post("/event", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    events_file = tmp_path / "events.json"
+    events_file.write_text(
+        json.dumps(
+            [
+                {"event_type": "message", "event_payload": str(i)}
+                for i in range(2)
+            ]
+        )
+    )
+    pool = PropagatorPool(
+        str(events_file),
+        f"http://127.0.0.1:{port}/event",
+        0.01,
+        2,
+        drain_timeout=5.0,
+        max_batch_size=1000,
+        max_batch_latency_ms=60_000,
+    )
+    task = asyncio.create_task(pool.run())
+    try:
+        await asyncio.sleep(3)
+    finally:
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await runner.cleanup()
+
+    # Batches are only flushed on shutdown, one per process.
+    assert requests == 2
+    assert len(received) > 2
+    assert pool.processes == [None, None]
+
+
+def test_pool_rejects_invalid_options():
+    """
+    Test that invalid options fail before any process starts.
+    """
+    with pytest.raises(ValueError, match="Unknown source mode"):
+        PropagatorPool(
+            "events.json", "http://localhost:5000/event", 1, 2, source_mode="x"
+        )
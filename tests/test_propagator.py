@@ -1,11 +1,31 @@
 import asyncio
+import gzip
 import json
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import httpx
 import pytest
 
 from propagator.propagator import EventPropagator
+from propagator.wire import (
+    EncodedEvents,
+    encode_batch,
+    encode_event,
+    join_batch,
+)
+
+
+def json_body(events):
+    """
+    Build the expected post arguments for a JSON batch.
+
+    :param events: Events of the batch.
+    :return: Keyword arguments of the expected ``post`` call.
+    """
+    return {
+        "content": json.dumps(events, separators=(",", ":")).encode(),
+        "headers": {"Content-Type": "application/json"},
+    }
 
 
 @pytest.fixture
@@ -33,8 +53,8 @@ async def test_load_events(event_propagator, mocker):
     )
 
     await event_propagator.load_events_from_file()
-    assert event_propagator.events == [
-        {"event_type": "message", "event_payload": "hello"}
+    assert list(event_propagator.events) == [
+        b'{"event_type":"message","event_payload":"hello"}'
     ]
 
 
@@ -49,7 +69,7 @@ async def test_send_event_success(event_propagator, mocker):
     event = {"event_type": "message", "event_payload": "hello"}
     await event_propagator.send_event(event)
     mock_post.assert_called_once_with(
-        "http://localhost:5000/event", json=[event]
+        "http://localhost:5000/event", **json_body([event])
     )
 
 
@@ -64,7 +84,7 @@ async def test_send_event_failure(event_propagator, mocker):
     event = {"event_type": "message", "event_payload": "hello"}
     await event_propagator.send_event(event)
     mock_post.assert_called_once_with(
-        "http://localhost:5000/event", json=[event]
+        "http://localhost:5000/event", **json_body([event])
     )
 
 
@@ -73,14 +93,14 @@ async def test_event_loop(event_propagator, mocker):
     """
     Test the event loop for sending events periodically.
     """
-    mock_send_event = mocker.patch.object(
-        event_propagator, "send_event", new_callable=AsyncMock
+    mock_send_encoded = mocker.patch.object(
+        event_propagator, "send_encoded", new_callable=AsyncMock
     )
     mock_sleep = mocker.patch("asyncio.sleep", new_callable=AsyncMock)
 
-    event_propagator.events = [
-        {"event_type": "message", "event_payload": "hello"}
-    ]
+    event_propagator.load_events(
+        [{"event_type": "message", "event_payload": "hello"}]
+    )
 
     async def stop_event_loop(*args, **kwargs):
         """
@@ -93,7 +113,9 @@ async def test_event_loop(event_propagator, mocker):
     with pytest.raises(asyncio.CancelledError):
         await event_propagator.event_loop()
 
-    mock_send_event.assert_called_once()
+    mock_send_encoded.assert_called_once_with(
+        b'{"event_type":"message","event_payload":"hello"}'
+    )
 
 
 @pytest.mark.asyncio
@@ -119,7 +141,7 @@ async def test_load_events_empty_file(event_propagator, mocker):
     )
 
     await event_propagator.load_events_from_file()
-    assert event_propagator.events == []
+    assert len(event_propagator.events) == 0
 
 
 @pytest.mark.asyncio
@@ -133,5 +155,677 @@ async def test_send_event_unexpected_error(event_propagator, mocker):
     event = {"event_type": "message", "event_payload": "hello"}
     await event_propagator.send_event(event)
     mock_post.assert_called_once_with(
-        "http://localhost:5000/event", json=[event]
+        "http://localhost:5000/event", **json_body([event])
+    )
+
+
+@pytest.mark.asyncio
+async def test_unexpected_error_in_probe_reopens_breaker(
+    event_propagator, mocker
+):
+    """
+    Test that a half-open probe failing with an unexpected error does not
+    leave the breaker half-open.
+    """
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.side_effect = Exception("Unexpected error")
+    breaker = event_propagator.breaker
+    breaker.record_failure()
+    breaker.state = breaker.OPEN
+    breaker.opened_at -= breaker.reset_timeout
+
+    event = {"event_type": "message", "event_payload": "hello"}
+    await event_propagator.send_event(event)
+
+    mock_post.assert_called_once()
+    assert breaker.state == breaker.OPEN
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_send_event_reuses_client(event_propagator, mocker):
+    """
+    Test that consecutive sends share one pooled client.
+    """
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = MagicMock(text="ok")
+
+    event = {"event_type": "message", "event_payload": "hello"}
+    await event_propagator.send_event(event)
+    client = event_propagator.client
+    await event_propagator.send_event(event)
+
+    assert event_propagator.client is client
+    assert mock_post.call_count == 2
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_run_closes_client_on_cancel(event_propagator, mocker):
+    """
+    Test that the pooled client is configured and closed on cancellation.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        max_connections=4,
+        keepalive_expiry=60.0,
+    )
+    mocker.patch.object(
+        event_propagator, "load_events_from_file", new_callable=AsyncMock
+    )
+    mocker.patch.object(
+        event_propagator,
+        "event_loop",
+        new_callable=AsyncMock,
+        side_effect=asyncio.CancelledError,
+    )
+    mock_aclose = mocker.patch(
+        "httpx.AsyncClient.aclose", new_callable=AsyncMock
+    )
+
+    assert event_propagator.limits.max_connections == 4
+    assert event_propagator.limits.keepalive_expiry == 60.0
+
+    with pytest.raises(asyncio.CancelledError):
+        await event_propagator.run()
+
+    mock_aclose.assert_called_once()
+    assert event_propagator.client is None
+
+
+@pytest.mark.asyncio
+async def test_metrics_listener(unused_tcp_port, mocker):
+    """
+    Test that send metrics are served while the propagator runs.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        metrics_host="127.0.0.1",
+        metrics_port=unused_tcp_port,
+    )
+    mocker.patch.object(
+        event_propagator, "load_events_from_file", new_callable=AsyncMock
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value.status_code = 200
+    scraped = []
+
+    async def event_loop():
+        await event_propagator.send_event(
+            {"event_type": "message", "event_payload": "hello"}
+        )
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                f"http://127.0.0.1:{unused_tcp_port}/metrics"
+            )
+        scraped.extend(response.text.splitlines())
+        raise asyncio.CancelledError
+
+    event_propagator.event_loop = event_loop
+
+    with pytest.raises(asyncio.CancelledError):
+        await event_propagator.run()
+
+    assert "propagator_sent_events_total 1" in scraped
+    assert "propagator_send_seconds_count 1" in scraped
+    assert "propagator_requests_in_flight 0" in scraped
+
+
+@pytest.mark.asyncio
+async def test_batch_flushed_when_full(mocker):
+    """
+    Test that a full batch is sent as one request.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        max_batch_size=3,
+        max_batch_latency_ms=10_000,
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = MagicMock(text="ok")
+
+    events = [
+        {"event_type": "message", "event_payload": str(i)} for i in range(3)
+    ]
+    for event in events[:2]:
+        await event_propagator.send_event(event)
+    mock_post.assert_not_called()
+
+    await event_propagator.send_event(events[2])
+    mock_post.assert_called_once_with(
+        "http://localhost:5000/event", **json_body(events)
+    )
+    assert event_propagator.batch == []
+    assert event_propagator.flush_timer is None
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_batch_flushed_after_latency(mocker):
+    """
+    Test that a partial batch is sent once the latency bound expires.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        max_batch_size=100,
+        max_batch_latency_ms=10,
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = MagicMock(text="ok")
+
+    event = {"event_type": "message", "event_payload": "hello"}
+    await event_propagator.send_event(event)
+    mock_post.assert_not_called()
+
+    await asyncio.sleep(0.05)
+    mock_post.assert_called_once_with(
+        "http://localhost:5000/event", **json_body([event])
+    )
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_run_flushes_batch_on_cancel(mocker):
+    """
+    Test that buffered events are flushed before the client is closed.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        max_batch_size=100,
+        max_batch_latency_ms=10_000,
+    )
+    event = {"event_type": "message", "event_payload": "hello"}
+
+    async def fill_then_cancel():
+        await event_propagator.send_event(event)
+        raise asyncio.CancelledError
+
+    mocker.patch.object(
+        event_propagator, "load_events_from_file", new_callable=AsyncMock
+    )
+    mocker.patch.object(
+        event_propagator, "event_loop", side_effect=fill_then_cancel
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = MagicMock(text="ok")
+
+    with pytest.raises(asyncio.CancelledError):
+        await event_propagator.run()
+
+    mock_post.assert_called_once_with(
+        "http://localhost:5000/event", **json_body([event])
+    )
+    assert event_propagator.client is None
+
+
+@pytest.mark.asyncio
+async def test_send_event_ndjson(mocker):
+    """
+    Test that the NDJSON wire format posts line-delimited events.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        wire_format="ndjson",
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = MagicMock(text="ok")
+
+    event = {"event_type": "message", "event_payload": "hello"}
+    await event_propagator.send_event(event)
+    mock_post.assert_called_once_with(
+        "http://localhost:5000/event",
+        content=b'{"event_type":"message","event_payload":"hello"}\n',
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    await event_propagator.close_client()
+
+
+def test_encode_batch_msgpack():
+    """
+    Test that msgpack batches round-trip.
+    """
+    msgpack = pytest.importorskip("msgpack")
+    events = [{"event_type": "message", "event_payload": "hello"}]
+    assert msgpack.unpackb(encode_batch(events, "msgpack")) == events
+
+
+def test_unknown_wire_format():
+    """
+    Test that unknown or unavailable wire formats are rejected.
+    """
+    with pytest.raises(ValueError):
+        EventPropagator("events.json", "http://localhost", 1, wire_format="xml")
+    with patch("propagator.wire.msgpack", None), pytest.raises(ValueError):
+        EventPropagator(
+            "events.json", "http://localhost", 1, wire_format="msgpack"
+        )
+
+
+@pytest.mark.asyncio
+async def test_send_event_gzip(mocker):
+    """
+    Test that gzip-compressed batches carry a Content-Encoding header.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        content_encoding="gzip",
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = MagicMock(text="ok")
+
+    event = {"event_type": "message", "event_payload": "hello"}
+    await event_propagator.send_event(event)
+    _, kwargs = mock_post.call_args
+    assert kwargs["headers"] == {
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+    }
+    assert json.loads(gzip.decompress(kwargs["content"])) == [event]
+    await event_propagator.close_client()
+
+
+def test_unknown_content_encoding():
+    """
+    Test that unknown or unavailable content encodings are rejected.
+    """
+    with pytest.raises(ValueError):
+        EventPropagator(
+            "events.json", "http://localhost", 1, content_encoding="br"
+        )
+    with patch("propagator.wire.zstd", None), pytest.raises(ValueError):
+        EventPropagator(
+            "events.json", "http://localhost", 1, content_encoding="zstd"
+        )
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_scheduled_for_retry(event_propagator, mocker):
+    """
+    Test that a request error schedules the batch for a retry.
+    """
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.side_effect = httpx.RequestError("Request failed")
+
+    event = {"event_type": "message", "event_payload": "hello"}
+    await event_propagator.send_event(event)
+
+    assert len(event_propagator.retry_queue) == 1
+    _, _, events, attempt = event_propagator.retry_queue[0]
+    assert events == [json.dumps(event, separators=(",", ":")).encode()]
+    assert attempt == 1
+    assert event_propagator.stats.failed_attempts == 1
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_client_error_not_retried(event_propagator, mocker):
+    """
+    Test that 4xx responses other than 429 are dropped, not retried.
+    """
+    request = httpx.Request("POST", "http://localhost:5000/event")
+    response = httpx.Response(400, request=request, text="bad")
+    mocker.patch(
+        "httpx.AsyncClient.post", new_callable=AsyncMock, return_value=response
+    )
+
+    await event_propagator.send_event(
+        {"event_type": "message", "event_payload": "hello"}
+    )
+
+    assert event_propagator.retry_queue == []
+    assert event_propagator.stats.dropped_events == 1
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_retry_loop_delivers_after_recovery(mocker):
+    """
+    Test that a failed batch is retried and delivered once the consumer is
+    back.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        retry_base_delay=0.01,
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.side_effect = [
+        httpx.RequestError("Request failed"),
+        MagicMock(text="ok"),
+    ]
+
+    retry_task = asyncio.create_task(event_propagator.retry_loop())
+    await event_propagator.send_event(
+        {"event_type": "message", "event_payload": "hello"}
+    )
+    for _ in range(100):
+        if event_propagator.stats.sent_batches:
+            break
+        await asyncio.sleep(0.01)
+    retry_task.cancel()
+
+    assert mock_post.call_count == 2
+    assert event_propagator.stats.retried_batches == 1
+    assert event_propagator.stats.sent_events == 1
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_spills_and_replays(tmp_path, mocker):
+    """
+    Test that batches are spilled while the consumer is down and replayed
+    once it recovers.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        retry_queue_size=0,
+        breaker_failure_threshold=1,
+        spill_file=str(tmp_path / "spill.ndjson"),
+    )
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.side_effect = httpx.RequestError("Request failed")
+
+    event = {"event_type": "message", "event_payload": "hello"}
+    await event_propagator.send_event(event)
+    await event_propagator.send_event(event)
+
+    assert mock_post.call_count == 1
+    assert event_propagator.breaker.state == "open"
+    assert event_propagator.stats.spilled_events == 2
+
+    mock_post.side_effect = None
+    mock_post.return_value = MagicMock(text="ok")
+    event_propagator.breaker.record_success()
+    await event_propagator.replay_spill()
+
+    assert event_propagator.stats.replayed_events == 2
+    assert event_propagator.stats.sent_events == 2
+    assert not event_propagator.spill.has_data()
+    await event_propagator.close_client()
+
+
+@pytest.mark.asyncio
+async def test_pooled_event_loop_bounds_in_flight(mocker):
+    """
+    Test that the worker pool sends concurrently within the in-flight window.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        rate=1000,
+        rate_burst=100,
+        workers=3,
+        max_in_flight=5,
+    )
+    event_propagator.load_events(
+        [{"event_type": "message", "event_payload": "hello"}]
+    )
+    active = 0
+    peak_active = 0
+    peak_in_flight = 0
+    sent = 0
+
+    async def slow_send(event):
+        nonlocal active, peak_active, peak_in_flight, sent
+        active += 1
+        peak_active = max(peak_active, active)
+        peak_in_flight = max(peak_in_flight, event_propagator.in_flight)
+        await asyncio.sleep(0.01)
+        active -= 1
+        sent += 1
+
+    mocker.patch.object(event_propagator, "send_encoded", side_effect=slow_send)
+
+    task = asyncio.create_task(event_propagator.event_loop())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert sent > 3
+    assert peak_active == 3
+    assert peak_in_flight <= 5
+
+
+@pytest.mark.asyncio
+async def test_load_events_sequential_source(tmp_path):
+    """
+    Test that the sequential source mode streams instead of loading events.
+    """
+    path = tmp_path / "events.json"
+    path.write_text(
+        json.dumps([{"event_type": "message", "event_payload": "hello"}])
+    )
+    event_propagator = EventPropagator(
+        events_file=str(path),
+        endpoint="http://localhost:5000/event",
+        period=1,
+        source_mode="sequential",
+    )
+
+    await event_propagator.load_events_from_file()
+
+    assert len(event_propagator.events) == 0
+    assert (
+        await event_propagator.next_event()
+        == b'{"event_type":"message","event_payload":"hello"}'
+    )
+    await event_propagator.source.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("source_mode", ["sequential", "indexed"])
+async def test_undecodable_records_skipped(tmp_path, source_mode):
+    """
+    Test that records the source cannot decode count as invalid events
+    instead of stopping the propagator.
+    """
+    path = tmp_path / "events.ndjson"
+    path.write_text('{"event_type": "message", "event_payload": "hello"}\n{"\n')
+    event_propagator = EventPropagator(
+        events_file=str(path),
+        endpoint="http://localhost:5000/event",
+        period=1,
+        source_mode=source_mode,
+    )
+    await event_propagator.load_events_from_file()
+
+    events = [await event_propagator.next_event() for _ in range(20)]
+    assert None in events
+    assert b'{"event_type":"message","event_payload":"hello"}' in events
+    assert event_propagator.invalid_events == events.count(None)
+    await event_propagator.source.close()
+
+
+def test_unknown_source_mode():
+    """
+    Test that unknown source modes are rejected.
+    """
+    with pytest.raises(ValueError):
+        EventPropagator(
+            "events.json", "http://localhost", 1, source_mode="shuffled"
+        )
+
+
+def test_load_events_drops_invalid(event_propagator):
+    """
+    Test that invalid events are counted and never stored.
+    """
+    event_propagator.load_events(
+        [
+            {"event_type": "message", "event_payload": "hello"},
+            {"event_type": "invalid", "event_payload": {}},
+            "not an event",
+        ]
+    )
+
+    assert len(event_propagator.events) == 1
+    assert event_propagator.invalid_events == 2
+
+
+def test_encoded_events():
+    """
+    Test the array-backed encoded event store.
+    """
+    events = EncodedEvents()
+    events.append(b"abc")
+    events.append(b"")
+    events.append(b"de")
+
+    assert len(events) == 3
+    assert list(events) == [b"abc", b"", b"de"]
+    with pytest.raises(IndexError):
+        events[3]
+
+
+@pytest.mark.parametrize("count", [1, 15, 16, 70000])
+def test_join_batch_msgpack(count):
+    """
+    Test that joined msgpack events form a valid msgpack array.
+    """
+    msgpack = pytest.importorskip("msgpack")
+    event = {"event_type": "message", "event_payload": "hello"}
+    parts = [encode_event(event, "msgpack")] * count
+    assert msgpack.unpackb(join_batch(parts, "msgpack")) == [event] * count
+
+
+@pytest.mark.asyncio
+async def test_reconfigure_keeps_client(event_propagator, mocker):
+    """
+    Test that a reload applies new settings and keeps the connection pool
+    unless its limits change.
+    """
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = MagicMock(status_code=200, text="ok")
+    await event_propagator.open_delivery()
+    client = event_propagator.client
+
+    apply = event_propagator.prepare_reconfigure(
+        "http://localhost:5001/event", 0.5, max_batch_size=10
+    )
+    assert event_propagator.endpoint == "http://localhost:5000/event"
+    await apply()
+
+    assert event_propagator.endpoint == "http://localhost:5001/event"
+    assert event_propagator.period == 0.5
+    assert event_propagator.max_batch_size == 10
+    assert event_propagator.client is client
+
+    apply = event_propagator.prepare_reconfigure(
+        "http://localhost:5001/event", 0.5, max_connections=20
+    )
+    await apply()
+    assert client.is_closed
+    await event_propagator.send_event(
+        {"event_type": "message", "event_payload": "hello"}
+    )
+    await event_propagator.flush_batch()
+    assert event_propagator.client.is_closed is False
+    assert event_propagator.client._transport._pool._max_connections == 20
+    await event_propagator.close_delivery()
+
+
+@pytest.mark.asyncio
+async def test_reconfigure_pooled_event_loop(mocker):
+    """
+    Test that a reload resizes the running worker pool and in-flight window.
+    """
+    event_propagator = EventPropagator(
+        events_file="test_events.json",
+        endpoint="http://localhost:5000/event",
+        period=1,
+        rate=1000,
+        rate_burst=100,
+        workers=1,
+    )
+    event_propagator.load_events(
+        [{"event_type": "message", "event_payload": "hello"}]
+    )
+    active = 0
+    peak_active = 0
+
+    async def slow_send(event):
+        nonlocal active, peak_active
+        active += 1
+        peak_active = max(peak_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+
+    mocker.patch.object(event_propagator, "send_encoded", side_effect=slow_send)
+    task = asyncio.create_task(event_propagator.event_loop())
+    await asyncio.sleep(0.05)
+    assert peak_active == 1
+
+    apply = event_propagator.prepare_reconfigure(
+        "http://localhost:5000/event", 1, rate=500, workers=4
+    )
+    await apply()
+    await asyncio.sleep(0.05)
+    assert peak_active == 4
+    assert event_propagator.limiter.rate == 500
+    assert event_propagator.window.size == 4
+
+    await event_propagator.prepare_reconfigure(
+        "http://localhost:5000/event", 1, rate=500, workers=2
+    )()
+    await asyncio.sleep(0.05)
+    assert len(event_propagator.worker_tasks) == 2
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_reconfigure_rejects_restart_options(event_propagator):
+    """
+    Test that options only read at startup are rejected by a reload.
+    """
+    with pytest.raises(ValueError, match="wire_format requires a restart"):
+        event_propagator.prepare_reconfigure(
+            "http://localhost:5000/event", 1, wire_format="ndjson"
+        )
+    with pytest.raises(ValueError, match="rate requires a restart"):
+        event_propagator.prepare_reconfigure(
+            "http://localhost:5000/event", 1, rate=10
+        )
+    with pytest.raises(ValueError, match="Unknown source mode"):
+        event_propagator.prepare_reconfigure(
+            "http://localhost:5000/event", 1, source_mode="random"
+        )
+
+
+def test_reconfigure_rejects_removing_routes():
+    """
+    Test that a reload dropping the routing table is rejected, not crashed
+    on.
+    """
+    event_propagator = EventPropagator(
+        events_file=None,
+        endpoint="http://localhost:5000/event",
+        period=1,
+        routes=[
+            {
+                "event_types": ["message"],
+                "endpoints": ["http://mirror:5000/event"],
+            }
+        ],
     )
+    with pytest.raises(ValueError, match="routes requires a restart"):
+        event_propagator.prepare_reconfigure("http://localhost:5000/event", 1)
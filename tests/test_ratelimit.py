@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from propagator.ratelimit import InFlightWindow, RateLimiter
+
+
+def test_permits_follow_fixed_schedule():
+    """
+    Test that permits are spaced by 1/rate regardless of when they are taken.
+    """
+    now = [0.0]
+    limiter = RateLimiter(10, clock=lambda: now[0])
+
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve() == pytest.approx(0.1)
+    assert limiter.reserve() == pytest.approx(0.2)
+
+    # Time spent sending does not push the schedule back.
+    now[0] = 0.25
+    assert limiter.reserve() == pytest.approx(0.05)
+
+
+def test_burst_allows_catching_up():
+    """
+    Test that up to ``burst`` permits are available after a stall.
+    """
+    now = [0.0]
+    limiter = RateLimiter(10, burst=3, clock=lambda: now[0])
+    limiter.reserve()
+
+    now[0] = 10.0
+    assert [limiter.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.reserve() == pytest.approx(0.1)
+
+
+def test_invalid_settings():
+    """
+    Test that non-positive rates and bursts are rejected.
+    """
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+    with pytest.raises(ValueError):
+        RateLimiter(1, burst=0)
+
+
+@pytest.mark.asyncio
+async def test_in_flight_window_resize():
+    """
+    Test that growing the window lets waiting acquirers through.
+    """
+    window = InFlightWindow(1)
+    await window.acquire()
+    waiting = asyncio.create_task(window.acquire())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+
+    window.resize(2)
+    await asyncio.wait_for(waiting, 1)
+    assert window.used == 2
+
+    window.resize(1)
+    window.release()
+    waiting = asyncio.create_task(window.acquire())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    window.release()
+    await asyncio.wait_for(waiting, 1)
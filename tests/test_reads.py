@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+
+from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+
+from consumer import init_app
+from consumer.backends import backend_key
+
+
+class TestReads(AioHTTPTestCase):
+    async def get_application(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        return await init_app(
+            db_path=os.path.join(db_dir.name, "events.db"), read_pool_size=2
+        )
+
+    async def store(self, *event_types):
+        events = [
+            {"event_type": event_type, "event_payload": f"payload{i}"}
+            for i, event_type in enumerate(event_types, start=1)
+        ]
+        resp = await self.client.post("/event", json=events)
+        assert resp.status == 200
+
+    @unittest_run_loop
+    async def test_list_events(self):
+        """
+        Test listing stored events in id order.
+        """
+        await self.store("a", "b")
+        resp = await self.client.get("/events")
+        assert resp.status == 200
+        body = await resp.json()
+        for event in body["events"]:
+            assert isinstance(event.pop("received_at"), float)
+        assert body == {
+            "events": [
+                {"id": 1, "event_type": "a", "event_payload": "payload1"},
+                {"id": 2, "event_type": "b", "event_payload": "payload2"},
+            ],
+            "next_after_id": None,
+        }
+
+    @unittest_run_loop
+    async def test_list_events_filters(self):
+        """
+        Test filtering by event type and id range.
+        """
+        await self.store("a", "b", "a", "a", "b")
+        resp = await self.client.get(
+            "/events", params={"event_type": "a", "after_id": 1, "before_id": 5}
+        )
+        body = await resp.json()
+        assert [event["id"] for event in body["events"]] == [3, 4]
+
+    @unittest_run_loop
+    async def test_list_events_keyset_pagination(self):
+        """
+        Test walking all events page by page with the returned cursor.
+        """
+        await self.store(*"abcde")
+        ids = []
+        params = {"limit": 2}
+        while True:
+            resp = await self.client.get("/events", params=params)
+            body = await resp.json()
+            ids.extend(event["id"] for event in body["events"])
+            if body["next_after_id"] is None:
+                break
+            params["after_id"] = body["next_after_id"]
+        assert ids == [1, 2, 3, 4, 5]
+
+    @unittest_run_loop
+    async def test_list_events_invalid_parameter(self):
+        """
+        Test rejecting malformed or out-of-range query parameters.
+        """
+        for params in ({"after_id": "x"}, {"limit": 0}, {"limit": 100000}):
+            resp = await self.client.get("/events", params=params)
+            assert resp.status == 400
+            name = next(iter(params))
+            assert await resp.json() == {
+                "error": f"Invalid query parameter: {name}"
+            }
+
+    @unittest_run_loop
+    async def test_count_events(self):
+        """
+        Test counting events per event type.
+        """
+        await self.store("a", "b", "a")
+        resp = await self.client.get("/events/counts")
+        assert resp.status == 200
+        assert await resp.json() == {"counts": {"a": 2, "b": 1}}
+        resp = await self.client.get("/events/counts", params={"after_id": 1})
+        assert await resp.json() == {"counts": {"a": 1, "b": 1}}
+
+    @unittest_run_loop
+    async def test_export_events(self):
+        """
+        Test streaming matching events as NDJSON.
+        """
+        await self.store("a", "b", "a")
+        resp = await self.client.get(
+            "/events/export", params={"event_type": "a"}
+        )
+        assert resp.status == 200
+        assert resp.content_type == "application/x-ndjson"
+        lines = (await resp.text()).splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [1, 3]
+
+    @unittest_run_loop
+    async def test_export_events_empty(self):
+        """
+        Test exporting an empty result.
+        """
+        resp = await self.client.get("/events/export")
+        assert resp.status == 200
+        assert await resp.text() == ""
+
+    @unittest_run_loop
+    async def test_read_pool_is_read_only(self):
+        """
+        Test that the read connections cannot modify the database.
+        """
+        async with self.app[backend_key].read_pool.acquire() as db:
+            with self.assertRaises(Exception):
+                await db.execute("DELETE FROM received_events")
+        async with self.app[backend_key].db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        ) as cursor:
+            indexes = [name for (name,) in await cursor.fetchall()]
+        assert any(name.endswith("_type_id") for name in indexes)
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from unittest.mock import AsyncMock
+
+import pytest
+
+from propagator.propagator import EventPropagator
+from propagator.routing import Router
+
+DEFAULT = "http://localhost:5000/event"
+MESSAGES = "http://messages:5000/event"
+USERS = "http://users:5000/event"
+MIRROR = "http://mirror:5000/event"
+AUDIT = "http://audit:5000/event"
+
+
+def routed_propagator(**kwargs):
+    """
+    Create an EventPropagator routing messages and user events apart.
+
+    :param kwargs: Extra EventPropagator options.
+    :return: The propagator.
+    """
+    return EventPropagator(
+        events_file="test_events.json",
+        endpoint=DEFAULT,
+        period=1,
+        routes=[
+            {"event_types": ["message"], "endpoints": [MESSAGES]},
+            {"event_types": ["user_*"], "endpoints": [USERS, MIRROR]},
+        ],
+        **kwargs,
+    )
+
+
+async def send_all(propagator, event_types):
+    """
+    Send one event per type through the started destinations, then stop
+    them.
+
+    :param propagator: The routed propagator.
+    :param event_types: Types of the events to send.
+    """
+    for destination in propagator.destinations:
+        await destination.start()
+    for event_type in event_types:
+        await propagator.send_event(
+            {"event_type": event_type, "event_payload": "payload"}
+        )
+    await asyncio.sleep(0)
+    for destination in propagator.destinations:
+        await destination.stop()
+
+
+def test_router_first_match_wins():
+    """
+    Test that the first matching route decides and unmatched types fall
+    back to the default destination.
+    """
+    router = Router([(["user_*"], ["users"]), (["*"], ["all"])], "default")
+
+    assert router.match("user_left") == ["users"]
+    assert router.match("message") == ["all"]
+    assert Router([], "default").match("message") == ["default"]
+
+
+@pytest.mark.asyncio
+async def test_events_routed_and_mirrored(mocker):
+    """
+    Test that every event reaches the endpoints of its route.
+    """
+    mock_post = mocker.patch("httpx.AsyncClient.post", new_callable=AsyncMock)
+    mock_post.return_value = mocker.MagicMock(status_code=200, text="ok")
+    propagator = routed_propagator()
+
+    await send_all(propagator, ["message", "user_joined", "user_left", "other"])
+
+    endpoints = sorted(call.args[0] for call in mock_post.call_args_list)
+    assert endpoints == sorted(
+        [MESSAGES, USERS, USERS, MIRROR, MIRROR, DEFAULT]
+    )
+    assert len(propagator.destinations) == 4
+    assert sum(s.stats.sent_events for s in propagator.senders) == 6
+
+
+@pytest.mark.asyncio
+async def test_slow_destination_does_not_block_others(mocker):
+    """
+    Test that a stalled endpoint drops its own events while the others keep
+    receiving theirs.
+    """
+    stalled = asyncio.Event()
+
+    async def post(url, **kwargs):
+        if url == MESSAGES:
+            await stalled.wait()
+        return mocker.MagicMock(status_code=200, text="ok")
+
+    mocker.patch("httpx.AsyncClient.post", side_effect=post)
+    propagator = routed_propagator(
+        destinations={MESSAGES: {"max_in_flight": 1}}
+    )
+    for destination in propagator.destinations:
+        await destination.start()
+
+    for _ in range(5):
+        await propagator.send_event(
+            {"event_type": "message", "event_payload": "payload"}
+        )
+        await propagator.send_event(
+            {"event_type": "user_joined", "event_payload": "payload"}
+        )
+        await asyncio.sleep(0)
+
+    senders = {s.endpoint: s for s in propagator.senders}
+    assert senders[USERS].stats.sent_events == 5
+    assert senders[MESSAGES].stats.dropped_events >= 3
+    stalled.set()
+    for destination in propagator.destinations:
+        await destination.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("spill", [False, True])
+async def test_full_destination_spills_or_drops(tmp_path, caplog, spill):
+    """
+    Test that events overflowing a destination queue are spilled, or
+    dropped without a spill file, with one warning per overflow.
+    """
+    options = {"max_in_flight": 1}
+    if spill:
+        options["spill_file"] = str(tmp_path / "spill.ndjson")
+    propagator = routed_propagator(destinations={MESSAGES: options})
+    destination = next(
+        d for d in propagator.destinations if d.endpoint == MESSAGES
+    )
+
+    with caplog.at_level(logging.WARNING, logger="propagator.routing"):
+        for i in range(3):
+            await propagator.send_event(
+                {"event_type": "message", "event_payload": str(i)}
+            )
+
+    stats = destination.sender.stats
+    assert destination.queue.qsize() == 1
+    assert (stats.spilled_events, stats.dropped_events) == (
+        (2, 0) if spill else (0, 2)
+    )
+    if spill:
+        batches = [batch async for batch in destination.sender.spill.replay()]
+        assert [batch[0]["event_payload"] for batch in batches] == ["1", "2"]
+    warnings = [r for r in caplog.records if MESSAGES in r.getMessage()]
+    assert len(warnings) == 1
+
+
+def test_invalid_routes():
+    """
+    Test that incomplete routes and per-endpoint wire formats are refused.
+    """
+    with pytest.raises(ValueError):
+        EventPropagator(
+            events_file="test_events.json",
+            endpoint=DEFAULT,
+            period=1,
+            routes=[{"event_types": ["message"]}],
+        )
+    with pytest.raises(ValueError):
+        routed_propagator(destinations={USERS: {"wire_format": "ndjson"}})
+
+
+@pytest.mark.asyncio
+async def test_reconfigure_routes(mocker):
+    """
+    Test that a reload keeps the destinations of remaining endpoints,
+    starts new ones and drains removed ones.
+    """
+    stalled = asyncio.Event()
+
+    async def post(url, **kwargs):
+        if url == MIRROR:
+            await stalled.wait()
+        return mocker.MagicMock(status_code=200, text="ok")
+
+    mock_post = mocker.patch("httpx.AsyncClient.post", side_effect=post)
+    propagator = routed_propagator()
+    for destination in propagator.destinations:
+        await destination.start()
+    propagator.running = True
+    await propagator.send_event(
+        {"event_type": "user_joined", "event_payload": "payload"}
+    )
+    await asyncio.sleep(0)
+    current = {d.endpoint: d for d in propagator.destinations}
+    users = current[USERS]
+    mirror = current[MIRROR].sender
+
+    apply = propagator.prepare_reconfigure(
+        DEFAULT,
+        1,
+        routes=[
+            {"event_types": ["user_*"], "endpoints": [USERS]},
+            {"event_types": ["message"], "endpoints": [MESSAGES]},
+            {"event_types": ["audit"], "endpoints": [AUDIT]},
+        ],
+        destinations={USERS: {"workers": 2}},
+    )
+    reload = asyncio.create_task(apply())
+    await asyncio.sleep(0)
+    stalled.set()
+    await reload
+
+    destinations = {d.endpoint: d for d in propagator.destinations}
+    assert set(destinations) == {DEFAULT, USERS, MESSAGES, AUDIT}
+    assert destinations[USERS] is users
+    assert users.workers == 2
+    assert mirror.stats.sent_events == 1
+    await propagator.send_event(
+        {"event_type": "audit", "event_payload": "payload"}
+    )
+    await asyncio.sleep(0)
+    for destination in propagator.destinations:
+        await destination.stop()
+
+    endpoints = sorted(call.args[0] for call in mock_post.call_args_list)
+    assert endpoints == sorted([USERS, MIRROR, AUDIT])
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from consumer.parsing import (
+    InvalidEventDataError,
+    MalformedBodyError,
+    iter_json_array,
+)
+from runtime import PROFILE_FAST, PROFILE_STANDARD, codec, use_profile
+from runtime.profile import active
+
+EVENTS = [
+    {"event_type": "message", "event_payload": "héllo"},
+    {"event_type": "user_joined", "event_payload": "", "event_id": "1"},
+]
+
+
+class FakeContent:
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+@pytest.fixture(params=[PROFILE_STANDARD, PROFILE_FAST])
+def profile(request):
+    """
+    Fixture running a test in each runtime profile, restoring the profile
+    of the test session afterwards.
+    """
+    session_profile = active["profile"]
+    yield use_profile(request.param)
+    use_profile(session_profile)
+
+
+def test_codec_round_trip(profile):
+    """
+    Test that events survive encoding and decoding in either profile.
+    """
+    assert codec.loads(codec.dumps(EVENTS)) == EVENTS
+    assert codec.loads(codec.dumps_bytes(EVENTS)) == EVENTS
+    assert json.loads(codec.dumps_bytes(EVENTS)) == EVENTS
+    assert b" " not in codec.dumps_bytes(EVENTS[1])
+    with pytest.raises(ValueError):
+        codec.loads("{invalid")
+
+
+def test_fast_profile_libraries(profile):
+    """
+    Test that the fast profile uses orjson and uvloop when installed.
+    """
+    orjson_installed = codec.orjson is not None
+    fast = profile["profile"] == PROFILE_FAST
+    assert profile["json"] == (
+        "orjson" if fast and orjson_installed else "json"
+    )
+    policy = type(asyncio.get_event_loop_policy()).__module__
+    assert policy.startswith("uvloop") == (profile["event_loop"] == "uvloop")
+
+
+@pytest.mark.asyncio
+async def test_iter_json_array(profile):
+    """
+    Test that JSON array bodies parse the same way in either profile.
+    """
+    body = json.dumps(EVENTS).encode()
+    items = [item async for item in iter_json_array(FakeContent(body), 1024)]
+    assert items == EVENTS
+
+    with pytest.raises(InvalidEventDataError):
+        async for _ in iter_json_array(FakeContent(b'{"a": 1}'), 1024):
+            pass
+    with pytest.raises(MalformedBodyError):
+        async for _ in iter_json_array(FakeContent(b"[{]"), 1024):
+            pass
+
+
+def test_fast_profile_falls_back():
+    """
+    Test that the fast profile falls back to the standard libraries when
+    orjson and uvloop are missing.
+    """
+    session_profile = active["profile"]
+    try:
+        with (
+            patch("runtime.codec.orjson", None),
+            patch("runtime.profile.uvloop", None),
+        ):
+            assert use_profile(PROFILE_FAST) == {
+                "profile": PROFILE_FAST,
+                "json": "json",
+                "event_loop": "asyncio",
+            }
+        assert codec.dumps is codec.json_dumps
+        assert codec.loads is json.loads
+    finally:
+        use_profile(session_profile)
+
+
+def test_unknown_profile():
+    """
+    Test that an unknown profile is rejected.
+    """
+    with pytest.raises(ValueError, match="Unknown runtime profile"):
+        use_profile("turbo")
@@ -0,0 +1,212 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from propagator.sources import (
+    IndexedSource,
+    SequentialSource,
+    build_offset_index,
+    iter_file_events,
+)
+
+EVENTS = [
+    {"event_type": "message", "event_payload": "hello [with] {brackets}"},
+    {"event_type": "message", "event_payload": 'quote \\" and ]'},
+    {"event_type": "user_joined", "event_payload": "Péter"},
+]
+
+
+@pytest.fixture
+def json_file(tmp_path):
+    """
+    Fixture writing EVENTS as a JSON array file.
+    """
+    path = tmp_path / "events.json"
+    path.write_text(json.dumps(EVENTS, indent=4, ensure_ascii=False))
+    return str(path)
+
+
+@pytest.fixture
+def ndjson_file(tmp_path):
+    """
+    Fixture writing EVENTS as an NDJSON file.
+    """
+    path = tmp_path / "events.ndjson"
+    path.write_text(
+        "\n".join(json.dumps(event, ensure_ascii=False) for event in EVENTS)
+        + "\n\n"
+    )
+    return str(path)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fixture", ["json_file", "ndjson_file"])
+async def test_iter_file_events(fixture, request):
+    """
+    Test that both file formats are streamed in small chunks.
+    """
+    path = request.getfixturevalue(fixture)
+    events = [event async for event in iter_file_events(path, chunk_size=7)]
+    assert events == EVENTS
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("ndjson", [False, True])
+async def test_iter_file_events_large_event(tmp_path, ndjson):
+    """
+    Test that events spanning many reads are streamed whole.
+    """
+    events = [{"event_type": "message", "event_payload": "x" * 1024 * 1024}] * 2
+    path = tmp_path / "events.json"
+    if ndjson:
+        path.write_text("\n".join(json.dumps(event) for event in events))
+    else:
+        path.write_text(json.dumps(events))
+    streamed = [
+        event async for event in iter_file_events(path, chunk_size=1024)
+    ]
+    assert streamed == events
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("element", ["{oops}", "tru", '"a\\q"', "{[1}"])
+async def test_iter_file_events_invalid_element(tmp_path, element):
+    """
+    Test that an invalid array element fails with its position without
+    reading the rest of the file.
+    """
+    head = json.dumps(EVENTS[:1])[:-1] + ", "
+    path = tmp_path / "events.json"
+    # Reading up to the undecodable tail would raise UnicodeDecodeError.
+    path.write_bytes(
+        (head + element + ", " + json.dumps(EVENTS * 1000)[1:]).encode()
+        + b"\xff"
+    )
+    events = []
+    with pytest.raises(ValueError, match=f"at character {len(head)}"):
+        async for event in iter_file_events(path, chunk_size=16):
+            events.append(event)
+    assert events == EVENTS[:1]
+
+
+@pytest.mark.parametrize("fixture", ["json_file", "ndjson_file"])
+def test_build_offset_index(fixture, request):
+    """
+    Test that offsets delimit every event, ignoring brackets inside strings.
+    """
+    path = request.getfixturevalue(fixture)
+    with open(path, "rb") as file:
+        data = file.read()
+    offsets = build_offset_index(data)
+    events = [
+        json.loads(data[offsets[i] : offsets[i + 1]])
+        for i in range(0, len(offsets), 2)
+    ]
+    assert events == EVENTS
+
+
+@pytest.mark.asyncio
+async def test_sequential_source_wraps_around(ndjson_file):
+    """
+    Test that the sequential source replays the file in order, repeatedly.
+    """
+    source = SequentialSource(ndjson_file)
+    await source.open()
+    events = [await source.next_event() for _ in range(4)]
+    await source.close()
+    assert events == EVENTS + EVENTS[:1]
+
+
+@pytest.mark.asyncio
+async def test_sequential_source_open_closes_stream(ndjson_file):
+    """
+    Test that checking the file for events closes the stream it opened.
+    """
+    closed = []
+
+    async def events(path):
+        try:
+            yield EVENTS[0]
+        finally:
+            closed.append(path)
+
+    with patch("propagator.sources.iter_file_events", events):
+        await SequentialSource(ndjson_file).open()
+    assert closed == [ndjson_file]
+
+
+@pytest.mark.asyncio
+async def test_sequential_source_restarts_after_corrupt_array(tmp_path):
+    """
+    Test that a JSON array that stops decoding is replayed from the start.
+    """
+    path = tmp_path / "events.json"
+    path.write_text(json.dumps(EVENTS[:1])[:-1] + ", {oops}]")
+    source = SequentialSource(str(path))
+    await source.open()
+    events = [await source.next_event() for _ in range(4)]
+    await source.close()
+    assert events == [EVENTS[0], None, EVENTS[0], None]
+
+
+@pytest.mark.asyncio
+async def test_indexed_source_reuses_saved_index(json_file):
+    """
+    Test that the offset index is built once and reused while the file is
+    unchanged.
+    """
+    source = IndexedSource(json_file)
+    await source.open()
+    assert len(source) == 3
+    assert await source.next_event() in EVENTS
+    await source.close()
+
+    with patch("propagator.sources.build_offset_index") as mock_build:
+        source = IndexedSource(json_file)
+        await source.open()
+        mock_build.assert_not_called()
+    assert len(source) == 3
+    await source.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content", ["[]", ""])
+async def test_indexed_source_empty_file(tmp_path, content):
+    """
+    Test that an empty events file is rejected and not left open.
+    """
+    path = tmp_path / "events.json"
+    path.write_text(content)
+    opened = []
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        file = real_open(*args, **kwargs)
+        opened.append(file)
+        return file
+
+    source = IndexedSource(str(path))
+    with patch("builtins.open", tracking_open):
+        with pytest.raises(ValueError, match="empty"):
+            await source.open()
+    assert opened and all(file.closed for file in opened)
+    assert source.file is None and source.data is None
+
+
+@pytest.mark.asyncio
+async def test_indexed_source_rebuilds_truncated_index(json_file):
+    """
+    Test that an index with an odd number of offsets is rebuilt.
+    """
+    source = IndexedSource(json_file)
+    await source.open()
+    await source.close()
+    with open(source.index_path, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 8)
+
+    source = IndexedSource(json_file)
+    await source.open()
+    assert len(source) == 3
+    assert await source.next_event() in EVENTS
+    await source.close()
@@ -0,0 +1,307 @@
+import aiosqlite
+import pytest
+import pytest_asyncio
+
+from consumer.backends import open_db
+from consumer.storage import (
+    ENCODING_TYPES,
+    ENCODING_TYPES_AND_PAYLOADS,
+    WINDOW_HOUR,
+    PartitionedStorage,
+    partition_end,
+    partition_start,
+)
+
+# 2026-10-17 00:00:00 UTC
+DAY = 1792195200.0
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest_asyncio.fixture
+async def db(tmp_path):
+    """
+    Fixture to open a writer connection on a fresh database.
+    """
+    db = await open_db(str(tmp_path / "events.db"))
+    yield db
+    await db.close()
+
+
+async def stored_ids(db):
+    rows = await db.execute_fetchall("SELECT id FROM received_events")
+    return sorted(row[0] for row in rows)
+
+
+async def write(storage, *payloads):
+    await storage.insert([("message", payload, None) for payload in payloads])
+    await storage.commit()
+
+
+def test_partition_bounds():
+    """
+    Test the window bounds of day and hour partitions.
+    """
+    assert partition_start("20261017") == DAY
+    assert partition_end("20261017") == DAY + 24 * 3600
+    assert partition_end("2026101705") == DAY + 6 * 3600
+
+
+def test_unknown_window():
+    """
+    Test that an unknown window is rejected.
+    """
+    with pytest.raises(ValueError):
+        PartitionedStorage(None, window="week")
+
+
+@pytest.mark.asyncio
+async def test_partitions_by_window(db):
+    """
+    Test that events land in the partition of their window and the view
+    unions all partitions with increasing ids.
+    """
+    clock = Clock(DAY + 10)
+    storage = PartitionedStorage(db, window=WINDOW_HOUR, clock=clock)
+    await storage.init()
+    await write(storage, "a", "b")
+    clock.now += 3600
+    await write(storage, "c")
+
+    assert storage.partitions == ["2026101700", "2026101701"]
+    assert await stored_ids(db) == [1, 2, 3]
+    rows = await db.execute_fetchall(
+        "SELECT id, received_at FROM received_events_p2026101701"
+    )
+    assert rows == [(3, DAY + 3610)]
+
+
+@pytest.mark.asyncio
+async def test_ids_survive_restart_and_rollback(db):
+    """
+    Test that ids continue after a restart and are reused after a rollback.
+    """
+    storage = PartitionedStorage(db, clock=Clock(DAY))
+    await storage.init()
+    await write(storage, "a")
+    await storage.insert([("message", "lost", None)])
+    await storage.rollback()
+
+    restarted = PartitionedStorage(db, clock=Clock(DAY + 24 * 3600))
+    await restarted.init()
+    await write(restarted, "b")
+
+    assert await stored_ids(db) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_insert_skips_stored_event_ids(db):
+    """
+    Test that rows with an event id already in the partition are skipped
+    and reported by position.
+    """
+    storage = PartitionedStorage(db, clock=Clock(DAY))
+    await storage.init()
+
+    assert (
+        await storage.insert([("message", "a", "e1"), ("message", "b", None)])
+        == set()
+    )
+    assert await storage.insert(
+        [("message", "a", "e1"), ("message", "c", "e2"), ("message", "c", "e2")]
+    ) == {0, 2}
+    await storage.commit()
+
+    rows = await db.execute_fetchall(
+        "SELECT id, event_id FROM received_events_p20261017 ORDER BY id"
+    )
+    assert rows == [(1, "e1"), (2, None), (4, "e2")]
+
+
+@pytest.mark.asyncio
+async def test_event_ids_span_partitions(db):
+    """
+    Test that an id stored in one partition is rejected in the next one,
+    and forgotten when retention drops its partition.
+    """
+    clock = Clock(DAY)
+    storage = PartitionedStorage(db, retention_hours=24, clock=clock)
+    await storage.init()
+    assert await storage.insert([("message", "a", "e1")]) == set()
+    await storage.commit()
+
+    clock.now += 24 * 3600
+    assert await storage.insert([("message", "a", "e1")]) == {0}
+    await storage.commit()
+
+    clock.now += 24 * 3600
+    await storage.drop_expired()
+    assert await storage.insert([("message", "a", "e1")]) == set()
+
+
+@pytest.mark.asyncio
+async def test_retention_drops_whole_partitions(db):
+    """
+    Test that partitions past the retention period are dropped and the view
+    keeps working.
+    """
+    clock = Clock(DAY)
+    storage = PartitionedStorage(db, retention_hours=24, clock=clock)
+    await storage.init()
+    await write(storage, "old")
+    clock.now += 24 * 3600
+    await write(storage, "new")
+
+    assert await storage.drop_expired() == []
+    clock.now += 24 * 3600
+    assert await storage.drop_expired() == ["20261017"]
+
+    assert storage.partitions == ["20261018", "20261019"]
+    assert await stored_ids(db) == [2]
+
+
+@pytest.mark.asyncio
+async def test_vacuum_releases_dropped_pages(db):
+    """
+    Test that incremental vacuum returns the pages of dropped partitions.
+    """
+    clock = Clock(DAY)
+    storage = PartitionedStorage(db, retention_hours=1, clock=clock)
+    await storage.init()
+    await write(storage, *["x" * 1000] * 100)
+    clock.now += 2 * 24 * 3600
+    await storage.drop_expired()
+
+    assert await storage.vacuum(10) == 10
+    assert await storage.vacuum(1000) > 0
+    assert await storage.vacuum(1000) == 0
+
+
+@pytest.mark.asyncio
+async def test_migrates_unpartitioned_table(tmp_path):
+    """
+    Test that a table from before partitioning becomes the oldest partition.
+    """
+    path = str(tmp_path / "events.db")
+    async with aiosqlite.connect(path) as db:
+        await db.execute(
+            "CREATE TABLE received_events (id INTEGER PRIMARY KEY "
+            "AUTOINCREMENT, event_type TEXT NOT NULL, "
+            "event_payload TEXT NOT NULL)"
+        )
+        await db.execute(
+            "INSERT INTO received_events (event_type, event_payload) "
+            "VALUES ('message', 'a')"
+        )
+        await db.commit()
+
+    db = await open_db(path)
+    try:
+        storage = PartitionedStorage(db, clock=Clock(DAY))
+        await storage.init()
+        await write(storage, "b")
+
+        assert storage.partitions == ["19700101", "20261017"]
+        assert await stored_ids(db) == [1, 2]
+        columns = await db.execute_fetchall(
+            "PRAGMA table_info(received_events_p19700101)"
+        )
+        assert "event_id" in [column[1] for column in columns]
+    finally:
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_dictionary_encoded_partitions(db):
+    """
+    Test that encoded partitions store lookup ids, and that the view reads
+    them back next to a partition stored as text.
+    """
+    clock = Clock(DAY + 10)
+    plain = PartitionedStorage(db, window=WINDOW_HOUR, clock=clock)
+    await plain.init()
+    await write(plain, "hello")
+    clock.now += 3600
+    storage = PartitionedStorage(
+        db,
+        window=WINDOW_HOUR,
+        clock=clock,
+        dictionary_encoding=ENCODING_TYPES_AND_PAYLOADS,
+    )
+    await storage.init()
+    await write(storage, "hello", "welcome", "hello")
+
+    rows = await db.execute_fetchall(
+        "SELECT type_id, payload_id FROM received_events_p2026101701"
+    )
+    assert rows == [(1, 1), (1, 2), (1, 1)]
+    rows = await db.execute_fetchall(
+        "SELECT id, event_type, event_payload FROM received_events "
+        "WHERE event_type = 'message' ORDER BY id"
+    )
+    assert rows == [
+        (1, "message", "hello"),
+        (2, "message", "hello"),
+        (3, "message", "welcome"),
+        (4, "message", "hello"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_rollback_forgets_interned_ids(db):
+    """
+    Test that ids interned by a rolled back transaction are not reused.
+    """
+    storage = PartitionedStorage(
+        db, clock=Clock(DAY), dictionary_encoding=ENCODING_TYPES
+    )
+    await storage.init()
+    await storage.insert([("lost", "payload", None)])
+    await storage.rollback()
+    await storage.insert([("kept", "payload", None)])
+    await storage.commit()
+
+    assert "lost" not in storage.types.cache
+    rows = await db.execute_fetchall("SELECT event_type FROM received_events")
+    assert rows == [("kept",)]
+
+
+@pytest.mark.asyncio
+async def test_retention_prunes_unused_payloads(db):
+    """
+    Test that payloads only referenced by dropped partitions are deleted.
+    """
+    clock = Clock(DAY + 10)
+    storage = PartitionedStorage(
+        db,
+        window=WINDOW_HOUR,
+        retention_hours=1,
+        clock=clock,
+        dictionary_encoding=ENCODING_TYPES_AND_PAYLOADS,
+    )
+    await storage.init()
+    await write(storage, "old", "shared")
+    clock.now += 3600
+    await write(storage, "shared")
+    clock.now += 3600
+
+    await storage.drop_expired()
+
+    rows = await db.execute_fetchall(
+        "SELECT value FROM received_events_payloads"
+    )
+    assert rows == [("shared",)]
+
+
+def test_unknown_dictionary_encoding():
+    """
+    Test that an unknown dictionary encoding is rejected.
+    """
+    with pytest.raises(ValueError):
+        PartitionedStorage(None, dictionary_encoding="zip")
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest.mock import MagicMock
+
+import pytest
+from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+
+from consumer import init_app
+from consumer.backends import open_backend
+from consumer.stream import (
+    SLOW_POLICY_DISCONNECT,
+    SLOW_POLICY_DROP,
+    StreamHub,
+    encode_event,
+    stream_hub_key,
+)
+
+
+async def read_frame(resp):
+    """
+    Read one Server-Sent Events frame.
+
+    :param resp: The streaming response.
+    :return: A dictionary of the frame's fields.
+    """
+    fields = {}
+    while True:
+        line = await asyncio.wait_for(resp.content.readline(), 5)
+        line = line.decode().rstrip("\n")
+        if not line:
+            return fields
+        name, _, value = line.partition(": ")
+        fields[name] = value
+
+
+class TestStream(AioHTTPTestCase):
+    async def get_application(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        return await init_app(db_path=os.path.join(db_dir.name, "events.db"))
+
+    async def post(self, *event_types):
+        resp = await self.client.post(
+            "/event",
+            json=[
+                {"event_type": event_type, "event_payload": "payload"}
+                for event_type in event_types
+            ],
+        )
+        assert resp.status == 200
+
+    @unittest_run_loop
+    async def test_live_events_filtered_by_type(self):
+        """
+        Test that subscribers receive new events of their type only.
+        """
+        resp = await self.client.get("/events/stream?event_type=message")
+        assert resp.status == 200
+        assert resp.headers["Content-Type"] == "text/event-stream"
+
+        await self.post("user_joined", "message")
+        frame = await read_frame(resp)
+
+        assert frame["event"] == "message"
+        event = json.loads(frame["data"])
+        assert event["id"] == int(frame["id"])
+        assert event["event_type"] == "message"
+        assert event["event_payload"] == "payload"
+        assert len(self.app[stream_hub_key]) == 1
+        resp.close()
+
+    @unittest_run_loop
+    async def test_resume_from_last_event_id(self):
+        """
+        Test that a reconnecting client gets the events it missed, then the
+        live ones, without duplicates.
+        """
+        await self.post("message", "message")
+        resp = await self.client.get(
+            "/events/stream", headers={"Last-Event-ID": "1"}
+        )
+        assert (await read_frame(resp))["id"] == "2"
+
+        await self.post("message")
+
+        assert (await read_frame(resp))["id"] == "3"
+        resp.close()
+
+    @unittest_run_loop
+    async def test_invalid_last_event_id(self):
+        """
+        Test that an invalid resume id is rejected.
+        """
+        resp = await self.client.get(
+            "/events/stream", headers={"Last-Event-ID": "abc"}
+        )
+        assert resp.status == 400
+        assert await resp.json() == {"error": "Invalid Last-Event-ID header"}
+
+
+def hub(slow_policy):
+    """
+    Create a StreamHub without storage.
+
+    :param slow_policy: The slow subscriber policy.
+    :return: The hub.
+    """
+    backend = MagicMock()
+    backend.shard_backends.return_value = []
+    return StreamHub(backend, queue_size=1, slow_policy=slow_policy)
+
+
+ROW = (1, "message", "payload", 0.0)
+
+
+@pytest.mark.asyncio
+async def test_event_encoded_once():
+    """
+    Test that matching subscribers share the encoded frame.
+    """
+    stream_hub = hub(SLOW_POLICY_DROP)
+    everything = await stream_hub.subscribe()
+    messages = await stream_hub.subscribe("message")
+    users = await stream_hub.subscribe("user")
+
+    stream_hub.publish([ROW])
+
+    assert everything.queue.get_nowait()[1] is messages.queue.get_nowait()[1]
+    assert users.queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_dropped():
+    """
+    Test that the drop policy skips events for a full subscriber.
+    """
+    stream_hub = hub(SLOW_POLICY_DROP)
+    subscriber = await stream_hub.subscribe()
+
+    stream_hub.publish([ROW, (2, "message", "payload", 0.0)])
+
+    assert subscriber.dropped == 1
+    assert subscriber.queue.get_nowait()[0] == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_disconnected():
+    """
+    Test that the disconnect policy ends the stream of a full subscriber.
+    """
+    stream_hub = hub(SLOW_POLICY_DISCONNECT)
+    subscriber = await stream_hub.subscribe()
+
+    stream_hub.publish([ROW, (2, "message", "payload", 0.0)])
+
+    assert subscriber.closed
+    assert subscriber.queue.get_nowait() is None
+
+
+def test_line_breaks_in_event_type_cannot_inject_fields():
+    """
+    Test that an event type with line breaks stays in one event field.
+    """
+    frame = encode_event((1, "x\ndata: injected\r\n\nid: 9", "p", 0.0))
+
+    lines = frame.decode().split("\n")
+    assert lines[:2] == ["id: 1", "event: x data: injected   id: 9"]
+    assert len(lines) == 5 and lines[3:] == ["", ""]
+    data = json.loads(lines[2].removeprefix("data: "))
+    assert data["event_type"] == "x\ndata: injected\r\n\nid: 9"
+
+
+def test_unknown_slow_policy():
+    """
+    Test that an unknown slow subscriber policy is refused.
+    """
+    with pytest.raises(ValueError):
+        hub("block")
+
+
+@pytest.mark.asyncio
+async def test_shards_of_other_workers_polled(tmp_path):
+    """
+    Test that events committed by another worker process are streamed.
+    """
+    path = str(tmp_path / "events.db")
+    await (await open_backend(path, shards=2)).close()
+    reader = await open_backend(path, shards=2, owned_shard=0)
+    writer = await open_backend(path, shards=2, owned_shard=1)
+    writer.start()
+    stream_hub = StreamHub(reader, poll_interval=0.01)
+    subscriber = await stream_hub.subscribe()
+
+    await writer.submit([("message", "payload", None)])
+    event_id, frame = await asyncio.wait_for(subscriber.queue.get(), 5)
+
+    assert event_id % 2 == 1
+    data = frame.split(b"data: ", 1)[1]
+    assert json.loads(data)["event_payload"] == "payload"
+    stream_hub.unsubscribe(subscriber)
+    await writer.stop()
+    await writer.close()
+    await reader.close()
@@ -0,0 +1,108 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+
+from consumer.workers import WorkerSupervisor
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(condition, timeout=10.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline
+        await asyncio.sleep(0.1)
+
+
+async def fetch_when_up(session, url, timeout=10.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            async with session.get(url) as resp:
+                return await resp.text()
+        except aiohttp.ClientConnectionError:
+            assert loop.time() < deadline
+            await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def test_workers_share_port_and_restart(tmp_path):
+    """
+    Test that workers serve the shared port, are restarted after a crash and
+    flush their shards on shutdown.
+    """
+    port = free_port()
+    metrics_port = free_port()
+    supervisor = WorkerSupervisor(
+        {"db_path": str(tmp_path / "events.db"), "metrics_port": metrics_port},
+        2,
+        "127.0.0.1",
+        port,
+        drain_timeout=5.0,
+        restart_delay=0.1,
+    )
+    await supervisor.setup()
+    url = f"http://127.0.0.1:{port}"
+    try:
+        crashed = supervisor.processes[0]
+        crashed.kill()
+        await wait_for(lambda: supervisor.processes[0] is not crashed)
+        await supervisor.wait_ready()
+
+        async with aiohttp.ClientSession() as session:
+            for i in range(20):
+                async with session.post(
+                    f"{url}/event",
+                    json=[{"event_type": "message", "event_payload": str(i)}],
+                ) as resp:
+                    assert resp.status == 200
+            async with session.get(f"{url}/events/counts") as resp:
+                assert await resp.json() == {"counts": {"message": 20}}
+            for index in range(2):
+                text = await fetch_when_up(
+                    session, f"http://localhost:{metrics_port + index}/metrics"
+                )
+                assert f'worker="{index}"' in text
+    finally:
+        await supervisor.cleanup()
+
+    assert sorted(path.name for path in tmp_path.glob("*.db")) == [
+        "events-0.db",
+        "events-1.db",
+    ]
+    assert supervisor.processes == [None, None]
+
+
+def test_workers_reject_other_shard_count(tmp_path):
+    """
+    Test that a configured shard count must match the workers.
+    """
+    with pytest.raises(ValueError, match="shards=3"):
+        WorkerSupervisor(
+            {"db_path": str(tmp_path / "events.db"), "shards": 3},
+            2,
+            "127.0.0.1",
+            free_port(),
+        )
+
+
+@pytest.mark.asyncio
+async def test_workers_refuse_unsharded_database(tmp_path):
+    """
+    Test that workers do not start over a database stored without shards.
+    """
+    (tmp_path / "events.db").touch()
+    supervisor = WorkerSupervisor(
+        {"db_path": str(tmp_path / "events.db")}, 2, "127.0.0.1", free_port()
+    )
+    with pytest.raises(ValueError, match="another shard layout"):
+        await supervisor.setup()
+    assert supervisor.processes == [None, None]
@@ -0,0 +1,107 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from consumer.writer import EventWriter
+
+
+@pytest.fixture
+def storage():
+    """
+    Fixture to create a mocked storage.
+    """
+    storage = MagicMock()
+    storage.insert = AsyncMock(return_value=set())
+    storage.last_insert = (1, 0.0)
+    storage.commit = AsyncMock()
+    storage.rollback = AsyncMock()
+    return storage
+
+
+@pytest.mark.asyncio
+async def test_group_bounded_by_event_count(storage):
+    """
+    Test that a commit group closes once it holds max_group_events events.
+    """
+    writer = EventWriter(storage, max_group_events=2, commit_interval_ms=1000)
+    futures = [writer.submit([("message", str(i))]) for i in range(3)]
+
+    writer.start()
+    await asyncio.gather(*futures)
+    await writer.stop()
+
+    assert storage.commit.call_count == 2
+    assert [len(call.args[0]) for call in storage.insert.call_args_list] == [
+        2,
+        1,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_queue_full(storage):
+    """
+    Test that submitting to a full queue raises QueueFull.
+    """
+    writer = EventWriter(storage, max_queue_size=1)
+    writer.submit([("message", "hello")], wait=False)
+
+    with pytest.raises(asyncio.QueueFull):
+        writer.submit([("message", "hello")], wait=False)
+
+
+@pytest.mark.asyncio
+async def test_configure_changes_queue_bound(storage):
+    """
+    Test that raising the queue bound wakes producers waiting for room.
+    """
+    writer = EventWriter(storage, max_queue_size=1)
+    writer.submit([("message", "hello")], wait=False)
+    put = asyncio.create_task(writer.put([("message", "hello")], wait=False))
+    await asyncio.sleep(0)
+    assert not put.done()
+
+    writer.configure(2, writer.max_group_events, 0)
+    await asyncio.wait_for(put, 1)
+
+    assert writer.queue.qsize() == 2
+    assert writer.full()
+    assert writer.commit_interval_ms == 0
+
+
+@pytest.mark.asyncio
+async def test_commit_failure_rejects_group(storage):
+    """
+    Test that a failed commit rolls back and fails every waiting batch.
+    """
+    storage.commit.side_effect = Exception("disk I/O error")
+    writer = EventWriter(storage)
+    futures = [writer.submit([("message", "hello")]) for _ in range(2)]
+
+    writer.start()
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    await writer.stop()
+
+    assert all(isinstance(result, Exception) for result in results)
+    storage.rollback.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_listeners_receive_stored_rows(storage):
+    """
+    Test that listeners get the stored rows of a commit with their ids.
+    """
+    storage.insert.return_value = {1}
+    storage.last_insert = (10, 123.0)
+    writer = EventWriter(storage)
+    received = []
+    writer.listeners.append(received.append)
+    future = writer.submit(
+        [("message", "a", None), ("message", "b", "dup"), ("user", "c", None)]
+    )
+
+    writer.start()
+    await future
+    await writer.stop()
+
+    assert received == [[(10, "message", "a", 123.0), (12, "user", "c", 123.0)]]